@@ -18,12 +18,38 @@ if 'bpy' in locals():
     importlib.reload(panels)
     importlib.reload(properties)
     importlib.reload(populate)
+    importlib.reload(planner)
+    importlib.reload(equivalence)
+    importlib.reload(evaluation)
+    importlib.reload(profiler)
+    importlib.reload(manifest)
+    importlib.reload(rig_cache)
+    importlib.reload(retarget)
+    importlib.reload(registry)
+    importlib.reload(geometry)
+    importlib.reload(mirror)
+    importlib.reload(cost)
+    importlib.reload(rigfile)
+    importlib.reload(fingerprint)
 else:
     import bpy
     from . import operators
     from . import panels
     from . import properties
     from . import populate
+    from . import planner
+    from . import equivalence
+    from . import evaluation
+    from . import profiler
+    from . import manifest
+    from . import rig_cache
+    from . import retarget
+    from . import registry
+    from . import geometry
+    from . import mirror
+    from . import cost
+    from . import rigfile
+    from . import fingerprint
 
 def register():
     operators.register()
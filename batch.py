@@ -0,0 +1,294 @@
+"""Headless batch rigging.
+
+Run from a shell (not from Blender) to rig many characters in parallel background Blender processes:
+
+    python batch.py characters/ --blender /path/to/blender --output-dir rigged/ --workers 8 --report report.json
+
+INPUT can be a directory (every .blend file in it), a .blend file, or a manifest: a .json list of paths or a text file
+with one path per line ('#' starts a comment). Every file is opened in its own Blender process, the Auto Rig template
+armature of the file is used (or the template is appended if there is none), populated and saved to the output
+directory, at its path relative to the folder common to all the inputs. The report has the timing and the error, if any, of every file.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+import concurrent.futures
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def import_addon():
+    """(BLENDER ONLY) Import and register the add-on from its folder, even if it is not installed"""
+    parent_dir = os.path.dirname(ADDON_DIR)
+    if parent_dir not in sys.path:
+        sys.path.insert(0, parent_dir)
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+    if not hasattr(bpy.types.Object, 'production_state'):
+        addon.register()
+    return addon
+
+def script_args():
+    """Arguments after '--' in a Blender command line"""
+    if '--' in sys.argv:
+        return sys.argv[sys.argv.index('--') + 1:]
+    return []
+
+# Controller side (plain Python)
+
+def collect_inputs(inputs):
+    """Expand directories and manifests into a list of .blend paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith('.blend'):
+                    paths.append(os.path.join(item, name))
+        elif item.lower().endswith('.blend'):
+            paths.append(item)
+        elif item.lower().endswith('.json'):
+            with open(item, 'r') as manifest:
+                base = os.path.dirname(item)
+                paths.extend(os.path.join(base, p) for p in json.load(manifest))
+        else:
+            with open(item, 'r') as manifest:
+                base = os.path.dirname(item)
+                for line in manifest:
+                    line = line.split('#')[0].strip()
+                    if line:
+                        paths.append(os.path.join(base, line))
+    return [os.path.abspath(p) for p in paths]
+
+def output_names(paths):
+    """Paths of the rigged files in the output directory: the input paths relative to their common folder, so that
+    files with the same name in different folders are kept apart. Raises ValueError if two inputs get the same path"""
+    if not paths:
+        return []
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    except ValueError:
+        # Inputs on different drives
+        root = None
+    names = [os.path.relpath(path, root) if root else os.path.basename(path) for path in paths]
+    seen = {}
+    for path, name in zip(paths, names):
+        key = os.path.normcase(name)
+        if key in seen:
+            raise ValueError("Both " + seen[key] + " and " + path + " would be saved as " + name)
+        seen[key] = path
+    return names
+
+def rig_file(blender, path, name, output_dir, spec, driver_mode, switch_mode, symmetry, lod, rig_path, snapshot_dir, reference_dir, cache_dir, cache_size, timeout):
+    """Rig one file in a background Blender process and return its report entry. name is its path in the output,
+    snapshot and reference directories (see output_names)"""
+    output = os.path.join(output_dir, name)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    result_path = output + '.result.json'
+    command = [
+        blender, '-b', '--factory-startup', path,
+        '--python', os.path.abspath(__file__),
+        '--', '--worker', '--output', output, '--result', result_path,
+    ]
+    if spec:
+        command += ['--spec', spec]
+    if driver_mode:
+        command += ['--driver-mode', driver_mode]
+    if switch_mode:
+        command += ['--switch-mode', switch_mode]
+    if symmetry:
+        command += ['--symmetry', symmetry]
+    if lod:
+        command += ['--lod', lod]
+    if rig_path:
+        command += ['--rig-file', os.path.abspath(rig_path)]
+    if snapshot_dir:
+        snapshot = os.path.join(snapshot_dir, name + '.json')
+        os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+        command += ['--snapshot', snapshot]
+    if reference_dir:
+        command += ['--reference', os.path.join(reference_dir, name + '.json')]
+    if cache_dir:
+        command += ['--cache-dir', cache_dir, '--cache-size', str(cache_size)]
+    entry = {'input': path, 'output': output, 'status': 'ERROR', 'error': None}
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, universal_newlines=True)
+        log = process.stdout
+    except subprocess.TimeoutExpired:
+        entry['error'] = "Timed out after " + str(timeout) + " s"
+        log = ""
+    except OSError as error:
+        entry['error'] = str(error)
+        log = ""
+    entry['seconds'] = time.perf_counter() - start
+    if os.path.exists(result_path):
+        with open(result_path, 'r') as result_file:
+            entry.update(json.load(result_file))
+        os.remove(result_path)
+    elif not entry['error']:
+        entry['error'] = "Blender exited without result:\n" + log[-2000:]
+    return entry
+
+def run_batch(args):
+    paths = collect_inputs(args.inputs)
+    try:
+        names = output_names(paths)
+    except ValueError as error:
+        print(error)
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.snapshot_dir:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    entries = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(rig_file, args.blender, path, name, args.output_dir, args.spec, args.driver_mode, args.switch_mode, args.symmetry, args.lod, args.rig_file, args.snapshot_dir, args.reference_dir, args.cache_dir, args.cache_size, args.timeout) for path, name in zip(paths, names)]
+        for future in concurrent.futures.as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            print(entry['status'], "%.2fs" % entry['seconds'], entry['input'], entry['error'] or "")
+    entries.sort(key=lambda e: e['input'])
+    report = {
+        'workers': workers,
+        'files': len(entries),
+        'failed': len([e for e in entries if e['status'] != 'OK']),
+        'total_seconds': time.perf_counter() - start,
+        'results': entries,
+    }
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+    print("Rigged", report['files'] - report['failed'], "of", report['files'], "files in %.2fs" % report['total_seconds'])
+    return 1 if report['failed'] else 0
+
+# Worker side (inside Blender)
+
+def find_template_armature(scene):
+    """Auto Rig armature of the scene that is not populated yet"""
+    if scene.armature_ob and scene.armature_ob.production_state in {'TEMPLATE', 'BASIC_EDITION'}:
+        return scene.armature_ob
+    for ob in scene.objects:
+        if ob.type == 'ARMATURE' and ob.production_state in {'TEMPLATE', 'BASIC_EDITION'}:
+            return ob
+    return None
+
+def run_worker(args):
+    result = {'status': 'ERROR', 'error': None, 'timings': {}}
+    try:
+        addon = import_addon()
+        scene = bpy.context.scene
+        start = time.perf_counter()
+        armature = find_template_armature(scene)
+        if armature is None:
+            armature = addon.operators.append_source_armature(scene)
+        if armature is None:
+            raise RuntimeError("No Auto Rig template armature")
+        scene.armature_ob = armature
+        result['armature'] = armature.name
+        result['timings']['append'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if args.rig_file:
+            # A known rig is rebuilt from its rig file, without populate
+            addon.rigfile.import_rig(armature, args.rig_file)
+            result['cached'] = False
+        else:
+            options = addon.planner.build_options(scene)
+            if args.driver_mode:
+                options['use_constraints'] = args.driver_mode == 'CONSTRAINTS'
+            if args.switch_mode:
+                options['use_consolidated_switch'] = args.switch_mode == 'CONSOLIDATED'
+            if args.symmetry:
+                options['use_symmetry'] = args.symmetry == 'ON'
+            if args.lod:
+                options['lod'] = args.lod
+            spec = addon.planner.armature_spec(args.spec or addon.planner.spec_path(scene), armature, options)
+            plan = addon.planner.compile_plan(spec)
+            cached_armature = None
+            if args.cache_dir:
+                key = addon.rig_cache.rig_key(armature, spec, options)
+                cached_armature = addon.rig_cache.load_cached_rig(armature, args.cache_dir, key)
+            result['cached'] = cached_armature is not None
+            armature = cached_armature or armature
+            if cached_armature is None:
+                addon.planner.execute_plan(armature, plan, options)
+                if bpy.context.mode != 'OBJECT':
+                    bpy.ops.object.mode_set(mode='OBJECT')
+                if args.cache_dir:
+                    addon.rig_cache.store_rig(armature, args.cache_dir, key, args.cache_size * 1024 * 1024)
+        result['timings']['populate'] = time.perf_counter() - start
+
+        # Structural check of the rig against a reference snapshot
+        start = time.perf_counter()
+        snapshot = addon.fingerprint.rig_snapshot(armature)
+        result['fingerprint'] = snapshot['fingerprint']
+        if args.snapshot:
+            addon.fingerprint.save_snapshot(snapshot, args.snapshot)
+        diff = None
+        if args.reference:
+            diff = addon.fingerprint.diff_snapshots(addon.fingerprint.load_snapshot(args.reference), snapshot)
+            result['diff'] = diff
+        result['timings']['fingerprint'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bpy.ops.wm.save_as_mainfile(filepath=args.output)
+        result['timings']['save'] = time.perf_counter() - start
+        if diff and not addon.fingerprint.is_identical(diff):
+            result['status'] = 'DIFF'
+            result['error'] = addon.fingerprint.diff_report(diff, 10)
+        else:
+            result['status'] = 'OK'
+    except Exception as error:
+        result['error'] = type(error).__name__ + ": " + str(error)
+    with open(args.result, 'w') as result_file:
+        json.dump(result, result_file)
+
+def main():
+    in_blender = bpy is not None
+    parser = argparse.ArgumentParser(description="Rig .blend files with Auto Rig in background Blender processes")
+    if in_blender:
+        parser.add_argument('--worker', action='store_true')
+        parser.add_argument('--output', required=True)
+        parser.add_argument('--result', required=True)
+        parser.add_argument('--spec', default=None)
+        parser.add_argument('--driver-mode', default=None)
+        parser.add_argument('--switch-mode', default=None)
+        parser.add_argument('--symmetry', default=None)
+        parser.add_argument('--lod', default=None)
+        parser.add_argument('--rig-file', default=None)
+        parser.add_argument('--snapshot', default=None)
+        parser.add_argument('--reference', default=None)
+        parser.add_argument('--cache-dir', default=None)
+        parser.add_argument('--cache-size', type=int, default=1024)
+        args = parser.parse_args(script_args())
+        run_worker(args)
+        return 0
+    parser.add_argument('inputs', nargs='+', help="directories, .blend files or manifests")
+    parser.add_argument('--blender', default='blender', help="Blender executable")
+    parser.add_argument('--output-dir', required=True, help="directory for the rigged files")
+    parser.add_argument('--workers', type=int, default=0, help="parallel Blender processes (number of cores by default)")
+    parser.add_argument('--report', default=None, help="JSON report path")
+    parser.add_argument('--spec', default=None, help="rig specification (humanoid by default)")
+    parser.add_argument('--driver-mode', choices=['DRIVERS', 'CONSTRAINTS'], default=None, help="finger/torsion build mode (scene setting by default)")
+    parser.add_argument('--switch-mode', choices=['DRIVERS', 'CONSOLIDATED'], default=None, help="FK-IK switch build mode (scene setting by default)")
+    parser.add_argument('--symmetry', choices=['ON', 'OFF'], default=None, help="mirror left side modules to the right (scene setting by default)")
+    parser.add_argument('--lod', choices=['FULL', 'MEDIUM', 'PROXY'], default=None, help="rig level of detail (scene setting by default)")
+    parser.add_argument('--rig-file', default=None, help="rig file (see rigfile.py) imported instead of populating")
+    parser.add_argument('--snapshot-dir', default=None, help="directory where the rig snapshot of every file is written (see fingerprint.py)")
+    parser.add_argument('--reference-dir', default=None, help="directory of reference snapshots: files whose rig differs fail with status DIFF")
+    parser.add_argument('--cache-dir', default=None, help="directory of populated rigs reused for identical proportions")
+    parser.add_argument('--cache-size', type=int, default=1024, help="cache size limit in MB")
+    parser.add_argument('--timeout', type=float, default=3600.0, help="seconds allowed per file")
+    return run_batch(parser.parse_args())
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Rig playback benchmark.
+
+Run from a shell to measure how fast a populated rig evaluates:
+
+    python benchmark.py --blender /path/to/blender --output results.json [--baseline previous.json]
+
+A background Blender process appends the template armature from 'source armature.blend', populates it, keys a
+reproducible random animation on the control bones (once in FK mode, once in IK mode) and steps through the frames.
+The JSON results have the frames per second, the frame latency percentiles, the peak memory and the rig counts. With
+--baseline, the run fails when the FPS of a mode dropped more than --max-regression percent. With --costs, the results
+also have what every constraint and driver group of every rig module costs per frame (see cost.py).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ADDON_DIR)
+from batch import import_addon, script_args
+
+MODES = (('FK', 0.0), ('IK', 1.0))
+
+# Controller side (plain Python)
+
+def run_blender(args):
+    """Run the benchmark in a background Blender process and return its results"""
+    command = [
+        args.blender, '-b', '--factory-startup',
+        '--python', os.path.abspath(__file__),
+        '--', '--worker', '--output', args.output,
+        '--frames', str(args.frames), '--warmup', str(args.warmup), '--seed', str(args.seed),
+    ]
+    if args.spec:
+        command += ['--spec', args.spec]
+    if args.driver_mode:
+        command += ['--driver-mode', args.driver_mode]
+    if args.lod:
+        command += ['--lod', args.lod]
+    if args.costs:
+        command += ['--costs']
+    if os.path.exists(args.output):
+        os.remove(args.output)
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if not os.path.exists(args.output):
+        print(process.stdout[-2000:])
+        return None
+    with open(args.output, 'r') as results_file:
+        return json.load(results_file)
+
+def compare_results(results, baseline, max_regression):
+    """Print the FPS change of every mode. Returns the modes that got slower than allowed"""
+    regressions = []
+    for mode, stats in results['modes'].items():
+        previous = baseline.get('modes', {}).get(mode)
+        if not previous or not previous['fps']:
+            continue
+        change = 100.0 * (stats['fps'] - previous['fps']) / previous['fps']
+        print(mode, "%.1f fps (baseline %.1f, %+.1f%%)" % (stats['fps'], previous['fps'], change))
+        if change < -max_regression:
+            regressions.append(mode)
+    return regressions
+
+def run_controller(args):
+    results = run_blender(args)
+    if results is None or results.get('error'):
+        print("Benchmark failed:", results and results['error'])
+        return 1
+    for mode, stats in results['modes'].items():
+        print(mode, "%.1f fps, p50 %.2f ms, p99 %.2f ms" % (stats['fps'], stats['p50_ms'], stats['p99_ms']))
+    for mode, costs in results.get('costs', {}).items():
+        print(mode, "costs:")
+        for row in costs['groups']:
+            print("  %-20s %-20s %8.3f ms" % (row['module'], row['group'], row['ms']))
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print("Regression in", ", ".join(regressions))
+            return 1
+    return 0
+
+# Worker side (inside Blender)
+
+def run_worker(args):
+    results = {'error': None, 'modes': {}}
+    try:
+        addon = import_addon()
+        scene = bpy.context.scene
+        start = time.perf_counter()
+        armature = addon.operators.append_source_armature(scene)
+        if armature is None:
+            raise RuntimeError("No Auto Rig template armature")
+        options = dict(addon.planner.DEFAULT_OPTIONS)
+        options['use_constraints'] = args.driver_mode == 'CONSTRAINTS'
+        options['lod'] = args.lod or 'FULL'
+        spec = addon.planner.armature_spec(args.spec or addon.planner.DEFAULT_SPEC_PATH, armature, options)
+        addon.planner.execute_plan(armature, addon.planner.compile_plan(spec), options)
+        if bpy.context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        results['populate_seconds'] = time.perf_counter() - start
+        results['rig'] = addon.evaluation.rig_counts(armature)
+        results['driver_mode'] = args.driver_mode or 'DRIVERS'
+        results['lod'] = options['lod']
+        results['blender'] = bpy.app.version_string
+
+        frame_start, frame_end = 1, args.frames
+        scene.frame_start, scene.frame_end = frame_start, frame_end
+        for mode, ik_value in MODES:
+            keys = addon.evaluation.animate_controls(armature, frame_start, frame_end, ik_value, args.seed)
+            frame_times = addon.evaluation.time_playback(scene, frame_start, frame_end, args.warmup)
+            results['modes'][mode] = addon.evaluation.frame_stats(frame_times)
+            results['modes'][mode]['keys'] = keys
+            if args.costs:
+                results.setdefault('costs', {})[mode] = addon.cost.analyze_costs(scene, armature, args.frames, args.warmup)
+        addon.evaluation.clear_animation(armature)
+        results['peak_memory_mb'] = addon.evaluation.peak_memory_mb()
+    except Exception as error:
+        results['error'] = type(error).__name__ + ": " + str(error)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the playback speed of a populated Auto Rig armature")
+    parser.add_argument('--output', required=True, help="JSON results path")
+    parser.add_argument('--frames', type=int, default=250, help="frames per mode")
+    parser.add_argument('--warmup', type=int, default=1, help="playback passes before measuring")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the control animation")
+    parser.add_argument('--spec', default=None, help="rig specification (humanoid by default)")
+    parser.add_argument('--driver-mode', choices=['DRIVERS', 'CONSTRAINTS'], default=None)
+    parser.add_argument('--lod', choices=['FULL', 'MEDIUM', 'PROXY'], default=None, help="rig level of detail (full by default)")
+    parser.add_argument('--costs', action='store_true', help="also measure the cost of every constraint and driver group")
+    if bpy is not None:
+        parser.add_argument('--worker', action='store_true')
+        run_worker(parser.parse_args(script_args()))
+        return 0
+    parser.add_argument('--blender', default='blender', help="Blender executable")
+    parser.add_argument('--baseline', default=None, help="previous results to compare with")
+    parser.add_argument('--max-regression', type=float, default=5.0, help="FPS drop (percent) that fails the run")
+    return run_controller(parser.parse_args())
+
+if __name__ == '__main__':
+    sys.exit(main())
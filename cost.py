@@ -0,0 +1,120 @@
+import bpy
+import contextlib
+from . import manifest
+from . import evaluation
+
+# Evaluation cost of the features of a populated rig. The scene is played back as it is, then once per feature group
+# with the group muted: the bone constraints of one type, the drivers, or the spline constraints and modifiers of one
+# rig module (from the build manifest). The cost of a group is the frame time saved by muting it. Python has no per
+# node depsgraph timings, so muting is the measure. Groups share work (a muted IK chain also speeds up the constraints
+# that follow it), so the costs don't add up exactly to the frame time.
+
+# Module of the features that are not in the build manifest (armatures populated without one)
+UNKNOWN_MODULE = 'armature'
+
+def feature_groups(armature):
+    """Bone constraints, drivers and spline constraints and modifiers of an armature grouped by rig module and type:
+    {(module, group): [constraints, driver F-curves or modifiers]}"""
+    owners = {}
+    objects = set()
+    build_manifest = manifest.read_manifest(armature)
+    if build_manifest:
+        for module_name, entry in build_manifest['modules'].items():
+            for bone_name, constraint_name in entry['constraints']:
+                owners[('BONE', bone_name, constraint_name)] = module_name
+            for owner, data_path, index in entry['drivers']:
+                owners[('DRIVER', owner, data_path, index)] = module_name
+            for object_name, kind, item_name in entry['objects']:
+                owners[(kind, object_name, item_name)] = module_name
+                objects.add(object_name)
+    groups = {}
+    def add(key, group, item):
+        groups.setdefault((owners.get(key, UNKNOWN_MODULE), group), []).append(item)
+
+    for pose_bone in armature.pose.bones:
+        for c in pose_bone.constraints:
+            add(('BONE', pose_bone.name, c.name), c.type, c)
+    for owner, id_data in (('OBJECT', armature), ('DATA', armature.data)):
+        if id_data.animation_data:
+            for fcurve in id_data.animation_data.drivers:
+                add(('DRIVER', owner, fcurve.data_path, fcurve.array_index), 'DRIVERS', fcurve)
+    # Only the objects populate changed (splines), not the meshes of the character
+    for object_name in sorted(objects):
+        ob = bpy.data.objects.get(object_name)
+        if ob is None:
+            continue
+        for c in ob.constraints:
+            add(('CONSTRAINT', ob.name, c.name), 'OBJECT_' + c.type, c)
+        for m in ob.modifiers:
+            add(('MODIFIER', ob.name, m.name), m.type, m)
+    return groups
+
+@contextlib.contextmanager
+def muted(items):
+    """Mute constraints, drivers and modifiers inside the with block"""
+    states = []
+    try:
+        for item in items:
+            if isinstance(item, bpy.types.Modifier):
+                states.append((item, 'show_viewport', item.show_viewport))
+                item.show_viewport = False
+            else:
+                states.append((item, 'mute', item.mute))
+                item.mute = True
+        yield
+    finally:
+        for item, attribute, value in reversed(states):
+            setattr(item, attribute, value)
+
+def _frame_ms(scene, frame_start, frame_end, warmup):
+    frame_times = evaluation.time_playback(scene, frame_start, frame_end, warmup)
+    return 1000.0 * sum(frame_times) / len(frame_times)
+
+def analyze_costs(scene, armature, frames, warmup=1, ik_value=1.0, seed=0):
+    """Mean frame time of the scene and what every feature group of the armature costs, ranked. An armature without
+    animation gets the benchmark animation of its controls (see evaluation.py) for the time of the analysis"""
+    frame_start = scene.frame_start
+    frame_end = frame_start + frames - 1
+    current_frame = scene.frame_current
+    keyed = not (armature.animation_data and armature.animation_data.action)
+    if keyed:
+        evaluation.animate_controls(armature, frame_start, frame_end, ik_value, seed)
+    try:
+        frame_ms = _frame_ms(scene, frame_start, frame_end, warmup)
+        rows = []
+        for (module_name, group), items in sorted(feature_groups(armature).items()):
+            with muted(items):
+                muted_ms = _frame_ms(scene, frame_start, frame_end, warmup)
+            rows.append({
+                'module': module_name,
+                'group': group,
+                'count': len(items),
+                'ms': frame_ms - muted_ms,
+                'percent': 100.0 * (frame_ms - muted_ms) / frame_ms if frame_ms else 0.0,
+            })
+    finally:
+        if keyed:
+            evaluation.clear_animation(armature)
+        scene.frame_set(current_frame)
+    rows.sort(key=lambda row: row['ms'], reverse=True)
+    modules = {}
+    for row in rows:
+        modules[row['module']] = modules.get(row['module'], 0.0) + row['ms']
+    return {
+        'frames': frames,
+        'frame_ms': frame_ms,
+        'modules': sorted(([name, ms] for name, ms in modules.items()), key=lambda item: item[1], reverse=True),
+        'groups': rows,
+    }
+
+def cost_report(costs):
+    """Text report of an analysis: the modules ranked by cost, each with its groups ranked"""
+    lines = ["Mean frame time %.3f ms (%d frames)" % (costs['frame_ms'], costs['frames'])]
+    lines.append("%-40s %6s %10s %8s" % ('', 'count', 'ms/frame', '%'))
+    for module_name, module_ms in costs['modules']:
+        lines.append("%-40s %6s %10.3f %8.1f" % (module_name[:40], '', module_ms,
+            100.0 * module_ms / costs['frame_ms'] if costs['frame_ms'] else 0.0))
+        for row in costs['groups']:
+            if row['module'] == module_name:
+                lines.append("%-40s %6d %10.3f %8.1f" % (("  " + row['group'])[:40], row['count'], row['ms'], row['percent']))
+    return "\n".join(lines)
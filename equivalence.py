@@ -0,0 +1,77 @@
+import bpy
+import random
+from . import registry
+
+# Check that two populated armatures deform the same way: both are posed with the same random control values and the
+# final bone matrices are compared. Used to validate the constraint build mode against the driver build mode.
+
+ROTATION_RANGE = 0.6 # Radians
+LOCATION_RANGE = 0.05
+SCALE_RANGE = 0.3
+
+def control_bone_names(armature):
+    """Names of the control (HDL) bones of an armature, sorted"""
+    return sorted(registry.bone_registry(armature).query(role='HDL'))
+
+def random_channels(pose_bone, generator):
+    """Give the unlocked location, rotation and scale channels of a pose bone random values drawn from generator.
+    Returns the (data path, index) of the channels that changed, index -1 for the whole quaternion"""
+    channels = []
+    use_quaternion = pose_bone.rotation_mode == 'QUATERNION'
+    for i in range(3):
+        value = generator.uniform(-1.0, 1.0)
+        if not pose_bone.lock_location[i]:
+            pose_bone.location[i] = value * LOCATION_RANGE
+            channels.append(('location', i))
+        if not pose_bone.lock_rotation[i]:
+            pose_bone.rotation_euler[i] = value * ROTATION_RANGE
+            if not use_quaternion:
+                channels.append(('rotation_euler', i))
+        if not pose_bone.lock_scale[i]:
+            pose_bone.scale[i] = 1.0 + value * SCALE_RANGE
+            channels.append(('scale', i))
+    if use_quaternion:
+        pose_bone.rotation_quaternion = pose_bone.rotation_euler.to_quaternion()
+        channels.append(('rotation_quaternion', -1))
+    return channels
+
+def random_pose(armature, bone_names, seed):
+    """Give random values to the unlocked channels of the bones. Returns the previous values to restore them"""
+    generator = random.Random(seed)
+    previous = {}
+    for name in bone_names:
+        pose_bone = armature.pose.bones[name]
+        previous[name] = (pose_bone.location.copy(), pose_bone.rotation_euler.copy(), pose_bone.rotation_quaternion.copy(), pose_bone.scale.copy())
+        random_channels(pose_bone, generator)
+    return previous
+
+def restore_pose(armature, previous):
+    """Put back the channel values returned by random_pose"""
+    for name, (location, rotation_euler, rotation_quaternion, scale) in previous.items():
+        pose_bone = armature.pose.bones[name]
+        pose_bone.location = location
+        pose_bone.rotation_euler = rotation_euler
+        pose_bone.rotation_quaternion = rotation_quaternion
+        pose_bone.scale = scale
+
+def compare_armatures(armature_a, armature_b, samples=8, seed=0):
+    """Pose both armatures the same way several times. Returns (largest matrix difference, bone where it was found)"""
+    shared_names = [bone.name for bone in armature_a.pose.bones if bone.name in armature_b.pose.bones]
+    control_names = [name for name in control_bone_names(armature_a) if name in armature_b.pose.bones]
+    worst_error = 0.0
+    worst_bone = None
+    for sample in range(samples):
+        previous_a = random_pose(armature_a, control_names, seed + sample)
+        previous_b = random_pose(armature_b, control_names, seed + sample)
+        bpy.context.view_layer.update()
+        for name in shared_names:
+            matrix_a = armature_a.pose.bones[name].matrix
+            matrix_b = armature_b.pose.bones[name].matrix
+            error = max(abs(matrix_a[row][column] - matrix_b[row][column]) for row in range(4) for column in range(4))
+            if error > worst_error:
+                worst_error = error
+                worst_bone = name
+        restore_pose(armature_a, previous_a)
+        restore_pose(armature_b, previous_b)
+    bpy.context.view_layer.update()
+    return worst_error, worst_bone
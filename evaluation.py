@@ -0,0 +1,98 @@
+import bpy
+import sys
+import math
+import time
+import random
+
+try:
+    import resource
+except ImportError:
+    resource = None
+from . import populate
+from .equivalence import control_bone_names, random_channels
+
+# Deterministic animation of the rig controls and playback timing, used to measure how fast a populated rig evaluates
+
+FK_IK_PROPERTIES = ('fk_ik_left_arm', 'fk_ik_right_arm', 'fk_ik_left_leg', 'fk_ik_right_leg')
+ACTION_NAME = 'Benchmark'
+KEY_STEP = 5 # Frames between two keyframes
+
+def animate_controls(armature, frame_start, frame_end, ik_value, seed=0):
+    """Key every unlocked channel of the control bones with reproducible random values. Returns the number of keys"""
+    clear_animation(armature)
+    generator = random.Random(seed)
+    armature.animation_data_create()
+    armature.animation_data.action = bpy.data.actions.new(ACTION_NAME)
+    keys = 0
+    for name in FK_IK_PROPERTIES:
+        setattr(armature, name, ik_value)
+        armature.keyframe_insert(name, frame=frame_start)
+        keys += 1
+    for name in control_bone_names(armature):
+        pose_bone = armature.pose.bones[name]
+        for frame in range(frame_start, frame_end + 1, KEY_STEP):
+            for data_path, index in random_channels(pose_bone, generator):
+                pose_bone.keyframe_insert(data_path, index=index, frame=frame, group=name)
+                keys += 4 if index == -1 else 1
+    return keys
+
+def clear_animation(armature):
+    """Remove the benchmark action (drivers are kept)"""
+    if armature.animation_data and armature.animation_data.action:
+        action = armature.animation_data.action
+        armature.animation_data.action = None
+        if action.name.startswith(ACTION_NAME) and action.users == 0:
+            bpy.data.actions.remove(action)
+    for pose_bone in armature.pose.bones:
+        pose_bone.location = (0, 0, 0)
+        pose_bone.rotation_euler = (0, 0, 0)
+        pose_bone.rotation_quaternion = (1, 0, 0, 0)
+        pose_bone.scale = (1, 1, 1)
+
+def time_playback(scene, frame_start, frame_end, warmup=1):
+    """Step through the frames and return the time taken by every frame (warmup passes are not measured)"""
+    for _ in range(warmup):
+        for frame in range(frame_start, frame_end + 1):
+            scene.frame_set(frame)
+    frame_times = []
+    for frame in range(frame_start, frame_end + 1):
+        start = time.perf_counter()
+        scene.frame_set(frame)
+        frame_times.append(time.perf_counter() - start)
+    return frame_times
+
+def percentile(values, fraction):
+    """Value below which a fraction of the sorted values fall (nearest rank)"""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[rank]
+
+def frame_stats(frame_times):
+    """Frames per second and latency percentiles (milliseconds) of a list of frame times"""
+    total = sum(frame_times)
+    return {
+        'frames': len(frame_times),
+        'fps': len(frame_times) / total if total else 0.0,
+        'mean_ms': 1000.0 * total / len(frame_times),
+        'p50_ms': 1000.0 * percentile(frame_times, 0.5),
+        'p90_ms': 1000.0 * percentile(frame_times, 0.9),
+        'p99_ms': 1000.0 * percentile(frame_times, 0.99),
+        'max_ms': 1000.0 * max(frame_times),
+    }
+
+def peak_memory_mb():
+    """Peak resident memory of the process in MB (None where it can't be read)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # Bytes on macOS, kilobytes elsewhere
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+def rig_counts(armature):
+    """Number of bones, constraints and drivers of a rig"""
+    return {
+        'bones': len(armature.pose.bones),
+        'constraints': sum(len(pose_bone.constraints) for pose_bone in armature.pose.bones),
+        'drivers': populate.driver_count(armature),
+    }
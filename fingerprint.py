@@ -0,0 +1,138 @@
+import json
+import hashlib
+from . import geometry
+from . import rigfile
+
+# Structural snapshots, fingerprints and diffs of rigs, to check that two build paths make the same rig. A snapshot
+# has every bone (rest geometry in armature space, hierarchy, layers and settings, pose settings), bone constraint
+# (all editable settings) and driver of an armature, as JSON. Names of the armature itself are replaced with
+# ARMATURE_NAME, so rigs on different objects compare equal. Every item has a fingerprint (a hash of its values with
+# floats rounded to FINGERPRINT_DIGITS), and diffs only compare in detail the items whose fingerprints differ.
+
+SNAPSHOT_VERSION = 1
+FINGERPRINT_DIGITS = 4
+ARMATURE_NAME = '<armature>'
+ITEM_KINDS = ('bones', 'constraints', 'drivers')
+# Constraint settings that only change the interface
+INTERFACE_SETTINGS = ('active', 'show_expanded')
+
+def _named(value, names):
+    """Value with the names of the armature and its data replaced"""
+    if isinstance(value, str):
+        return ARMATURE_NAME if value in names else value
+    if isinstance(value, list):
+        return [_named(item, names) for item in value]
+    if isinstance(value, dict):
+        return {key: _named(item, names) for key, item in value.items()}
+    return value
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, FINGERPRINT_DIGITS) + 0.0 # No -0.0
+    if isinstance(value, list):
+        return [_rounded(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    return value
+
+def item_fingerprint(item):
+    """Hash of the values of a snapshot item"""
+    return hashlib.sha1(json.dumps(_rounded(item), sort_keys=True).encode()).hexdigest()
+
+def rig_snapshot(armature):
+    """Snapshot of an armature with the fingerprint of every item and of the whole rig (REQUIRES OBJECT OR POSE MODE)"""
+    geometry.require_numpy("Rig snapshots")
+    names = {armature.name, armature.data.name}
+    bones = armature.data.bones
+    heads, tails, rotations = geometry.read_frames(bones, 'matrix_local')
+    snapshot = {'version': SNAPSHOT_VERSION, 'bones': {}, 'constraints': {}, 'drivers': {}}
+    for idx, bone in enumerate(bones):
+        pose_bone = armature.pose.bones[bone.name]
+        item = {
+            'head': heads[idx].tolist(),
+            'tail': tails[idx].tolist(),
+            'rotation': rotations[idx].tolist(),
+            'parent': bone.parent.name if bone.parent else None,
+            'layers': list(bone.layers),
+            'custom_shape': pose_bone.custom_shape.name if pose_bone.custom_shape else None,
+            'bone_group': pose_bone.bone_group.name if pose_bone.bone_group else None,
+        }
+        for attribute in rigfile.BONE_SETTINGS:
+            item[attribute] = rigfile.plain_value(getattr(bone, attribute))
+        for attribute in rigfile.POSE_SETTINGS:
+            item[attribute] = rigfile.plain_value(getattr(pose_bone, attribute))
+        snapshot['bones'][bone.name] = item
+        for c in pose_bone.constraints:
+            values = rigfile.rna_values(c)
+            for attribute in INTERFACE_SETTINGS:
+                values.pop(attribute, None)
+            values['type'] = c.type
+            values['index'] = pose_bone.constraints.find(c.name)
+            snapshot['constraints'][bone.name + "/" + c.name] = _named(values, names)
+    for owner, id_data in (('OBJECT', armature), ('DATA', armature.data)):
+        for driver in rigfile.driver_values(id_data, owner):
+            snapshot['drivers']["%s:%s[%d]" % (owner, driver['data_path'], driver['index'])] = _named(driver, names)
+    snapshot['fingerprints'] = {kind: {key: item_fingerprint(item) for key, item in snapshot[kind].items()} for kind in ITEM_KINDS}
+    snapshot['fingerprint'] = hashlib.sha1(json.dumps(snapshot['fingerprints'], sort_keys=True).encode()).hexdigest()
+    return snapshot
+
+def save_snapshot(snapshot, path):
+    with open(path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file, indent=1, sort_keys=True)
+
+def load_snapshot(path):
+    with open(path, 'r') as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported rig snapshot version " + str(snapshot.get('version')))
+    return snapshot
+
+def _close(a, b, tolerance):
+    """True if two values are equal, floats within tolerance"""
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool) and not isinstance(b, bool):
+        return abs(a - b) <= tolerance
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_close(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_close(a[key], b[key], tolerance) for key in a)
+    return a == b
+
+def diff_snapshots(a, b, tolerance=1e-4):
+    """Items removed from snapshot a, added in snapshot b and changed (with the values that differ by more than
+    tolerance): {'removed': [[kind, key]], 'added': [[kind, key]], 'changed': [[kind, key, [fields]]]}"""
+    # Rounded values that are equal differ by less than 10^-FINGERPRINT_DIGITS
+    trust_fingerprints = tolerance >= 10.0 ** -FINGERPRINT_DIGITS
+    diff = {'removed': [], 'added': [], 'changed': []}
+    for kind in ITEM_KINDS:
+        items_a, items_b = a[kind], b[kind]
+        fingerprints_a, fingerprints_b = a['fingerprints'][kind], b['fingerprints'][kind]
+        diff['removed'] += [[kind, key] for key in sorted(items_a.keys() - items_b.keys())]
+        diff['added'] += [[kind, key] for key in sorted(items_b.keys() - items_a.keys())]
+        for key in sorted(items_a.keys() & items_b.keys()):
+            if trust_fingerprints and fingerprints_a[key] == fingerprints_b[key]:
+                continue
+            item_a, item_b = items_a[key], items_b[key]
+            fields = [field for field in sorted(item_a.keys() | item_b.keys()) if not _close(item_a.get(field), item_b.get(field), tolerance)]
+            if fields:
+                diff['changed'].append([kind, key, fields])
+    return diff
+
+def diff_rigs(armature_a, armature_b, tolerance=1e-4):
+    """Diff of two armatures (see diff_snapshots)"""
+    return diff_snapshots(rig_snapshot(armature_a), rig_snapshot(armature_b), tolerance)
+
+def is_identical(diff):
+    return not (diff['removed'] or diff['added'] or diff['changed'])
+
+def diff_report(diff, limit=50):
+    """Text report of a diff (at most limit lines per category)"""
+    lines = ["%d removed, %d added, %d changed" % (len(diff['removed']), len(diff['added']), len(diff['changed']))]
+    for category in ('removed', 'added', 'changed'):
+        for entry in diff[category][:limit]:
+            line = "%-8s %-12s %s" % (category, entry[0], entry[1])
+            if category == 'changed':
+                line += ": " + ", ".join(entry[2])
+            lines.append(line)
+        if len(diff[category]) > limit:
+            lines.append("%-8s ... %d more" % (category, len(diff[category]) - limit))
+    return "\n".join(lines)
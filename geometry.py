@@ -0,0 +1,157 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Vectorized bone geometry. Bone frames are NumPy arrays: heads (n, 3), tails (n, 3) and rotations (n, 3, 3) whose
+# columns are the bone X, Y and Z axes, in armature space. Anchors are the ones of the build manifest (see manifest.py).
+# Nothing here uses bpy, so the geometry can be checked outside of Blender. The add-on loads without NumPy: what
+# needs these functions checks require_numpy first, or has a fallback.
+
+def require_numpy(feature):
+    """Raise ValueError when NumPy is missing"""
+    if numpy is None:
+        raise ValueError(feature + " needs NumPy, which is not installed in this Python")
+
+def normalized(vectors):
+    """Unit vectors (zero vectors stay zero)"""
+    lengths = numpy.linalg.norm(vectors, axis=-1, keepdims=True)
+    return numpy.divide(vectors, lengths, out=numpy.zeros_like(vectors), where=lengths > 0.0)
+
+def frames_from_axes(heads, tails, z_axes):
+    """Rotations with the Y axis from head to tail and the Z axis as close as possible to z_axes"""
+    y_axes = normalized(tails - heads)
+    x_axes = normalized(numpy.cross(y_axes, z_axes))
+    return numpy.stack((x_axes, y_axes, numpy.cross(x_axes, y_axes)), axis=-1)
+
+def transform_points(matrix, points):
+    """Points (n, 3) transformed by a 4x4 matrix"""
+    return numpy.asarray(points, dtype=float) @ matrix[:3, :3].T + matrix[:3, 3]
+
+def bone_rolls(heads, tails, z_axes):
+    """Rolls giving bones from heads to tails the Z axis closest to z_axes, as EditBone.align_roll does. The roll turns
+    the frame Blender builds for a bone at roll 0 around its Y axis"""
+    y_axes = normalized(tails - heads)
+    x, y, z = y_axes[:, 0], y_axes[:, 1], y_axes[:, 2]
+    theta = 1.0 + y
+    # Bones pointing to -Y have the world -X and +Z axes at roll 0
+    flipped = theta < 1e-5
+    theta = numpy.where(flipped, 1.0, theta)
+    x_axes = numpy.stack((1.0 - x * x / theta, -x, -x * z / theta), axis=-1)
+    zero_z_axes = numpy.stack((-x * z / theta, -z, 1.0 - z * z / theta), axis=-1)
+    x_axes[flipped] = (-1.0, 0.0, 0.0)
+    zero_z_axes[flipped] = (0.0, 0.0, 1.0)
+    z_axes = numpy.asarray(z_axes, dtype=float)
+    return numpy.arctan2(numpy.einsum('ni,ni->n', z_axes, x_axes), numpy.einsum('ni,ni->n', z_axes, zero_z_axes))
+
+def transported_axes(directions, axis, direction):
+    """An axis carried along successive directions (n, 3) by the smallest rotation from one to the next (minimum twist),
+    starting from axis along direction"""
+    axis = numpy.asarray(axis, dtype=float)
+    direction = normalized(numpy.asarray(direction, dtype=float))
+    axes = numpy.zeros((len(directions), 3))
+    for idx, new_direction in enumerate(normalized(numpy.asarray(directions, dtype=float))):
+        # Rodrigues' rotation with the unnormalized axis direction x new_direction (a half turn keeps the axis)
+        cross = numpy.cross(direction, new_direction)
+        cosine = direction @ new_direction
+        if cosine > -1.0 + 1e-9:
+            axis = axis * cosine + numpy.cross(cross, axis) + cross * (cross @ axis) / (1.0 + cosine)
+        direction = new_direction
+        axes[idx] = axis
+    return axes
+
+def read_frames(bones, matrix_attribute):
+    """Heads, tails and rotations of a bone collection with foreach_get: edit bones ('head', 'tail', 'matrix') or
+    bones at rest ('head_local', 'tail_local', 'matrix_local')"""
+    count = len(bones)
+    head_attribute, tail_attribute = ('head', 'tail') if matrix_attribute == 'matrix' else ('head_local', 'tail_local')
+    heads = numpy.zeros(count * 3, dtype=numpy.float32)
+    tails = numpy.zeros(count * 3, dtype=numpy.float32)
+    matrices = numpy.zeros(count * 16, dtype=numpy.float32)
+    bones.foreach_get(head_attribute, heads)
+    bones.foreach_get(tail_attribute, tails)
+    bones.foreach_get(matrix_attribute, matrices)
+    # Matrices are read column by column
+    rotations = matrices.reshape(count, 4, 4).transpose(0, 2, 1)[:, :3, :3]
+    return heads.reshape(count, 3).astype(float), tails.reshape(count, 3).astype(float), rotations.astype(float)
+
+def polyline_points(points, fractions):
+    """Points at fractions of the length of a polyline (points is (n, 3))"""
+    points = numpy.asarray(points, dtype=float)
+    lengths = numpy.concatenate(([0.0], numpy.cumsum(numpy.linalg.norm(numpy.diff(points, axis=0), axis=1))))
+    distances = numpy.clip(numpy.asarray(fractions, dtype=float), 0.0, 1.0) * lengths[-1]
+    return numpy.stack([numpy.interp(distances, lengths, points[:, axis]) for axis in range(3)], axis=-1)
+
+def anchor_points(heads, tails, rotations, bone_indices, vectors):
+    """Points of anchors: vectors in bone frames (in bone lengths) where bone_indices >= 0, absolute points elsewhere"""
+    points = numpy.array(vectors, dtype=float)
+    on_bone = bone_indices >= 0
+    bones = bone_indices[on_bone]
+    lengths = numpy.linalg.norm(tails[bones] - heads[bones], axis=1)
+    points[on_bone] = heads[bones] + numpy.einsum('nij,nj->ni', rotations[bones], points[on_bone]) * lengths[:, None]
+    return points
+
+def closest_bone_anchors(points, heads, tails, rotations):
+    """For every point, the closest bone (first one on ties), the point in its frame (in bone lengths) and the
+    distance to the bone segment"""
+    lengths = numpy.linalg.norm(tails - heads, axis=1)
+    offsets = numpy.asarray(points, dtype=float)[:, None, :] - heads[None, :, :]
+    locals_ = numpy.einsum('bji,pbj->pbi', rotations, offsets) / lengths[None, :, None]
+    outside = numpy.maximum(0.0, numpy.maximum(-locals_[:, :, 1], locals_[:, :, 1] - 1.0))
+    distances = numpy.sqrt(locals_[:, :, 0] ** 2 + locals_[:, :, 2] ** 2 + outside ** 2) * lengths[None, :]
+    closest = numpy.argmin(distances, axis=1)
+    rows = numpy.arange(len(closest))
+    return closest, locals_[rows, closest], distances[rows, closest]
+
+def _derivation_levels(derivations):
+    """Derived bone names grouped so that every bone only depends on bones of the previous groups (or not derived)"""
+    levels = {}
+    def level(name, resolving):
+        if name not in derivations or name in resolving:
+            return -1
+        if name not in levels:
+            derivation = derivations[name]
+            sources = [anchor['bone'] for anchor in derivation.values() if 'bone' in anchor]
+            levels[name] = 1 + max([level(source, resolving | {name}) for source in sources], default=-1)
+        return levels[name]
+    for name in derivations:
+        level(name, frozenset())
+    groups = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+    for name, value in levels.items():
+        groups[value].append(name)
+    return groups
+
+def solve_derivations(names, heads, tails, rotations, derivations, splines):
+    """New heads, tails and rotations of the bones names (arrays in the same order) after the bones they were derived
+    from moved. splines maps curve names to (control points, evaluated points) arrays. Derived bones are placed level by
+    level, each level in one vectorized pass. Returns the arrays updated"""
+    heads, tails, rotations = heads.copy(), tails.copy(), rotations.copy()
+    indices = {name: idx for idx, name in enumerate(names)}
+    derivations = {name: derivation for name, derivation in derivations.items() if name in indices}
+
+    def compile_anchor(anchor):
+        """(bone index, vector, offset from the head) of an anchor"""
+        if 'bone' in anchor:
+            return indices[anchor['bone']], anchor['local'], False
+        if 'offset' in anchor:
+            return -1, anchor['offset'], True
+        control_points, evaluated_points = splines[anchor['spline']]
+        if 'point' in anchor:
+            return -1, control_points[anchor['point']], False
+        return -1, polyline_points(evaluated_points, [anchor['length']])[0], False
+
+    for group in _derivation_levels(derivations):
+        rows = numpy.array([indices[name] for name in group])
+        head_anchors = [compile_anchor(derivations[name]['head']) for name in group]
+        tail_anchors = [compile_anchor(derivations[name]['tail']) for name in group]
+        rolls = [derivations[name]['roll'] for name in group]
+        new_heads = anchor_points(heads, tails, rotations, numpy.array([a[0] for a in head_anchors]), [a[1] for a in head_anchors])
+        new_tails = anchor_points(heads, tails, rotations, numpy.array([a[0] for a in tail_anchors]), [a[1] for a in tail_anchors])
+        offsets = numpy.array([a[2] for a in tail_anchors])
+        new_tails[offsets] += new_heads[offsets]
+        z_axes = numpy.array([roll['z'] for roll in rolls], dtype=float)
+        roll_bones = numpy.array([indices.get(roll.get('bone'), -1) for roll in rolls])
+        on_bone = roll_bones >= 0
+        z_axes[on_bone] = numpy.einsum('nij,nj->ni', rotations[roll_bones[on_bone]], z_axes[on_bone])
+        heads[rows], tails[rows], rotations[rows] = new_heads, new_tails, frames_from_axes(new_heads, new_tails, z_axes)
+    return heads, tails, rotations
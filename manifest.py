@@ -0,0 +1,474 @@
+import bpy
+import json
+import hashlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+import mathutils
+from . import populate
+from . import geometry
+
+# Build manifest: what every module of the rig specification created on the armature (bones, constraints, drivers,
+# object constraints and modifiers, bones shown and hidden by consolidated FK-IK switches), the template bone settings
+# it changed, the level of detail and a signature of the template bones and splines it was built from. It is stored as JSON in a custom property of the armature by execute_plan, and lets
+# modules whose inputs changed be rebuilt alone.
+#
+# Every created bone also gets a derivation: where its head and tail are relative to the bones (or spline) it was
+# created from, and its Z axis. Anchors are {"bone": name, "local": [x, y, z]} (coordinates in the bone frame, in
+# bone lengths), {"spline": name, "point": index}, {"spline": name, "length": fraction} or {"offset": [x, y, z]}
+# (tails only, from the head). retarget.py moves created bones with them when the template changes.
+
+MANIFEST_PROPERTY = 'auto_rig_manifest'
+MANIFEST_VERSION = 1
+
+# Template bone settings that populate functions change and that are restored before a module is rebuilt
+TEMPLATE_EDIT_SETTINGS = ('use_connect', 'use_inherit_rotation', 'inherit_scale')
+TEMPLATE_POSE_SETTINGS = ('rotation_mode', 'lock_location', 'lock_rotation', 'lock_rotation_w', 'lock_scale')
+
+def read_manifest(armature):
+    """Manifest of the last build of the armature (None if there is none)"""
+    data = armature.get(MANIFEST_PROPERTY)
+    if not data:
+        return None
+    manifest = json.loads(data)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def write_manifest(armature, manifest):
+    armature[MANIFEST_PROPERTY] = json.dumps(manifest, separators=(',', ':'))
+
+def clear_manifest(armature):
+    if MANIFEST_PROPERTY in armature:
+        del armature[MANIFEST_PROPERTY]
+
+def spec_hash(spec, options):
+    """Hash of a rig specification and the build options"""
+    data = json.dumps([spec, options], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def _edit_or_data_bones(armature):
+    if armature.mode == 'EDIT':
+        return armature.data.edit_bones
+    return armature.data.bones
+
+def bone_settings(armature, bone_names):
+    """Settings of existing bones that populate functions may change"""
+    bones = _edit_or_data_bones(armature)
+    settings = {}
+    for name in bone_names:
+        bone = bones.get(name)
+        pose_bone = armature.pose.bones.get(name)
+        if bone is None or pose_bone is None:
+            continue
+        values = {'parent': bone.parent.name if bone.parent else None, 'layers': list(bone.layers)}
+        for attribute in TEMPLATE_EDIT_SETTINGS:
+            values[attribute] = getattr(bone, attribute)
+        for attribute in TEMPLATE_POSE_SETTINGS:
+            value = populate.pose_bone_setting(armature, name, attribute)
+            values[attribute] = value if isinstance(value, (bool, str)) else list(value)
+        settings[name] = values
+    return settings
+
+def _driver_keys(id_data, owner):
+    if not id_data.animation_data:
+        return set()
+    return {(owner, fcurve.data_path, fcurve.array_index) for fcurve in id_data.animation_data.drivers}
+
+def armature_state(armature, objects):
+    """Names of the bones, bone constraints, drivers, object constraints and modifiers and consolidated switch bones
+    that exist now"""
+    state = {
+        'bones': {bone.name for bone in _edit_or_data_bones(armature)},
+        'constraints': set(),
+        'drivers': _driver_keys(armature, 'OBJECT') | _driver_keys(armature.data, 'DATA'),
+        'objects': set(),
+        'switches': {(name, switch, expression) for switch, bones in populate.switch_visibility(armature).items()
+            for name, expression in bones.items()},
+    }
+    for pose_bone in armature.pose.bones:
+        for c in pose_bone.constraints:
+            state['constraints'].add((pose_bone.name, c.name))
+    for ob in objects:
+        state['objects'] |= {(ob.name, 'CONSTRAINT', c.name) for c in ob.constraints}
+        state['objects'] |= {(ob.name, 'MODIFIER', m.name) for m in ob.modifiers}
+    return state
+
+def bone_signature(armature, bone_name):
+    """Rest transform of a bone (REQUIRES OBJECT OR POSE MODE)"""
+    bone = armature.data.bones.get(bone_name)
+    if bone is None:
+        return None
+    return [round(value, 5) for row in bone.matrix_local for value in row] + [round(bone.length, 5)]
+
+def spline_signature(spline):
+    """Transform and control points of a curve object"""
+    values = [round(value, 5) for row in spline.matrix_basis for value in row]
+    for curve_spline in spline.data.splines:
+        for point in curve_spline.bezier_points:
+            values += [round(value, 5) for vector in (point.co, point.handle_left, point.handle_right) for value in vector]
+        for point in curve_spline.points:
+            values += [round(value, 5) for value in point.co]
+    return values
+
+def module_signature(armature, bone_names, spline_names):
+    """Hash of the template bones and splines a module is built from"""
+    values = [[name, bone_signature(armature, name)] for name in sorted(bone_names)]
+    for name in sorted(spline_names):
+        spline = bpy.data.objects.get(name)
+        values.append([name, spline_signature(spline) if spline else None])
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+def _module_inputs(operations, template):
+    """Template bones and splines the operations of a module refer to"""
+    bone_names = set()
+    spline_names = set()
+    for operation in operations:
+        for token in operation.tokens:
+            if token.startswith('spline:'):
+                spline_names.add(token[len('spline:'):])
+            elif token in template:
+                bone_names.add(token)
+    return bone_names, spline_names
+
+# Distance under which a point is considered to be on a bone or a spline
+DERIVATION_TOLERANCE = 1e-4
+
+def rest_frame(bone):
+    """Head, tail and rotation of an edit bone, or of a bone at rest (armature space)"""
+    if isinstance(bone, bpy.types.EditBone):
+        return bone.head.copy(), bone.tail.copy(), bone.matrix.to_3x3()
+    return bone.head_local.copy(), bone.tail_local.copy(), bone.matrix_local.to_3x3()
+
+def bone_anchor(point, bone_name, frame):
+    """Anchor of a point in a bone frame and the distance from the point to the bone"""
+    head, tail, rotation = frame
+    length = (tail - head).length
+    local = rotation.transposed() @ (point - head) / length
+    outside = max(0.0, -local.y, local.y - 1.0)
+    distance = (local.x ** 2 + local.z ** 2 + outside ** 2) ** 0.5 * length
+    return {'bone': bone_name, 'local': list(local)}, distance
+
+def spline_control_points(spline):
+    """Control point coordinates of the first spline of a curve object (as create_spline_hooks uses them)"""
+    curve_spline = spline.data.splines[0]
+    if curve_spline.type == 'BEZIER':
+        return [point.co.copy() for point in curve_spline.bezier_points]
+    return [point.co.to_3d() for point in curve_spline.points]
+
+def polyline_fraction(points, point):
+    """Position of the closest point of a polyline, as a fraction of its length, and the distance to it"""
+    lengths = [0.0]
+    for idx in range(1, len(points)):
+        lengths.append(lengths[idx-1] + (points[idx] - points[idx-1]).length)
+    best = (0.0, float('inf'))
+    for idx in range(1, len(points)):
+        segment = points[idx] - points[idx-1]
+        factor = 0.0
+        if segment.length_squared > 0.0:
+            factor = min(max((point - points[idx-1]).dot(segment) / segment.length_squared, 0.0), 1.0)
+        distance = (points[idx-1] + segment * factor - point).length
+        if distance < best[1]:
+            best = ((lengths[idx-1] + segment.length * factor) / lengths[-1], distance)
+    return best
+
+def spline_anchor(point, spline, evaluated_points):
+    """Anchor of a point on a spline (a control point or a position along the curve) and its distance to it"""
+    for idx, co in enumerate(spline_control_points(spline)):
+        if (co - point).length < DERIVATION_TOLERANCE:
+            return {'spline': spline.name, 'point': idx}, 0.0
+    fraction, distance = polyline_fraction(evaluated_points, point)
+    return {'spline': spline.name, 'length': fraction}, distance
+
+def closest_bone_anchors(points, frames):
+    """Anchors of points on their closest bone of frames, and the distances to them, computed at once"""
+    if not frames:
+        return [(None, float('inf'))] * len(points)
+    if numpy is None:
+        anchors = []
+        for point in points:
+            point = mathutils.Vector(point)
+            anchors.append(min((bone_anchor(point, name, frame) for name, frame in frames.items()), key=lambda anchor: anchor[1]))
+        return anchors
+    names = list(frames)
+    heads, tails, rotations = (numpy.array([frame[idx] for frame in frames.values()]) for idx in range(3))
+    closest, locals_, distances = geometry.closest_bone_anchors(numpy.array(points), heads, tails, rotations)
+    return [({'bone': names[bone], 'local': list(local)}, float(distance)) for bone, local, distance in zip(closest, locals_, distances)]
+
+def _point_anchor(point, bone_best, splines):
+    """Best anchor of a point: a bone it lies on (bone_best is the closest bone anchor), then a spline it lies on, then
+    the closest bone"""
+    if bone_best[1] < DERIVATION_TOLERANCE:
+        return bone_best
+    for spline, evaluated_points in splines:
+        anchor, distance = spline_anchor(point, spline, evaluated_points)
+        if distance < DERIVATION_TOLERANCE:
+            return anchor, distance
+    return bone_best
+
+def bone_derivations(armature, bone_names, source_names, splines):
+    """Derivations of the created bones bone_names from the existing bones source_names and the curve objects splines"""
+    bones = _edit_or_data_bones(armature)
+    frames = {name: rest_frame(bones[name]) for name in source_names if bones.get(name)}
+    to_armature = armature.matrix_world.inverted()
+    splines = [(spline, [to_armature @ p for p in populate.spline_evaluated_points(spline)]) for spline in splines]
+    bone_names = list(bone_names)
+    created = [rest_frame(bones[name]) for name in bone_names]
+    # Heads and tails of all the created bones are anchored to the source bones in one vectorized pass
+    bone_anchors = closest_bone_anchors([frame[0] for frame in created] + [frame[1] for frame in created], frames)
+    derivations = {}
+    for idx, name in enumerate(bone_names):
+        head, tail, rotation = created[idx]
+        head_anchor, _ = _point_anchor(head, bone_anchors[idx], splines)
+        if head_anchor is None:
+            continue
+        tail_anchor, distance = _point_anchor(tail, bone_anchors[len(bone_names) + idx], splines)
+        z_axis = rotation.col[2]
+        if 'bone' in head_anchor:
+            frame = frames[head_anchor['bone']]
+            if distance > DERIVATION_TOLERANCE:
+                tail_anchor = bone_anchor(tail, head_anchor['bone'], frame)[0]
+            roll = {'bone': head_anchor['bone'], 'z': list(frame[2].transposed() @ z_axis)}
+        else:
+            if distance > DERIVATION_TOLERANCE:
+                tail_anchor = {'offset': list(tail - head)}
+            roll = {'z': list(z_axis)}
+        derivations[name] = {'head': head_anchor, 'tail': tail_anchor, 'roll': roll}
+    return derivations
+
+def _serializable(result):
+    return isinstance(result, str) or (isinstance(result, list) and all(isinstance(item, str) for item in result))
+
+class BuildRecorder:
+    """Record what every module of a plan creates on the armature and write the manifest at the end. The armature
+    state is compared once per module, not once per operation, as it lists every bone and constraint.
+    previous is the manifest of the build being updated when only some modules are run"""
+
+    def __init__(self, armature, plan, options, previous=None):
+        self.armature = armature
+        self.plan = plan
+        self.options = options
+        self.objects = [ob for ob in armature.users_collection[0].objects if ob is not armature] if armature.users_collection else []
+        # Module whose operations are being recorded, the armature state when it started and what its operations use
+        self._module = None
+        self._before = None
+        self._sources = set()
+        self._results = set()
+        self._splines = set()
+        if previous:
+            self.manifest = previous
+        else:
+            if armature.mode == 'EDIT':
+                populate.enter_object_mode()
+            self.manifest = {
+                'version': MANIFEST_VERSION,
+                'spec': spec_hash(plan.spec, options),
+                'lod': options.get('lod'),
+                'template': bone_settings(armature, [bone.name for bone in armature.data.bones]),
+                'results': {},
+                'modules': {},
+            }
+
+    def module_entry(self, name):
+        return self.manifest['modules'].setdefault(name, {
+            'signature': None, 'bones': [], 'constraints': [], 'drivers': [], 'objects': [], 'template': [], 'modified': [],
+            'switches': [], 'derivations': {},
+        })
+
+    def record(self, operation, function, args):
+        """Run a populate function for an operation and record the template bone settings it changed. What the
+        operations of a module create is recorded at once, when the next module starts, when the build finishes or when
+        a function fails, so that the build can be rolled back"""
+        if operation.module != self._module:
+            self.flush()
+            self._module = operation.module
+            self._before = armature_state(self.armature, self.objects)
+        touched = [token for token in operation.tokens if not token.startswith(('@', 'spline:'))]
+        self._sources.update(touched)
+        for token in operation.tokens:
+            if token.startswith('@'):
+                result_names = self.manifest['results'].get(token[1:], [])
+                self._results.update([result_names] if isinstance(result_names, str) else result_names)
+            elif token.startswith('spline:'):
+                self._splines.add(token[len('spline:'):])
+        settings = bone_settings(self.armature, touched)
+        try:
+            result = function(self.armature, *args)
+        except Exception:
+            self._record_settings(operation, settings, touched)
+            self.flush()
+            raise
+        self._record_settings(operation, settings, touched)
+        if operation.id and _serializable(result):
+            self.manifest['results'][operation.id] = result
+        return result
+
+    def _record_settings(self, operation, settings, touched):
+        """Add the bones of touched whose settings changed since settings to the module entry"""
+        template = self.manifest['template']
+        entry = self.module_entry(operation.module)
+        # Changed template bones get their settings back before a rebuild, other changed bones make their module rebuild
+        for name, values in bone_settings(self.armature, touched).items():
+            if name not in settings or values == settings[name]:
+                continue
+            changed = entry['template'] if name in template else entry['modified']
+            if name not in changed:
+                changed.append(name)
+
+    def flush(self):
+        """Add what the operations of the current module created since it started to its entry, with the derivations
+        of the created bones"""
+        if self._module is None:
+            return
+        # Derivations are read from the placed bones
+        populate.write_placements(self.armature)
+        before = self._before
+        after = armature_state(self.armature, self.objects)
+        entry = self.module_entry(self._module)
+        for key in ('bones', 'constraints', 'drivers', 'objects', 'switches'):
+            entry.setdefault(key, [])
+            entry[key] += [item if isinstance(item, str) else list(item) for item in sorted(after[key] - before[key])]
+        created = after['bones'] - before['bones']
+        session = populate.build_session(self.armature)
+        if session is not None and session.registry is not None:
+            for name in created:
+                session.registry.add(name, self._module)
+        if created:
+            splines = [bpy.data.objects[name] for name in sorted(self._splines)]
+            sources = (self._sources | self._results) & before['bones']
+            # Created bones that later operations of the module refer to are derived first, so that the other created
+            # bones can be derived from them without a bone being derived from itself
+            results = created & self._results
+            if results:
+                entry['derivations'].update(bone_derivations(self.armature, results, sources, splines))
+            if created - results:
+                entry['derivations'].update(bone_derivations(self.armature, created - results, sources | results, splines))
+        self._module = None
+        self._before = None
+        self._sources = set()
+        self._results = set()
+        self._splines = set()
+
+    def finish(self, module_names):
+        """Compute the input signatures of the modules that were built and store the manifest"""
+        self.flush()
+        for name in module_names:
+            self.module_entry(name)
+        update_signatures(self.armature, self.plan, self.manifest, module_names)
+        write_manifest(self.armature, self.manifest)
+
+def update_signatures(armature, plan, manifest, module_names):
+    """Store the current signatures of the template bones and splines of modules"""
+    if armature.mode == 'EDIT':
+        populate.enter_object_mode()
+    template = manifest['template']
+    for name in module_names:
+        operations = [operation for operation in plan.operations if operation.module == name]
+        bone_names, spline_names = _module_inputs(operations, template)
+        manifest['modules'][name]['signature'] = module_signature(armature, bone_names, spline_names)
+
+def changed_modules(armature, plan, options, manifest):
+    """Modules that must be rebuilt: the ones whose template bones or splines changed and all the modules that depend
+    on them. Returns None if the whole rig must be rebuilt (no manifest, other specification or options)"""
+    if manifest is None or manifest['spec'] != spec_hash(plan.spec, options):
+        return None
+    template = manifest['template']
+    modules = {}
+    for operation in plan.operations:
+        modules.setdefault(operation.module, []).append(operation)
+    changed = set()
+    for name, operations in modules.items():
+        entry = manifest['modules'].get(name)
+        bone_names, spline_names = _module_inputs(operations, template)
+        if entry is None or entry['signature'] != module_signature(armature, bone_names, spline_names):
+            changed.add(name)
+
+    # Modules that use what a rebuilt module creates, whose bones it changed, or that constrain or change the same
+    # template bones are rebuilt too
+    tokens = {}
+    products = {}
+    modified = {}
+    shared = {}
+    for name, operations in modules.items():
+        entry = manifest['modules'].get(name, {})
+        tokens[name] = set().union(*[operation.tokens for operation in operations])
+        products[name] = set(entry.get('bones', [])) | {'@' + operation.id for operation in operations if operation.id}
+        modified[name] = set(entry.get('modified', []))
+        shared[name] = {bone for bone, _ in entry.get('constraints', [])} | set(entry.get('template', []))
+    pending = list(changed)
+    while pending:
+        rebuilt = pending.pop()
+        for name in modules:
+            if name in changed:
+                continue
+            if tokens[name] & products[rebuilt] or products[name] & modified[rebuilt] or shared[name] & shared[rebuilt]:
+                changed.add(name)
+                pending.append(name)
+    return changed
+
+def remove_drivers(id_data, keys):
+    """Remove the driver F-Curves with these (data path, index) keys in one pass"""
+    if not id_data.animation_data or not keys:
+        return
+    drivers = id_data.animation_data.drivers
+    for fcurve in [fcurve for fcurve in drivers if (fcurve.data_path, fcurve.array_index) in keys]:
+        drivers.remove(fcurve)
+
+def remove_modules(armature, manifest, module_names):
+    """Remove what modules created and restore the template bone settings they changed"""
+    populate.enter_pose_mode(armature)
+    pose_bones = {pose_bone.name: pose_bone for pose_bone in armature.pose.bones}
+    drivers = {'OBJECT': set(), 'DATA': set()}
+    bone_names = []
+    switch_names = []
+    template_names = set()
+    for name in module_names:
+        entry = manifest['modules'].pop(name, None)
+        if entry is None:
+            continue
+        for owner, data_path, index in entry['drivers']:
+            drivers[owner].add((data_path, index))
+        for bone_name, constraint_name in entry['constraints']:
+            pose_bone = pose_bones.get(bone_name)
+            c = pose_bone.constraints.get(constraint_name) if pose_bone else None
+            if c:
+                pose_bone.constraints.remove(c)
+        for object_name, kind, item_name in entry['objects']:
+            ob = bpy.data.objects.get(object_name)
+            if ob is None:
+                continue
+            items = ob.constraints if kind == 'CONSTRAINT' else ob.modifiers
+            if items.get(item_name):
+                items.remove(items[item_name])
+        switch_names += [name for name, _, _ in entry.get('switches', [])]
+        bone_names += entry['bones']
+        template_names |= set(entry['template'])
+    populate.remove_switch_visibility(armature, switch_names)
+    remove_drivers(armature, drivers['OBJECT'])
+    remove_drivers(armature.data, drivers['DATA'])
+
+    # Bones are removed, then template bones get their settings back
+    populate.enter_edit_mode(armature)
+    edit_bones = {edit_bone.name: edit_bone for edit_bone in armature.data.edit_bones}
+    for bone_name in bone_names:
+        edit_bone = edit_bones.pop(bone_name, None)
+        if edit_bone:
+            armature.data.edit_bones.remove(edit_bone)
+    template = manifest['template']
+    for bone_name in template_names:
+        edit_bone = edit_bones.get(bone_name)
+        if edit_bone is None:
+            continue
+        values = template[bone_name]
+        edit_bone.parent = edit_bones.get(values['parent']) if values['parent'] else None
+        edit_bone.layers = values['layers']
+        for attribute in TEMPLATE_EDIT_SETTINGS:
+            setattr(edit_bone, attribute, values[attribute])
+    populate.enter_pose_mode(armature)
+    for bone_name in template_names:
+        pose_bone = armature.pose.bones.get(bone_name)
+        if pose_bone is None:
+            continue
+        for attribute in TEMPLATE_POSE_SETTINGS:
+            setattr(pose_bone, attribute, template[bone_name][attribute])
@@ -0,0 +1,227 @@
+import bpy
+import re
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+import mathutils
+from . import populate
+from . import manifest
+from . import retarget
+
+# Symmetry mode. A module of the rig specification with "mirror_of" (e.g. arm_right, the mirror of arm_left) is not
+# built from its operations: what the other module created is mirrored instead, in one pass. Bones get their geometry
+# flipped in X (armature space) and their settings, constraints, drivers (paths, variable targets and custom property
+# names like fk_ik_left_arm), consolidated FK-IK switch bones, object constraints and hook modifiers are copied with
+# mirrored names. Names are mirrored by swapping their 'left' and 'right' tokens. When the template bones or splines of
+# the two sides are not symmetric the module is built from its operations.
+
+SIDE_TOKENS = {'left': 'right', 'right': 'left'}
+SYMMETRY_TOLERANCE = 1e-4
+FLIP = mathutils.Vector((-1.0, 1.0, 1.0))
+_IDENTIFIER = re.compile(r'[A-Za-z0-9_]+')
+
+# Pose bone settings of created bones copied to their mirrors
+MIRROR_POSE_SETTINGS = populate.POSE_BONE_SETTINGS + ('lock_ik_x', 'lock_ik_y', 'lock_ik_z')
+
+def mirror_name(name):
+    """Name of the other side (the same name if it has no side)"""
+    return "_".join(SIDE_TOKENS.get(token, token) for token in name.split('_'))
+
+def mirror_path(data_path):
+    """Data path (or custom property name) of the other side"""
+    return _IDENTIFIER.sub(lambda match: mirror_name(match.group(0)), data_path)
+
+def mirror_value(value):
+    """Operation result (a name or a list of names) of the other side"""
+    if isinstance(value, str):
+        return mirror_name(value)
+    if isinstance(value, list):
+        return [mirror_value(item) for item in value]
+    return value
+
+def mirror_object(ob):
+    """Object of the other side (the same object if there is none)"""
+    if ob is None:
+        return None
+    return bpy.data.objects.get(mirror_name(ob.name), ob)
+
+def _spline_points(armature, spline):
+    to_armature = armature.matrix_world.inverted() @ spline.matrix_world
+    return [to_armature @ co for co in manifest.spline_control_points(spline)]
+
+def symmetric_inputs(armature, bone_names, spline_names):
+    """True if every input bone and spline with a side has a counterpart on the other side with mirrored geometry"""
+    bones = armature.data.edit_bones if armature.mode == 'EDIT' else armature.data.bones
+    for name in bone_names:
+        other_name = mirror_name(name)
+        if other_name == name:
+            continue
+        bone, other = bones.get(name), bones.get(other_name)
+        if bone is None or other is None:
+            return False
+        head, tail, rotation = manifest.rest_frame(bone)
+        other_head, other_tail, other_rotation = manifest.rest_frame(other)
+        for point, other_point in ((head, other_head), (tail, other_tail), (rotation.col[2], other_rotation.col[2])):
+            if (point * FLIP - other_point).length > SYMMETRY_TOLERANCE:
+                return False
+    for name in spline_names:
+        spline, other = bpy.data.objects.get(name), bpy.data.objects.get(mirror_name(name))
+        if spline is None or other is None or other == spline:
+            continue
+        points, other_points = _spline_points(armature, spline), _spline_points(armature, other)
+        if len(points) != len(other_points):
+            return False
+        if any((point * FLIP - other_point).length > SYMMETRY_TOLERANCE for point, other_point in zip(points, other_points)):
+            return False
+    return True
+
+def can_mirror(armature, build_manifest, source):
+    """True if what module source created can be mirrored: the bones it created have a side and their mirrors don't exist"""
+    entry = build_manifest['modules'].get(source)
+    if entry is None:
+        return False
+    bones = armature.data.edit_bones if armature.mode == 'EDIT' else armature.data.bones
+    return all(mirror_name(name) != name and bones.get(mirror_name(name)) is None for name in entry['bones'])
+
+def mirror_constraint(constraints, c):
+    """Copy a constraint with mirrored targets and settings to a constraint stack"""
+    new_c = constraints.copy(c)
+    for attribute in ('target', 'pole_target'):
+        if getattr(new_c, attribute, None) is not None:
+            setattr(new_c, attribute, mirror_object(getattr(c, attribute)))
+    for attribute in ('subtarget', 'pole_subtarget'):
+        if getattr(new_c, attribute, ""):
+            setattr(new_c, attribute, mirror_name(getattr(c, attribute)))
+    if c.type == 'IK':
+        # Same as Symmetrize
+        new_c.pole_angle = math.remainder(-math.pi - c.pole_angle, 2.0 * math.pi)
+    elif c.type == 'LIMIT_ROTATION':
+        new_c.min_y, new_c.max_y = -c.max_y, -c.min_y
+        new_c.min_z, new_c.max_z = -c.max_z, -c.min_z
+    if c.type == 'CHILD_OF':
+        new_c.set_inverse_pending = True
+    return new_c
+
+def mirror_driver(fcurve, new_fcurve):
+    """Copy a driver with mirrored variable targets"""
+    driver, new_driver = fcurve.driver, new_fcurve.driver
+    new_driver.type = driver.type
+    new_driver.expression = mirror_path(driver.expression)
+    new_driver.use_self = driver.use_self
+    for variable in list(new_driver.variables):
+        new_driver.variables.remove(variable)
+    for variable in driver.variables:
+        new_variable = new_driver.variables.new()
+        new_variable.name = variable.name
+        new_variable.type = variable.type
+        for target, new_target in zip(variable.targets, new_variable.targets):
+            if variable.type == 'SINGLE_PROP':
+                new_target.id_type = target.id_type
+            new_target.id = mirror_object(target.id) if isinstance(target.id, bpy.types.Object) else target.id
+            new_target.data_path = mirror_path(target.data_path)
+            new_target.bone_target = mirror_name(target.bone_target)
+            new_target.transform_type = target.transform_type
+            new_target.transform_space = target.transform_space
+            new_target.rotation_mode = target.rotation_mode
+
+def place_mirrored_bones(armature, names):
+    """(REQUIRES EDIT MODE) Place bones as the mirrors of their sources (names maps the sources to them), in one pass
+    inside a build session (see populate.place_bones)"""
+    heads, tails, rolls = populate.bone_placements(armature, list(names))
+    if numpy is not None:
+        flip = numpy.array(FLIP)
+        heads, tails, rolls = heads * flip, tails * flip, -rolls
+    else:
+        heads = [mathutils.Vector((-head[0], head[1], head[2])) for head in heads]
+        tails = [mathutils.Vector((-tail[0], tail[1], tail[2])) for tail in tails]
+        rolls = [-roll for roll in rolls]
+    populate.place_bones(armature, list(names.values()), heads, tails, rolls)
+    populate.write_placements(armature)
+
+def mirror_module(armature, build_manifest, source):
+    """Create the mirror of everything module source created (see its build manifest entry)"""
+    entry = build_manifest['modules'][source]
+    changed_names = [name for name in entry['template'] + entry['modified'] if mirror_name(name) != name]
+
+    # Bones, placed in one pass before the hierarchy is set
+    populate.enter_edit_mode(armature)
+    populate.write_placements(armature)
+    edit_bones = armature.data.edit_bones
+    names = {}
+    for name in entry['bones']:
+        source_bone = edit_bones[name]
+        new_bone = populate.new_edit_bone(armature, mirror_name(name), None, None, None, source_bone.layers, source_bone.deletable)
+        populate.copy_edit_bone_settings(source_bone, new_bone)
+        names[name] = new_bone.name
+    place_mirrored_bones(armature, names)
+    for name in list(names) + changed_names:
+        source_bone = edit_bones[name]
+        edit_bone = edit_bones.get(names.get(name, mirror_name(name)))
+        if edit_bone is None:
+            continue
+        if source_bone.parent:
+            parent_name = source_bone.parent.name
+            edit_bone.parent = edit_bones.get(names.get(parent_name, mirror_name(parent_name))) or source_bone.parent
+        else:
+            edit_bone.parent = None
+        for attribute in manifest.TEMPLATE_EDIT_SETTINGS:
+            setattr(edit_bone, attribute, getattr(source_bone, attribute))
+        edit_bone.layers = source_bone.layers
+
+    # Pose bone settings and constraints (in stack order)
+    populate.enter_pose_mode(armature)
+    pose_bones = armature.pose.bones
+    for name, new_name in names.items():
+        for attribute in MIRROR_POSE_SETTINGS:
+            populate.set_pose_bone_setting(armature, new_name, attribute, populate.pose_bone_setting(armature, name, attribute))
+    for name in changed_names:
+        if pose_bones.get(mirror_name(name)):
+            for attribute in manifest.TEMPLATE_POSE_SETTINGS:
+                populate.set_pose_bone_setting(armature, mirror_name(name), attribute, populate.pose_bone_setting(armature, name, attribute))
+    constraint_keys = {tuple(key) for key in entry['constraints']}
+    for bone_name in dict.fromkeys(bone_name for bone_name, _ in entry['constraints']):
+        pose_bone = pose_bones.get(names.get(bone_name, mirror_name(bone_name)))
+        if pose_bone is None or pose_bone.name == bone_name:
+            continue
+        for c in pose_bones[bone_name].constraints:
+            if (bone_name, c.name) in constraint_keys:
+                mirror_constraint(pose_bone.constraints, c)
+
+    # Drivers and consolidated switch bones (custom properties like fk_ik_left_arm are mirrored with the paths)
+    for owner, data_path, index in entry['drivers']:
+        id_data = armature if owner == 'OBJECT' else armature.data
+        fcurve = id_data.animation_data.drivers.find(data_path, index=index) if id_data.animation_data else None
+        if fcurve is None or mirror_path(data_path) == data_path:
+            continue
+        mirror_driver(fcurve, populate.add_driver(id_data, mirror_path(data_path), index))
+    for name, switch_property_name, expression in entry.get('switches', []):
+        if mirror_path(switch_property_name) != switch_property_name:
+            populate.add_switch_visibility(armature, names.get(name, mirror_name(name)), mirror_path(switch_property_name), expression)
+
+    # Object constraints and hook modifiers
+    populate.enter_object_mode()
+    hooked = set()
+    for object_name, kind, item_name in entry['objects']:
+        ob = bpy.data.objects.get(object_name)
+        other = bpy.data.objects.get(mirror_name(object_name))
+        if ob is None or other is None or other == ob:
+            continue
+        if kind == 'CONSTRAINT':
+            mirror_constraint(other.constraints, ob.constraints[item_name])
+            continue
+        modifier = ob.modifiers[item_name]
+        if modifier.type != 'HOOK':
+            continue
+        new_modifier = other.modifiers.new(mirror_name(item_name), 'HOOK')
+        new_modifier.object = mirror_object(modifier.object)
+        new_modifier.subtarget = mirror_name(modifier.subtarget)
+        new_modifier.strength = modifier.strength
+        new_modifier.falloff_type = modifier.falloff_type
+        new_modifier.vertex_indices_set(list(modifier.vertex_indices))
+        hooked.add(other)
+    if hooked:
+        bpy.context.view_layer.update()
+        for ob in hooked:
+            retarget.reset_hooks(armature, ob)
@@ -1,25 +1,145 @@
 import bpy
 import os
+import time
+import contextlib
 from . import populate
-import math
+from . import planner
+from . import equivalence
+from . import profiler
+from . import manifest
+from . import rig_cache
+from . import retarget
+from . import cost
+from . import rigfile
+from . import fingerprint
+
+SOURCE_PATH = os.path.join(os.path.dirname(__file__), 'source armature.blend')
+SOURCE_COLLECTION = 'Armature Collection'
+
+# Populate from the interface: seconds between two timer events and seconds of build per event
+MODAL_TIMER_STEP = 0.01
+MODAL_TIME_SLICE = 0.1
+
+# Populate operator building from the panel, one at a time
+_modal_build = None
+
+# Events a modal build lets through to the interface: view navigation only. Events that can edit data are blocked
+# until the build ends
+MODAL_PASS_THROUGH_EVENTS = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE',
+    'WHEELINMOUSE', 'WHEELOUTMOUSE', 'TRACKPADPAN', 'TRACKPADZOOM', 'MOUSEROTATE', 'WINDOW_DEACTIVATE'}
+
+# The template collection is loaded from the source file once and kept out of the scenes, with this name prefix.
+# New armatures are copies of it. It is removed before saving, so blend files don't carry it
+TEMPLATE_CACHE_PREFIX = '.autorig_cache '
+
+def _cache_collections(collection):
+    """A collection and all its child collections"""
+    collections = [collection]
+    for child in collection.children:
+        collections += _cache_collections(child)
+    return collections
+
+def template_cache():
+    """Cached template collection (loaded from the source file if it is not cached yet)"""
+    collection = bpy.data.collections.get(TEMPLATE_CACHE_PREFIX + SOURCE_COLLECTION)
+    if collection is not None and collection.all_objects:
+        return collection
+    with bpy.data.libraries.load(SOURCE_PATH, link=False) as (data_from, data_to):
+        data_to.collections = [SOURCE_COLLECTION]
+    collection = data_to.collections[0]
+    for item in _cache_collections(collection):
+        item.name = TEMPLATE_CACHE_PREFIX + item.name
+    for ob in collection.all_objects:
+        ob.name = TEMPLATE_CACHE_PREFIX + ob.name
+    return collection
+
+@bpy.app.handlers.persistent
+def clear_template_cache(*args):
+    """Remove the cached template collection and its objects"""
+    collection = bpy.data.collections.get(TEMPLATE_CACHE_PREFIX + SOURCE_COLLECTION)
+    if collection is None:
+        return
+    for ob in list(collection.all_objects):
+        data = ob.data
+        bpy.data.objects.remove(ob, do_unlink=True)
+        if data is not None and data.users == 0:
+            if isinstance(data, bpy.types.Armature):
+                bpy.data.armatures.remove(data)
+            elif isinstance(data, bpy.types.Curve):
+                bpy.data.curves.remove(data)
+    for item in reversed(_cache_collections(collection)):
+        bpy.data.collections.remove(item)
+
+def _copy_cache_collection(source, copies, data_copies):
+    """Copy a cached collection with its objects and their data, giving them their original names. copies and
+    data_copies map the cached objects and data to their copies"""
+    collection = bpy.data.collections.new(source.name[len(TEMPLATE_CACHE_PREFIX):])
+    for ob in source.objects:
+        copy = ob.copy()
+        if ob.data is not None:
+            copy.data = data_copies[ob.data] = ob.data.copy()
+        copy.name = ob.name[len(TEMPLATE_CACHE_PREFIX):]
+        collection.objects.link(copy)
+        copies[ob] = copy
+    for child in source.children:
+        collection.children.link(_copy_cache_collection(child, copies, data_copies))
+    return collection
+
+def _remap_copied_ids(ob, copies):
+    """Point the references of a copied object to cached objects and data at their copies (copies maps both): parent,
+    object and bone constraint targets, modifier objects, bone custom shapes and driver targets (of the object and of
+    its data)"""
+    if ob.parent in copies:
+        ob.parent = copies[ob.parent]
+    constraints = list(ob.constraints)
+    if ob.pose is not None:
+        for pose_bone in ob.pose.bones:
+            if pose_bone.custom_shape in copies:
+                pose_bone.custom_shape = copies[pose_bone.custom_shape]
+            constraints += list(pose_bone.constraints)
+    for c in constraints:
+        for attribute in ('target', 'pole_target'):
+            if getattr(c, attribute, None) in copies:
+                setattr(c, attribute, copies[getattr(c, attribute)])
+    for m in ob.modifiers:
+        if getattr(m, 'object', None) in copies:
+            m.object = copies[m.object]
+    for id_data in (ob, ob.data):
+        animation_data = getattr(id_data, 'animation_data', None)
+        if animation_data is None:
+            continue
+        for fcurve in animation_data.drivers:
+            for variable in fcurve.driver.variables:
+                for target in variable.targets:
+                    if target.id in copies:
+                        target.id = copies[target.id]
+
+def append_source_armature(scene):
+    """Add a copy of the cached template collection to the scene and return its armature. Needs no window, so it works
+    in background mode"""
+    copies = {}
+    data_copies = {}
+    collection = _copy_cache_collection(template_cache(), copies, data_copies)
+    # References between template objects point to the copies
+    ids = {**copies, **data_copies}
+    armature = None
+    for ob in copies.values():
+        _remap_copied_ids(ob, ids)
+        if ob.production_state == 'TEMPLATE':
+            armature = ob
+    scene.collection.children.link(collection)
+    if armature is None:
+        return None
+    armature.production_state = 'BASIC_EDITION'
+    scene.armature_ob = armature
+    return armature
 
 class OBJECT_OT_add_source_armature(bpy.types.Operator):
     bl_idname = 'object.add_source_armature'
     bl_label = 'Add Armature'
 
     def execute(self, context):
-        scene = context.scene
-        path = os.path.dirname(__file__) + '/source armature.blend\\Collection'
-        collection_name = 'Armature Collection'
-        bpy.ops.wm.append(
-            directory=path,
-            filename=collection_name
-        )
-        for ob in context.selectable_objects:
-            if ob.production_state == 'TEMPLATE':
-                ob.production_state = 'BASIC_EDITION'
-                scene.armature_ob = ob.id_data
-                break
+        append_source_armature(context.scene)
         return {'FINISHED'}
 
 class OBJECT_OT_clean_armature(bpy.types.Operator):
@@ -47,19 +167,21 @@ class OBJECT_OT_clean_armature(bpy.types.Operator):
             bpy.ops.object.mode_set(mode='OBJECT')
         except RuntimeError:
             return {'FINISHED'}
+
+        # Remove exactly what populate created, as recorded in the build manifest
+        build_manifest = manifest.read_manifest(armature)
+        if build_manifest:
+            manifest.remove_modules(armature, build_manifest, list(build_manifest['modules']))
+            manifest.clear_manifest(armature)
+            bpy.ops.object.mode_set(mode='OBJECT')
+            return {'FINISHED'}
+
+        # Armatures without manifest: every constraint and bone driver is removed
         for bone in armature.pose.bones:
             for c in bone.constraints:
                 bone.constraints.remove(c)
-            paths = []
-            paths.append('pose.bones[\"' + bone.name + '\"].location')
-            paths.append('pose.bones[\"' + bone.name + '\"].rotation_euler')
-            paths.append('pose.bones[\"' + bone.name + '\"].rotation_quaternion')
-            paths.append('pose.bones[\"' + bone.name + '\"].scale')
-            paths.append('pose.bones[\"' + bone.name + '\"].constraints[\"' + 'Copy Transforms' + '\"].influence')
-            paths.append('pose.bones[\"' + bone.name + '\"].constraints[\"' + 'Copy Transforms.001' + '\"].influence')
-            for p in paths:
-                armature.driver_remove(p)
-            armature.data.driver_remove('bones[\"' + bone.name + '\"].hide')
+        populate.remove_bone_drivers(armature, [bone.name for bone in armature.pose.bones])
+        populate.remove_switch_visibility(armature, [bone.name for bone in armature.data.bones])
         
         # Delete deletable bones
         bpy.ops.object.select_all(action='DESELECT')
@@ -104,181 +226,353 @@ class OBJECT_OT_delete_armature(bpy.types.Operator):
         return {'FINISHED'}
 
 class OBJECT_OT_populate_armature(bpy.types.Operator):
-    """Populate the template armature to make it animation ready"""
+    """Populate the template armature to make it animation ready (Esc cancels)"""
     bl_idname = 'object.populate_armature'
     bl_label = 'Populate armature'
-    def execute(self, context):
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def prepare(self, context):
+        """Compile the rig specification and take the rig from the cache if it is there. Returns the operator result
+        when there is nothing to build"""
+        if _modal_build is not None:
+            self.report({'ERROR'}, "The armature is being populated (Esc cancels it)")
+            return {'CANCELLED'}
+
         # Try to get the armature
         if not bpy.context.scene.armature_ob:
             return {'FINISHED'}
 
         try:
-            armature = bpy.context.scene.armature_ob
+            self.armature = bpy.context.scene.armature_ob
         except KeyError:
             return {'FINISHED'}
 
-        # Splines dictionary
-        splines = {}
-        for name, ob in bpy.data.objects.items():
-            if not name.endswith("_SPL"):
-                continue
-            splines[name] = ob
+        # Compile the rig specification
+        self.options = planner.build_options(context.scene)
+        try:
+            self.spec = planner.armature_spec(planner.spec_path(context.scene), self.armature, self.options)
+            self.plan = planner.compile_plan(self.spec)
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, "Invalid rig specification: " + str(error))
+            return {'CANCELLED'}
+
+        # Rigs with the same proportions are taken from the cache
+        self.cache_dir = bpy.path.abspath(context.scene.rig_cache_dir) if context.scene.rig_cache_dir else None
+        if self.cache_dir:
+            if context.mode != 'OBJECT':
+                bpy.ops.object.mode_set(mode='OBJECT')
+            self.key = rig_cache.rig_key(self.armature, self.spec, self.options)
+            cached_armature = rig_cache.load_cached_rig(self.armature, self.cache_dir, self.key)
+            if cached_armature:
+                self.report({'INFO'}, "Rig loaded from the cache")
+                return {'FINISHED'}
+
+        self.profile = profiler.Profiler(self.armature) if context.scene.rig_profile else None
+        self.start = time.perf_counter()
+        return None
+
+    def finish(self, context):
+        """Store the rig in the cache and report the build time"""
+        if self.cache_dir:
+            if context.mode != 'OBJECT':
+                bpy.ops.object.mode_set(mode='OBJECT')
+            rig_cache.store_rig(self.armature, self.cache_dir, self.key, context.scene.rig_cache_size * 1024 * 1024)
+
+        # Build time report
+        if self.profile:
+            print(self.profile.report())
+            if context.scene.rig_profile_path:
+                self.profile.save(bpy.path.abspath(context.scene.rig_profile_path), context.scene.rig_profile_format)
+
+        self.report({'INFO'}, "Armature populated in %.2f s" % (time.perf_counter() - self.start))
+        return {'FINISHED'}
+
+    def execute(self, context):
+        result = self.prepare(context)
+        if result:
+            return result
 
         # Populate operations
-        # IMPORTANT: It is highly recommended to use populate functions only!
-        # Spine
-        spine_RST_bones = populate.create_spline_chain(armature, splines["spine_SPL"], 6, "spine", False)
-        spine_HDL_bones = populate.create_spline_hooks(armature, splines["spine_SPL"], "spine")
-        populate.chain_torsion(
-            armature, 
-            spine_RST_bones, 
-            armature.pose.bones[spine_HDL_bones[0]].name,
-            armature.pose.bones[spine_HDL_bones[len(spine_HDL_bones)-1]].name
-        )
-        populate.duplicate_bones(armature, [spine_HDL_bones[0]], ["hips_location_HDL"], 16, True)
-        populate.parent_bones(armature, spine_HDL_bones, "hips_location_HDL", False, True, 'FULL')
-        populate.parent_bones(armature, ["hips_location_HDL"], "center_HDL", False, True, 'FULL')
-        populate.parent_bones(armature, [spine_RST_bones[0]], "center_HDL", False, False, 'FULL')
-        populate.bone_child_of_constraint(armature, [spine_RST_bones[0]], spine_HDL_bones[0], [True, True, True, True, True, True, False, False, False])
-        populate.object_child_of_constraint(armature, splines["spine_SPL"], spine_HDL_bones[0], [True, True, True, True, True, True, True, True, True])
-        populate.lock_bone_transforms(armature, ["hips_location_HDL"], [False, False, False, True, True, True, True, True, True])
-        populate.lock_bone_transforms(armature, [spine_HDL_bones[0]], [True, True, True, False, False, False, True, True, True])
-        populate.lock_bone_transforms(armature, [spine_HDL_bones[len(spine_HDL_bones)-1]], [False, False, False, False, False, False, True, True, True])
-        for idx in range(1,len(spine_HDL_bones)-1):
-            populate.lock_bone_transforms(armature, [spine_HDL_bones[idx]], [False, False, False, False, True, False, True, True, True])
-        
-        # Shoulders
-        populate.connect_tail_head(armature,spine_RST_bones[len(spine_RST_bones)-1], "shoulder_left_RST", "shoulder_con_left_AUX", 7, True)
-        populate.connect_tail_head(armature,spine_RST_bones[len(spine_RST_bones)-1], "shoulder_right_RST", "shoulder_con_right_AUX", 7, True)
-        populate.parent_bones(armature, ["shoulder_left_RST"], "shoulder_con_left_AUX", True, False, 'FULL')
-        populate.parent_bones(armature, ["shoulder_right_RST"], "shoulder_con_right_AUX", True, False, 'FULL')
-        populate.add_bone_axis(armature, "shoulder_left_HDL", "shoulder_left_RST", "shoulder_con_left_AUX", 'HEAD', '-X', 0.3, True, 16, True)
-        populate.add_bone_axis(armature, "shoulder_right_HDL", "shoulder_right_RST", "shoulder_con_right_AUX", 'HEAD', '+X', 0.3, True, 16, True)
-        populate.assign_rotation_mode(armature, ["shoulder_left_RST", "shoulder_right_RST"])
-        populate.lock_bone_transforms(armature, ["shoulder_left_RST", "shoulder_right_RST"], [True, True, True, True, True, True, True, True, True])
-        populate.lock_bone_transforms(armature, ["shoulder_left_HDL", "shoulder_right_HDL"], [True, True, True, False, False, False, True, True, True])
-        populate.bone_child_of_constraint(armature, ["shoulder_left_RST"], "shoulder_left_HDL", [False, False, False, True, True, True, False, False, False])
-        populate.bone_child_of_constraint(armature, ["shoulder_right_RST"], "shoulder_right_HDL", [False, False, False, True, True, True, False, False, False])
-
-        # Neck-Head
-        populate.connect_tail_head(armature, spine_RST_bones[len(spine_RST_bones)-1], "neck01_RST", "neck_con_AUX", 7, True)
-        populate.assign_rotation_mode(armature,["neck01_RST", "neck02_RST", "head_RST"])
-        populate.duplicate_bones(armature, ["neck01_RST"], ["neck_HDL"], 16, True)
-        populate.duplicate_bones(armature, ["head_RST"], ["head_HDL"], 16, True)
-        populate.lock_bone_transforms(armature, ["neck01_RST", "neck02_RST", "head_RST"], [True, True, True, True, True, True, True, True, True])
-        populate.parent_bones(armature, ["neck_HDL"], "neck_con_AUX", True, False, 'FULL')
-        populate.parent_bones(armature, ["head_HDL"], "neck_HDL", False, False, 'FULL')
-        populate.lock_bone_transforms(armature, ["neck_HDL", "head_HDL"], [False, False, False, False, False, False, True, True, True])
-        populate.bone_copy_rotation_constraint(armature, ["neck01_RST"], "neck_HDL", [True, True, True], 'WORLD')
-        populate.bone_child_of_constraint(armature, ["neck_HDL", "head_HDL"], "center_HDL", [False, False, False, True, True, True, False, False, False])
-        populate.bone_IK_constraint(armature, ["neck02_RST"], "head_HDL", None, 1, 0.0, [False, False, False])
-        populate.bone_copy_transforms_constraint(armature, ["head_RST"], "head_HDL", 'WORLD')
-
-        # Arms
-        populate.create_fk_ik_limb(
-            armature,
-            ["arm_left_RST", "forearm_left_AUX", "hand_left_RST"], # Ordered as: root, second, third, pole
-            ["arm_left_fk_HDL", "forearm_left_fk_HDL", "hand_left_fk_HDL"], # Ordered as: root, first, second
-            ["arm_left_ik_HDL", "forearm_left_ik_AUX", "hand_left_ik_HDL"], # Ordered as: root, first, second
-            "center_HDL",
-            "arm_left_Pole_HDL",
-            "fk_ik_left_arm",
-            math.radians(0),
-            [False, False, True],
-            16,
-            7
-            )
-        populate.create_fk_ik_limb(
-            armature,
-            ["arm_right_RST", "forearm_right_AUX", "hand_right_RST"], # Ordered as: root, second, third, pole
-            ["arm_right_fk_HDL", "forearm_right_fk_HDL", "hand_right_fk_HDL"], # Ordered as: root, first, second
-            ["arm_right_ik_HDL", "forearm_right_ik_AUX", "hand_right_ik_HDL"], # Ordered as: root, first, second
-            "center_HDL",
-            "arm_right_Pole_HDL",
-            "fk_ik_right_arm",
-            math.radians(180),
-            [False, False, True],
-            16,
-            7
-            )
-        populate.create_forarm_torsion_bones(armature, ["forearm_left_AUX", "hand_left_RST"], 3, 23, 7)
-        populate.create_forarm_torsion_bones(armature, ["forearm_right_AUX", "hand_right_RST"], 3, 23, 7)
-
-        # Hands
-        populate.finger_drivers_and_constraints(armature, ["index_01_left_RST", "index_02_left_RST", "index_03_left_RST", "index_left_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["middle_01_left_RST", "middle_02_left_RST", "middle_03_left_RST", "middle_left_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["ring_01_left_RST", "ring_02_left_RST", "ring_03_left_RST", "ring_left_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["pinky_01_left_RST", "pinky_02_left_RST", "pinky_03_left_RST", "pinky_left_HDL"], 1.0)
-        populate.thumb_drivers_and_constraints(armature, ["thumb_01_left_RST", "thumb_02_left_RST", "thumb_03_left_RST", "thumb_root_left_HDL", "thumb_left_HDL"], 1.0)
-        
-        populate.finger_drivers_and_constraints(armature, ["index_01_right_RST", "index_02_right_RST", "index_03_right_RST", "index_right_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["middle_01_right_RST", "middle_02_right_RST", "middle_03_right_RST", "middle_right_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["ring_01_right_RST", "ring_02_right_RST", "ring_03_right_RST", "ring_right_HDL"], 1.0)
-        populate.finger_drivers_and_constraints(armature, ["pinky_01_right_RST", "pinky_02_right_RST", "pinky_03_right_RST", "pinky_right_HDL"], 1.0)
-        populate.thumb_drivers_and_constraints(armature, ["thumb_01_right_RST", "thumb_02_right_RST", "thumb_03_right_RST", "thumb_root_right_HDL", "thumb_right_HDL"], 1.0)
-
-        # Legs
-        # Left
-        populate.create_fk_ik_limb(
-            armature,
-            ["thigh_left_RST", "calf_left_RST", "foot_left_RST"], # Ordered as: root, second, third, pole
-            ["thigh_left_fk_HDL", "calf_left_fk_HDL", "foot_left_fk_HDL"], # Ordered as: root, first, second
-            ["thigh_left_ik_HDL", "calf_left_ik_AUX", "foot_left_mech_AUX"], # Ordered as: root, first, second
-            "center_HDL",
-            "leg_left_Pole_HDL",
-            "fk_ik_left_leg",
-            math.radians(90),
-            [False, True, True],
-            16,
-            7
-            )
-        populate.parent_bones(armature, ["thigh_left_fk_HDL", "thigh_left_ik_HDL"], spine_RST_bones[0], False, False, 'FULL')
-        
-        # Right
-        populate.create_fk_ik_limb(
-            armature,
-            ["thigh_right_RST", "calf_right_RST", "foot_right_RST"], # Ordered as: root, second, third, pole
-            ["thigh_right_fk_HDL", "calf_right_fk_HDL", "foot_right_fk_HDL"], # Ordered as: root, first, second
-            ["thigh_right_ik_HDL", "calf_right_ik_AUX", "foot_right_mech_AUX"], # Ordered as: root, first, second
-            "center_HDL",
-            "leg_right_Pole_HDL",
-            "fk_ik_right_leg",
-            math.radians(90),
-            [False, True, True],
-            16,
-            7
-            )
-        populate.parent_bones(armature, ["thigh_right_fk_HDL", "thigh_right_ik_HDL"], spine_RST_bones[0], False, False, 'FULL')
-
-
-        # Feet
-        # Left
-        populate.assign_bones_to_layers(armature, ["foot_left_mech_AUX"], 7)
-        populate.assign_rotation_mode(armature, ["toe_left_RST"])
-        populate.duplicate_bones(armature, ["toe_left_RST"], ["toe_left_fk_HDL"], 16, True)
-        populate.duplicate_bones(armature, ["toe_left_RST"], ["toe_left_mch_AUX"], 7, True)
-        populate.lock_bone_transforms(armature, ["toe_left_RST"], [True, True, True, True, True, True, True, True, True])
-        populate.lock_bone_transforms(armature, ["toe_left_fk_HDL"], [True, True, True, False, False, False, True, True, True])
-        populate.lock_bone_transforms(armature, ["toe_left_mch_AUX"], [True, True, True, True, True, True, True, True, True])
-        populate.parent_bones(armature, ["toe_left_fk_HDL"], "foot_left_fk_HDL", True, True, 'FULL')
-        populate.bone_create_fk_ik_switch(armature, "toe_left_RST", "toe_left_fk_HDL", "toe_left_mch_AUX", "fk_ik_left_leg")
-
-        populate.create_heel_foot_control(armature, ["foot_left_mech_AUX", "toe_left_mch_AUX"], "foot_left_IK_main_HDL", "fk_ik_left_leg", 7, 16)
-
-        # Right
-        populate.assign_bones_to_layers(armature, ["foot_right_mech_AUX"], 7)
-        populate.assign_rotation_mode(armature, ["toe_right_RST"])
-        populate.duplicate_bones(armature, ["toe_right_RST"], ["toe_right_fk_HDL"], 16, True)
-        populate.duplicate_bones(armature, ["toe_right_RST"], ["toe_right_mch_AUX"], 7, True)
-        populate.lock_bone_transforms(armature, ["toe_right_RST"], [True, True, True, True, True, True, True, True, True])
-        populate.lock_bone_transforms(armature, ["toe_right_fk_HDL"], [True, True, True, False, False, False, True, True, True])
-        populate.lock_bone_transforms(armature, ["toe_right_mch_AUX"], [True, True, True, True, True, True, True, True, True])
-        populate.parent_bones(armature, ["toe_right_fk_HDL"], "foot_right_fk_HDL", True, True, 'FULL')
-        populate.bone_create_fk_ik_switch(armature, "toe_right_RST", "toe_right_fk_HDL", "toe_right_mch_AUX", "fk_ik_right_leg")
-
-        populate.create_heel_foot_control(armature, ["foot_right_mech_AUX", "toe_right_mch_AUX"], "foot_right_IK_main_HDL", "fk_ik_right_leg", 7, 16)
+        # IMPORTANT: It is highly recommended to use populate functions only (through the rig specification)!
+        # A failed build is rolled back by the planner
+        try:
+            with self.profile or contextlib.nullcontext():
+                planner.execute_plan(self.armature, self.plan, self.options)
+        except Exception as error:
+            self.report({'ERROR'}, "Populate failed, the armature is back to the template: " + str(error))
+            return {'CANCELLED'}
+        return self.finish(context)
+
+    def invoke(self, context, event):
+        # From the interface the build runs a few steps per timer event, so the interface stays responsive. One build
+        # session is open for the whole build, the profiler only counts the timer events, and the view can be navigated
+        # in between (see MODAL_PASS_THROUGH_EVENTS)
+        global _modal_build
+        result = self.prepare(context)
+        if result:
+            return result
+        if self.profile:
+            self.profile.begin()
+        self.steps = planner.iterate_plan(self.armature, self.plan, self.options)
+        self.session = populate.BuildSession(self.armature)
+        self.session.__enter__()
+        context.window_manager.progress_begin(0, 100)
+        self.timer = context.window_manager.event_timer_add(MODAL_TIMER_STEP, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        _modal_build = self
+        return {'RUNNING_MODAL'}
 
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            try:
+                # Closing the steps removes what was built
+                self.steps.close()
+            finally:
+                self.stop(context)
+            self.report({'WARNING'}, "Populate cancelled, the armature is back to the template")
+            return {'CANCELLED'}
+        if event.type in MODAL_PASS_THROUGH_EVENTS or event.type.startswith('NDOF_'):
+            return {'PASS_THROUGH'}
+        if event.type != 'TIMER':
+            return {'RUNNING_MODAL'}
+        deadline = time.perf_counter() + MODAL_TIME_SLICE
+        finished = False
+        try:
+            with self.profile.step() if self.profile else contextlib.nullcontext():
+                try:
+                    while time.perf_counter() < deadline:
+                        done, total, module_name = next(self.steps)
+                except StopIteration:
+                    finished = True
+                    # The session runs its queued work at the end of the build
+                    session, self.session = self.session, None
+                    session.close()
+        except Exception as error:
+            self.stop(context)
+            self.report({'ERROR'}, "Populate failed, the armature is back to the template: " + str(error))
+            return {'CANCELLED'}
+        if finished:
+            self.stop(context)
+            return self.finish(context)
+        context.window_manager.progress_update(100.0 * done / total)
+        context.workspace.status_text_set("Populating %s (%d/%d), Esc to cancel" % (module_name, done + 1, total))
+        return {'RUNNING_MODAL'}
 
+    def stop(self, context):
+        global _modal_build
+        _modal_build = None
+        if self.session is not None:
+            # Failed or cancelled: the queued work is dropped, as when execute_plan fails
+            self.session.close(flush=False)
+            self.session = None
+        context.window_manager.event_timer_remove(self.timer)
+        context.window_manager.progress_end()
+        context.workspace.status_text_set(None)
+        if self.profile:
+            self.profile.end()
+
+class OBJECT_OT_update_armature(bpy.types.Operator):
+    """Rebuild only the rig modules whose template bones or splines changed since the last populate"""
+    bl_idname = 'object.update_armature'
+    bl_label = 'Update armature'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        armature = context.scene.armature_ob
+        if not armature:
+            return {'FINISHED'}
+        options = planner.build_options(context.scene, armature)
+        try:
+            spec = planner.armature_spec(planner.spec_path(context.scene), armature, options)
+            plan = planner.compile_plan(spec)
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, "Invalid rig specification: " + str(error))
+            return {'CANCELLED'}
+        try:
+            modules = planner.update_plan(armature, plan, options)
+        except Exception as error:
+            self.report({'ERROR'}, "Update failed, the modules it rebuilt were removed: " + str(error))
+            return {'CANCELLED'}
+        if modules is None:
+            self.report({'WARNING'}, "The armature was not populated with this specification and options: clean and populate it")
+            return {'CANCELLED'}
+        if not modules:
+            self.report({'INFO'}, "Nothing changed since the last populate")
+        else:
+            self.report({'INFO'}, "Rebuilt " + ", ".join(sorted(modules)))
+        return {'FINISHED'}
+
+class OBJECT_OT_switch_rig_lod(bpy.types.Operator):
+    """Rebuild the populated armature at the level of detail chosen in the panel, keeping its animation"""
+    bl_idname = 'object.switch_rig_lod'
+    bl_label = 'Switch level of detail'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        armature = context.scene.armature_ob
+        return bool(armature and manifest.MANIFEST_PROPERTY in armature)
+
+    def execute(self, context):
+        armature = context.scene.armature_ob
+        options = planner.build_options(context.scene)
+        try:
+            spec = planner.armature_spec(planner.spec_path(context.scene), armature, options)
+            plan = planner.compile_plan(spec)
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, "Invalid rig specification: " + str(error))
+            return {'CANCELLED'}
+        start = time.perf_counter()
+        try:
+            planner.rebuild_plan(armature, plan, options)
+        except Exception as error:
+            self.report({'ERROR'}, "Level of detail switch failed, the armature is back to the template: " + str(error))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Armature rebuilt at %s level of detail in %.2f s" % (options['lod'].lower(), time.perf_counter() - start))
+        return {'FINISHED'}
+
+class OBJECT_OT_retarget_armature(bpy.types.Operator):
+    """Give the populated scene armature the proportions of the active armature without populating it again"""
+    bl_idname = 'object.retarget_armature'
+    bl_label = 'Retarget armature'
+
+    @classmethod
+    def poll(cls, context):
+        armature = context.scene.armature_ob
+        return armature and context.active_object and context.active_object.type == 'ARMATURE' and context.active_object != armature
+
+    def execute(self, context):
+        armature = context.scene.armature_ob
+        try:
+            spec = planner.armature_spec(planner.spec_path(context.scene), armature, planner.build_options(context.scene, armature))
+            plan = planner.compile_plan(spec)
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, "Invalid rig specification: " + str(error))
+            return {'CANCELLED'}
+        source = context.active_object
+        try:
+            template_count, derived_count = retarget.retarget_armature(armature, source, plan)
+        except ValueError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Moved %d template bones and %d created bones" % (template_count, derived_count))
+        return {'FINISHED'}
+
+class OBJECT_OT_compare_rigs(bpy.types.Operator):
+    """Compare the deformation of the scene armature with the active armature (e.g. drivers and constraints build modes)"""
+    bl_idname = 'object.compare_rigs'
+    bl_label = 'Compare rigs'
+
+    tolerance: bpy.props.FloatProperty(name='tolerance', default=1e-4, min=0.0)
+    samples: bpy.props.IntProperty(name='samples', default=8, min=1)
+
+    @classmethod
+    def poll(cls, context):
+        armature = context.scene.armature_ob
+        return armature and context.active_object and context.active_object.type == 'ARMATURE' and context.active_object != armature
+
+    def execute(self, context):
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        error, bone_name = equivalence.compare_armatures(context.scene.armature_ob, context.active_object, self.samples)
+        if error > self.tolerance:
+            self.report({'WARNING'}, "Rigs differ by %.6f at bone %s" % (error, bone_name))
+        else:
+            self.report({'INFO'}, "Rigs are equivalent (largest difference %.6f)" % error)
+        return {'FINISHED'}
+
+class OBJECT_OT_diff_rigs(bpy.types.Operator):
+    """Compare the bones, constraints and drivers of the scene armature with the active armature (report in the console)"""
+    bl_idname = 'object.diff_rigs'
+    bl_label = 'Diff rigs'
+
+    tolerance: bpy.props.FloatProperty(name='tolerance', default=1e-4, min=0.0)
+
+    @classmethod
+    def poll(cls, context):
+        armature = context.scene.armature_ob
+        return armature and context.active_object and context.active_object.type == 'ARMATURE' and context.active_object != armature
+
+    def execute(self, context):
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        try:
+            diff = fingerprint.diff_rigs(context.scene.armature_ob, context.active_object, self.tolerance)
+        except ValueError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        print(fingerprint.diff_report(diff))
+        if fingerprint.is_identical(diff):
+            self.report({'INFO'}, "Rigs are identical")
+        else:
+            self.report({'WARNING'}, "Rigs differ: %d removed, %d added, %d changed (see the console)" % (
+                len(diff['removed']), len(diff['added']), len(diff['changed'])))
+        return {'FINISHED'}
+
+class OBJECT_OT_analyze_rig_costs(bpy.types.Operator):
+    """Measure what the constraints and drivers of every rig module cost during playback (report in the console)"""
+    bl_idname = 'object.analyze_rig_costs'
+    bl_label = 'Analyze costs'
+
+    frames: bpy.props.IntProperty(name='frames', default=50, min=1)
+    warmup: bpy.props.IntProperty(name='warmup', default=1, min=0)
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.armature_ob is not None
+
+    def execute(self, context):
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        costs = cost.analyze_costs(context.scene, context.scene.armature_ob, self.frames, self.warmup)
+        print(cost.cost_report(costs))
+        if costs['modules']:
+            module_name, module_ms = costs['modules'][0]
+            self.report({'INFO'}, "Frame %.2f ms, most expensive: %s (%.2f ms)" % (costs['frame_ms'], module_name, module_ms))
+        return {'FINISHED'}
+
+class OBJECT_OT_export_rig(bpy.types.Operator):
+    """Write the scene armature to the rig file"""
+    bl_idname = 'object.export_rig'
+    bl_label = 'Export rig'
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.armature_ob is not None and bool(context.scene.rig_file_path)
+
+    def execute(self, context):
+        path = bpy.path.abspath(context.scene.rig_file_path)
+        try:
+            rigfile.export_rig(context.scene.armature_ob, path)
+        except OSError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Rig written to " + path)
+        return {'FINISHED'}
+
+class OBJECT_OT_import_rig(bpy.types.Operator):
+    """Build the rig of the rig file on the template armature without populating it"""
+    bl_idname = 'object.import_rig'
+    bl_label = 'Import rig'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.armature_ob is not None and bool(context.scene.rig_file_path)
+
+    def execute(self, context):
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        try:
+            created, failed = rigfile.import_rig(context.scene.armature_ob, bpy.path.abspath(context.scene.rig_file_path))
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        if failed:
+            print("Rig file settings not imported:\n" + "\n".join(failed))
+            self.report({'WARNING'}, "Imported %d bones, %d settings could not be written (see the console)" % (created, len(failed)))
+        else:
+            self.report({'INFO'}, "Imported %d bones" % created)
         return {'FINISHED'}
 
 class MESSAGE_WM_delete_previous_popup(bpy.types.Operator):
@@ -305,15 +599,34 @@ class MESSAGE_WM_delete_previous_popup(bpy.types.Operator):
         return {'INTERFACE'}
 
 def register():
+    bpy.app.handlers.save_pre.append(clear_template_cache)
     bpy.utils.register_class(OBJECT_OT_add_source_armature)
     bpy.utils.register_class(OBJECT_OT_clean_armature)
     bpy.utils.register_class(OBJECT_OT_delete_armature)
     bpy.utils.register_class(OBJECT_OT_populate_armature)
+    bpy.utils.register_class(OBJECT_OT_update_armature)
+    bpy.utils.register_class(OBJECT_OT_switch_rig_lod)
+    bpy.utils.register_class(OBJECT_OT_retarget_armature)
+    bpy.utils.register_class(OBJECT_OT_compare_rigs)
+    bpy.utils.register_class(OBJECT_OT_diff_rigs)
+    bpy.utils.register_class(OBJECT_OT_analyze_rig_costs)
+    bpy.utils.register_class(OBJECT_OT_export_rig)
+    bpy.utils.register_class(OBJECT_OT_import_rig)
     bpy.utils.register_class(MESSAGE_WM_delete_previous_popup)
 
 def unregister():
+    bpy.app.handlers.save_pre.remove(clear_template_cache)
+    clear_template_cache()
     bpy.utils.unregister_class(OBJECT_OT_add_source_armature)
     bpy.utils.unregister_class(OBJECT_OT_clean_armature)
     bpy.utils.unregister_class(OBJECT_OT_delete_armature)
     bpy.utils.unregister_class(OBJECT_OT_populate_armature)
+    bpy.utils.unregister_class(OBJECT_OT_update_armature)
+    bpy.utils.unregister_class(OBJECT_OT_switch_rig_lod)
+    bpy.utils.unregister_class(OBJECT_OT_retarget_armature)
+    bpy.utils.unregister_class(OBJECT_OT_compare_rigs)
+    bpy.utils.unregister_class(OBJECT_OT_diff_rigs)
+    bpy.utils.unregister_class(OBJECT_OT_analyze_rig_costs)
+    bpy.utils.unregister_class(OBJECT_OT_export_rig)
+    bpy.utils.unregister_class(OBJECT_OT_import_rig)
     bpy.utils.unregister_class(MESSAGE_WM_delete_previous_popup)
\ No newline at end of file
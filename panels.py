@@ -12,7 +12,27 @@ class VIEW3D_PT_edit_rig(bpy.types.Panel):
         column = layout.column()
         row = layout.row()
         column.operator('wm.delete_previous_popup', text='Add armature')
+        column.prop(context.scene, 'rig_spec_path', text='')
+        column.prop(context.scene, 'rig_driver_mode', text='')
+        column.prop(context.scene, 'rig_switch_mode', text='')
+        column.prop(context.scene, 'rig_lod', text='')
+        column.prop(context.scene, 'rig_symmetry')
+        column.prop(context.scene, 'rig_cache_dir', text='')
+        if context.scene.rig_cache_dir:
+            column.prop(context.scene, 'rig_cache_size')
+        column.prop(context.scene, 'rig_profile')
+        if context.scene.rig_profile:
+            column.prop(context.scene, 'rig_profile_path', text='')
+            column.prop(context.scene, 'rig_profile_format', text='')
         column.operator('object.populate_armature')
+        column.operator('object.update_armature')
+        column.operator('object.switch_rig_lod')
+        column.operator('object.retarget_armature')
+        column.operator('object.analyze_rig_costs')
+        column.prop(context.scene, 'rig_file_path', text='')
+        file_row = column.row(align=True)
+        file_row.operator('object.export_rig')
+        file_row.operator('object.import_rig')
         row.operator('object.clean_armature', icon='PANEL_CLOSE')
         row.operator('object.delete_armature', icon='CANCEL')
 
@@ -0,0 +1,565 @@
+import bpy
+import os
+import copy
+import json
+import math
+import inspect
+from . import populate
+from . import profiler
+from . import manifest
+from . import mirror
+
+# Rig specifications describe a rig as a list of modules (spine, arms, legs...). Every module is a list of operations,
+# and every operation is a call to a populate.py function. The armature is always passed as the first argument.
+#
+# Argument values are JSON values, with some special objects:
+#   {"ref": "<operation id>"}                       Result of another operation (a list of bone names)
+#   {"ref": "<operation id>", "index": i}           One element of that result
+#   {"ref": "<operation id>", "slice": [i, j]}      A part of that result (j may be null)
+#   {"spline": "<object name>"}                     A curve object
+#   {"radians": degrees}                            An angle given in degrees
+#   {"option": "<option name>"}                     A build option (see DEFAULT_OPTIONS)
+#   {"lod": {"FULL": a, "MEDIUM": b, "PROXY": c}}    A value per level of detail (see LODS)
+#
+# Bones created by an operation should be referred to through its id, so the planner knows the dependency.
+#
+# A module with "mirror_of": "<module name>" is the mirror image of an earlier module (same functions in the same
+# order, 'left' and 'right' swapped in the names). With the use_symmetry option it is built by mirroring what the other
+# module created (see mirror.py) when the template bones of both sides are symmetric. Remove "mirror_of" from a module
+# to always build it from its operations.
+#
+# With "spline_chains": {"bones": n, "parent": "<bone name>", "fit_spline": false}, every curve of the template
+# collection named "<name>_SPL" that no operation uses gets a module <name> (see spline_chain_module): tails,
+# tentacles... are rigged by adding curves to the template. The custom properties of CHAIN_PROPERTIES on a curve
+# override these settings for its chain.
+#
+# An operation with "lods": [<levels>] is only built at these levels of detail (see select_lod). Lower levels drop
+# torsion and finger setups and build shorter chains, but keep every control bone, so animation transfers.
+
+DEFAULT_SPEC_PATH = os.path.join(os.path.dirname(__file__), 'specs', 'humanoid.json')
+
+# Build options that specifications can use, with their default values
+DEFAULT_OPTIONS = {
+    'use_constraints': False, # Native constraints instead of drivers where they are equivalent
+    'use_symmetry': False, # Mirror the modules with "mirror_of" instead of building them
+    'use_consolidated_switch': False, # FK-IK switches with one influence driver per bone and no hide drivers
+    'lod': 'FULL', # Level of detail (see LODS)
+}
+
+# Levels of detail, from the most detailed
+LODS = ('FULL', 'MEDIUM', 'PROXY')
+# Bone count of the spline chains at every level of detail, relative to the "spline_chains" bone count
+LOD_CHAIN_SCALE = {'FULL': 1.0, 'MEDIUM': 0.5, 'PROXY': 0.25}
+
+# Settings of the "spline_chains" of a specification and their default values
+DEFAULT_SPLINE_CHAIN = {'bones': 8, 'parent': None, 'fit_spline': False}
+# Curve custom properties overriding the "spline_chains" settings
+CHAIN_PROPERTIES = {'bones': 'rig_chain_bones', 'parent': 'rig_chain_parent', 'fit_spline': 'rig_chain_fit'}
+SPLINE_SUFFIX = '_SPL'
+
+# Populate functions allowed in a rig specification: (mode the function works in, parameters that take bone names)
+# 'MIXED' functions switch modes by themselves, 'ANY' functions queue their work to the end of the build
+OPERATIONS = {
+    'assign_bones_to_layers': ('EDIT', ('bone_names_array',)),
+    'parent_bones': ('EDIT', ('bone_names_array', 'parent_bone')),
+    'assign_rotation_mode': ('ANY', ('bone_names_array',)),
+    'lock_bone_transforms': ('ANY', ('bone_names_array',)),
+    'bone_copy_rotation_constraint': ('POSE', ('bone_names_array', 'target_bone_name')),
+    'bone_copy_transforms_constraint': ('POSE', ('bone_names_array', 'target_bone_name')),
+    'bone_IK_constraint': ('POSE', ('bone_names_array', 'target_bone_name', 'pole_bone_name')),
+    'bone_child_of_constraint': ('POSE', ('bone_names_array', 'target_bone_name')),
+    'bone_damped_track_constraint': ('POSE', ('bone_names_array', 'target_bone_name')),
+    'bone_limit_rotation_constraint': ('POSE', ('bone_names_array',)),
+    'delete_bone_constraints_and_drivers': ('POSE', ('bone_names_array',)),
+    'chain_torsion': ('POSE', ('result_bone_array', 'bone0_name', 'bone1_name')),
+    'bone_add_hide_driver': ('POSE', ('bone_name',)),
+    'bone_create_fk_ik_switch': ('POSE', ('result_bone', 'fk_bone', 'ik_bone')),
+    'finger_drivers_and_constraints': ('POSE', ('finger_names_array',)),
+    'thumb_drivers_and_constraints': ('POSE', ('finger_names_array',)),
+    'object_child_of_constraint': ('OBJECT', ('object', 'target_bone_name')),
+    'duplicate_bones': ('MIXED', ('bone_names_array', 'new_bone_names_array')),
+    'create_spline_chain': ('MIXED', ('spline',)),
+    'create_spline_hooks': ('MIXED', ('spline',)),
+    'connect_tail_head': ('MIXED', ('tail_bone_name', 'head_bone_name', 'new_bone_name')),
+    'add_bone_axis': ('MIXED', ('new_bone_name', 'ref_bone_name', 'parent_name')),
+    'create_fk_ik_limb': ('MIXED', ('bone_names_array', 'fk_names_array', 'ik_names_array', 'center_bone_name', 'pole_bone_name')),
+    'create_forarm_torsion_bones': ('MIXED', ('forearm_hand_array',)),
+    'create_heel_foot_control': ('MIXED', ('mch_names_array', 'ik_main_name')),
+}
+
+class Operation:
+    """A populate function call of a rig specification"""
+
+    def __init__(self, module, index, function_name, args, id):
+        self.module = module
+        self.index = index
+        self.function_name = function_name
+        self.args = args
+        self.id = id
+        self.mode = OPERATIONS[function_name][0]
+        self.tokens = set()
+        self.dependencies = set()
+
+    def __repr__(self):
+        return "<Operation " + self.module + ":" + self.function_name + ">"
+
+class MirrorStep:
+    """The operations of a module, run as the mirror of its source module (symmetry mode)"""
+
+    def __init__(self, module, source, operations, source_operations):
+        self.module = module
+        self.source = source
+        self.operations = operations
+        self.source_operations = source_operations
+        self.index = operations[0].index
+        self.function_name = 'mirror_module'
+        self.id = None
+        self.mode = 'MIXED'
+        self.tokens = set().union(*[operation.tokens for operation in operations])
+        self.dependencies = set()
+
+    def __repr__(self):
+        return "<MirrorStep " + self.module + ":" + self.source + ">"
+
+class Plan:
+    """Operations of a rig specification in execution order"""
+
+    def __init__(self, spec, operations):
+        self.spec = spec
+        self.operations = operations
+        self.passes = count_passes(operations)
+
+def load_spec(path):
+    """Load a rig specification from a JSON file"""
+    with open(path, 'r') as spec_file:
+        return json.load(spec_file)
+
+def spec_path(scene):
+    """Path of the rig specification used by a scene"""
+    if scene.rig_spec_path:
+        return bpy.path.abspath(scene.rig_spec_path)
+    return DEFAULT_SPEC_PATH
+
+def build_options(scene, armature=None):
+    """Build options chosen in a scene. With a populated armature, the level of detail is the one it was built at"""
+    options = dict(DEFAULT_OPTIONS)
+    options['use_constraints'] = scene.rig_driver_mode == 'CONSTRAINTS'
+    options['use_symmetry'] = scene.rig_symmetry
+    options['use_consolidated_switch'] = scene.rig_switch_mode == 'CONSOLIDATED'
+    options['lod'] = scene.rig_lod
+    build_manifest = manifest.read_manifest(armature) if armature else None
+    if build_manifest and build_manifest.get('lod'):
+        options['lod'] = build_manifest['lod']
+    return options
+
+def armature_spec(path, armature, options):
+    """Rig specification of a file for an armature: with the spline chain modules of its curves, at the level of detail
+    of the build options"""
+    return select_lod(expand_spline_chains(load_spec(path), armature), options.get('lod', DEFAULT_OPTIONS['lod']))
+
+def template_splines(armature):
+    """Curve objects of the template collection of an armature"""
+    return [ob for ob in armature.users_collection[0].objects if ob.type == 'CURVE']
+
+def spline_chain_module(spline_name, settings):
+    """Module rigging a curve with a chain of settings['bones'] bones following it (Spline IK), a hook per control point
+    moving with the first one and the torsion of the first and last hooks distributed along the chain (shorter chains and
+    no torsion at lower levels of detail)"""
+    name = spline_name[:-len(SPLINE_SUFFIX)]
+    spline = {'spline': spline_name}
+    chain, hooks = name + '_chain', name + '_hooks'
+    first_hook = {'ref': hooks, 'index': 0}
+    cuts = {lod: max(1, round(settings['bones'] * LOD_CHAIN_SCALE[lod])) - 1 for lod in LODS}
+    operations = [
+        {'id': chain, 'function': 'create_spline_chain', 'args': [spline, {'lod': cuts}, name, settings['fit_spline']]},
+        {'id': hooks, 'function': 'create_spline_hooks', 'args': [spline, name]},
+        {'function': 'chain_torsion', 'args': [{'ref': chain}, first_hook, {'ref': hooks, 'index': -1}, {'option': 'use_constraints'}], 'lods': ['FULL', 'MEDIUM']},
+        {'function': 'parent_bones', 'args': [{'ref': hooks, 'slice': [1, None]}, first_hook, False, True, 'FULL']},
+        {'function': 'bone_child_of_constraint', 'args': [[{'ref': chain, 'index': 0}], first_hook, [True, True, True, True, True, True, False, False, False]]},
+        {'function': 'object_child_of_constraint', 'args': [spline, first_hook, [True, True, True, True, True, True, True, True, True]]},
+        {'function': 'lock_bone_transforms', 'args': [{'ref': hooks, 'slice': [1, -1]}, [False, False, False, False, True, False, True, True, True]]},
+    ]
+    if settings['parent']:
+        operations.append({'function': 'parent_bones', 'args': [[first_hook], settings['parent'], False, True, 'FULL']})
+        operations.append({'function': 'parent_bones', 'args': [[{'ref': chain, 'index': 0}], settings['parent'], False, False, 'FULL']})
+    return {'name': name, 'section': 'Spline chains', 'operations': operations}
+
+def expand_spline_chains(spec, armature):
+    """Rig specification with a spline chain module for every template curve of the armature named <name>_SPL that no
+    operation uses (only if the specification has "spline_chains"). Raises ValueError if the chain settings are invalid"""
+    if not isinstance(spec, dict) or 'spline_chains' not in spec:
+        return spec
+    defaults = dict(DEFAULT_SPLINE_CHAIN)
+    if not isinstance(spec['spline_chains'], dict) or not set(spec['spline_chains']) <= set(defaults):
+        raise ValueError("'spline_chains' settings must be some of " + ", ".join(sorted(defaults)))
+    defaults.update(spec['spline_chains'])
+    used = set()
+    for module in spec.get('modules', []):
+        for entry in module.get('operations', []):
+            for item in _walk_values(entry.get('args', [])):
+                if isinstance(item, dict) and 'spline' in item:
+                    used.add(item['spline'])
+    modules = []
+    for spline in sorted(template_splines(armature), key=lambda ob: ob.name):
+        if not spline.name.endswith(SPLINE_SUFFIX) or spline.name in used:
+            continue
+        settings = dict(defaults)
+        for key, property_name in CHAIN_PROPERTIES.items():
+            if property_name in spline:
+                settings[key] = spline[property_name]
+        if not isinstance(settings['bones'], int) or not 1 <= settings['bones'] <= populate.SPLINE_IK_MAX_BONES:
+            raise ValueError("Curve '" + spline.name + "': a spline chain has 1 to " + str(populate.SPLINE_IK_MAX_BONES) + " bones")
+        settings['fit_spline'] = bool(settings['fit_spline'])
+        modules.append(spline_chain_module(spline.name, settings))
+    if not modules:
+        return spec
+    expanded = dict(spec)
+    expanded['modules'] = spec['modules'] + modules
+    return expanded
+
+def _lod_value(value, lod):
+    """Argument value at a level of detail"""
+    if isinstance(value, list):
+        return [_lod_value(item, lod) for item in value]
+    if isinstance(value, dict) and 'lod' in value:
+        if len(value) != 1 or not isinstance(value['lod'], dict) or lod not in value['lod']:
+            raise ValueError("No " + lod + " value in " + str(value))
+        return value['lod'][lod]
+    return value
+
+def select_lod(spec, lod):
+    """Rig specification at a level of detail: the operations whose "lods" don't list it are dropped (and the modules
+    left without operations), and the {"lod": ...} values are replaced. Raises ValueError if a level is unknown"""
+    if lod not in LODS:
+        raise ValueError("Unknown level of detail " + str(lod))
+    if not isinstance(spec, dict) or not isinstance(spec.get('modules'), list):
+        return spec
+    modules = []
+    for module in spec['modules']:
+        if not isinstance(module, dict) or not isinstance(module.get('operations'), list):
+            modules.append(module)
+            continue
+        operations = []
+        for entry in module['operations']:
+            lods = entry.get('lods', LODS) if isinstance(entry, dict) else LODS
+            if not set(lods) <= set(LODS):
+                raise ValueError("Module '" + str(module.get('name')) + "': unknown levels of detail in " + str(lods))
+            if lod not in lods:
+                continue
+            if isinstance(entry, dict):
+                entry = {key: _lod_value(value, lod) if key == 'args' else value for key, value in entry.items() if key != 'lods'}
+            operations.append(entry)
+        if operations:
+            modules.append(dict(module, operations=operations))
+    return dict(spec, modules=modules)
+
+def _walk_values(value):
+    """Yield a value and all the values nested in its lists"""
+    yield value
+    if isinstance(value, list):
+        for item in value:
+            yield from _walk_values(item)
+
+def _check_value(value, where):
+    """Check the special objects of an argument value"""
+    for item in _walk_values(value):
+        if not isinstance(item, dict):
+            continue
+        if 'ref' in item:
+            if not set(item) <= {'ref', 'index', 'slice'}:
+                raise ValueError(where + ": unknown keys in " + str(item))
+            if 'index' in item and 'slice' in item:
+                raise ValueError(where + ": 'index' and 'slice' can't be used together")
+        elif 'spline' in item or 'radians' in item:
+            if len(item) != 1:
+                raise ValueError(where + ": unknown keys in " + str(item))
+        elif 'option' in item:
+            if len(item) != 1 or item['option'] not in DEFAULT_OPTIONS:
+                raise ValueError(where + ": unknown build option " + str(item))
+        else:
+            raise ValueError(where + ": unknown argument object " + str(item))
+
+def _value_tokens(value):
+    """Names of the bones, operation results and objects an argument value refers to"""
+    tokens = set()
+    for item in _walk_values(value):
+        if isinstance(item, str):
+            tokens.add(item)
+        elif isinstance(item, dict) and 'ref' in item:
+            tokens.add('@' + item['ref'])
+        elif isinstance(item, dict) and 'spline' in item:
+            tokens.add('spline:' + item['spline'])
+    return tokens
+
+def validate_spec(spec):
+    """Check a rig specification and return its operations in specification order. Raises ValueError if invalid"""
+    if not isinstance(spec, dict) or not isinstance(spec.get('modules'), list):
+        raise ValueError("A rig specification must be an object with a 'modules' list")
+    operations = []
+    module_names = set()
+    ids = {}
+    for module in spec['modules']:
+        name = module.get('name')
+        if not isinstance(name, str) or name in module_names:
+            raise ValueError("Every module needs a unique name (" + str(name) + ")")
+        module_names.add(name)
+        if not isinstance(module.get('operations'), list):
+            raise ValueError("Module '" + name + "' needs an 'operations' list")
+        for entry in module['operations']:
+            where = name + "[" + str(len(operations)) + "]"
+            function_name = entry.get('function')
+            if function_name not in OPERATIONS:
+                raise ValueError(where + ": '" + str(function_name) + "' is not a populate operation")
+            args = entry.get('args', [])
+            if not isinstance(args, list):
+                raise ValueError(where + ": 'args' must be a list")
+            try:
+                signature = inspect.signature(getattr(populate, function_name))
+                bound = signature.bind(None, *args)
+            except TypeError as error:
+                raise ValueError(where + ": " + function_name + " " + str(error))
+            operation = Operation(name, len(operations), function_name, args, entry.get('id'))
+            for parameter in OPERATIONS[function_name][1]:
+                operation.tokens |= _value_tokens(bound.arguments.get(parameter))
+            for arg in args:
+                _check_value(arg, where)
+                operation.tokens |= {token for token in _value_tokens(arg) if token.startswith('@')}
+            for token in operation.tokens:
+                if token.startswith('@') and token[1:] not in ids:
+                    raise ValueError(where + ": operation id '" + token[1:] + "' is unknown or defined later")
+            if operation.id:
+                if operation.id in ids:
+                    raise ValueError(where + ": duplicated operation id '" + operation.id + "'")
+                ids[operation.id] = operation
+                operation.tokens.add('@' + operation.id)
+            operations.append(operation)
+        source = module.get('mirror_of')
+        if source is not None:
+            source_modules = [item for item in spec['modules'] if item.get('name') == source and item is not module]
+            if not source_modules or 'mirror_of' in source_modules[0] or source not in module_names:
+                raise ValueError("Module '" + name + "': 'mirror_of' must name an earlier module that is not a mirror")
+            functions = [entry.get('function') for entry in module['operations']]
+            if functions != [entry.get('function') for entry in source_modules[0]['operations']]:
+                raise ValueError("Module '" + name + "' must have the operations of '" + source + "' to be its mirror")
+    return operations
+
+def resolve_dependencies(operations):
+    """Every operation depends on the last previous operation that shares a bone, a result or an object with it"""
+    last_users = {}
+    for operation in operations:
+        for token in operation.tokens:
+            if token in last_users:
+                operation.dependencies.add(last_users[token])
+            last_users[token] = operation
+
+def _start_mode(operation, mode):
+    """Mode an operation needs when it starts in mode ('MIXED' operations start creating bones in edit mode)"""
+    if operation.mode == 'MIXED':
+        return 'EDIT'
+    if operation.mode == 'ANY':
+        return mode
+    return operation.mode
+
+def _end_mode(operation, mode):
+    """Mode an operation started in mode leaves the armature in ('MIXED' operations end with pose mode work)"""
+    if operation.mode == 'MIXED':
+        return 'POSE'
+    if operation.mode == 'ANY':
+        return mode
+    return operation.mode
+
+def order_operations(operations):
+    """Topological order of the operations that stays in the same mode as long as possible"""
+    dependents = {operation: [] for operation in operations}
+    pending = {}
+    for operation in operations:
+        pending[operation] = len(operation.dependencies)
+        for dependency in operation.dependencies:
+            dependents[dependency].append(operation)
+    ready = [operation for operation in operations if pending[operation] == 0]
+    ordered = []
+    mode = None
+    while ready:
+        same_mode = [operation for operation in ready if _start_mode(operation, mode) == mode]
+        operation = min(same_mode or ready, key=lambda o: o.index)
+        ready.remove(operation)
+        ordered.append(operation)
+        mode = _end_mode(operation, mode)
+        for dependent in dependents[operation]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+    if len(ordered) != len(operations):
+        raise ValueError("Circular dependency between rig operations")
+    return ordered
+
+def count_passes(operations):
+    """Number of mode switches needed to run operations in order"""
+    passes = 0
+    mode = None
+    for operation in operations:
+        if _start_mode(operation, mode) != mode:
+            passes += 1
+        if _end_mode(operation, mode) != _start_mode(operation, mode):
+            passes += 1
+        mode = _end_mode(operation, mode)
+    return passes
+
+def compile_plan(spec):
+    """Validate a rig specification and compile it into an execution plan"""
+    operations = validate_spec(spec)
+    resolve_dependencies(operations)
+    return Plan(spec, order_operations(operations))
+
+def mirrored_modules(plan, options):
+    """Modules built by mirroring ({module: source module}) with these build options"""
+    if not options.get('use_symmetry'):
+        return {}
+    return {module['name']: module['mirror_of'] for module in plan.spec['modules'] if module.get('mirror_of')}
+
+def execution_order(plan, mirrors):
+    """Order of the plan operations with the operations of the mirrored modules replaced by one MirrorStep each, run
+    once their source module is built. The plan order is kept if the steps can't be scheduled"""
+    if not mirrors:
+        return plan.operations
+    steps = {}
+    for module, source in mirrors.items():
+        operations = [operation for operation in plan.operations if operation.module == module]
+        source_operations = sorted([operation for operation in plan.operations if operation.module == source], key=lambda o: o.index)
+        steps[module] = MirrorStep(module, source, operations, source_operations)
+    nodes = {}
+    for operation in plan.operations:
+        if operation.module in steps:
+            nodes[operation] = steps[operation.module]
+        else:
+            nodes[operation] = copy.copy(operation)
+            nodes[operation].dependencies = set()
+    for operation in plan.operations:
+        node = nodes[operation]
+        node.dependencies |= {nodes[dependency] for dependency in operation.dependencies if nodes[dependency] is not node}
+    for step in steps.values():
+        step.dependencies |= {nodes[operation] for operation in step.source_operations}
+    try:
+        return order_operations(list(dict.fromkeys(nodes.values())))
+    except ValueError:
+        return plan.operations
+
+def resolve_value(value, results, options):
+    """Turn an argument value of the specification into the value passed to the populate function"""
+    if isinstance(value, list):
+        return [resolve_value(item, results, options) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if 'option' in value:
+        return options.get(value['option'], DEFAULT_OPTIONS[value['option']])
+    if 'radians' in value:
+        return math.radians(value['radians'])
+    if 'spline' in value:
+        spline = bpy.data.objects.get(value['spline'])
+        if spline is None or spline.type != 'CURVE':
+            raise ValueError("Spline object '" + value['spline'] + "' not found")
+        return spline
+    result = results[value['ref']]
+    if 'index' in value:
+        return result[value['index']]
+    if 'slice' in value:
+        return result[value['slice'][0]:value['slice'][1]]
+    return result
+
+def execute_plan(armature, plan, options=None, modules=None, previous=None):
+    """Run the operations of a plan on the armature and record them in the build manifest. Returns the results of the
+    operations with id. With modules, only the operations of these modules are run on top of the previous build"""
+    steps = iterate_plan(armature, plan, options, modules, previous)
+    with populate.BuildSession(armature):
+        try:
+            while True:
+                next(steps)
+        except StopIteration as done:
+            return done.value
+
+def iterate_plan(armature, plan, options=None, modules=None, previous=None):
+    """execute_plan one step (operation or mirrored module) at a time: yields (steps done, step count, module of the
+    next step) before every step and returns the results. The build is a transaction: when a step fails or the
+    generator is closed before the end (cancelled), what it built is removed and the template bones get their settings
+    back. The steps must run inside a populate.BuildSession: execute_plan runs them all in one, and a modal build keeps
+    one open from the first step to the end of the build"""
+    if options is None:
+        options = DEFAULT_OPTIONS
+    sections = {module['name']: module.get('section', module['name']) for module in plan.spec['modules']}
+    recorder = manifest.BuildRecorder(armature, plan, options, previous)
+    results = dict(recorder.manifest['results'])
+    steps = [step for step in execution_order(plan, mirrored_modules(plan, options)) if modules is None or step.module in modules]
+    try:
+        if modules is not None:
+            manifest.remove_modules(armature, recorder.manifest, modules)
+        for index, step in enumerate(steps):
+            yield index, len(steps), step.module
+            with profiler.section(sections[step.module]), profiler.section(step.module):
+                if isinstance(step, MirrorStep):
+                    _run_mirror_step(armature, recorder, step, results, options)
+                else:
+                    _run_operation(recorder, step, results, options)
+    except BaseException:
+        # Cancelled (GeneratorExit) or failed
+        _rollback(armature, recorder, modules, previous)
+        raise
+    recorder.finish(sections if modules is None else modules)
+    return results
+
+def _rollback(armature, recorder, modules, previous):
+    """Remove what a build created and give the template bones their settings back"""
+    recorder.flush()
+    manifest.remove_modules(armature, recorder.manifest, list(recorder.manifest['modules'] if modules is None else modules))
+    if previous is None:
+        manifest.clear_manifest(armature)
+    else:
+        # Rebuilt modules are missing from the manifest, so the next update builds them
+        manifest.write_manifest(armature, recorder.manifest)
+
+def _run_operation(recorder, operation, results, options):
+    args = [resolve_value(arg, results, options) for arg in operation.args]
+    result = recorder.record(operation, getattr(populate, operation.function_name), args)
+    if operation.id:
+        results[operation.id] = result
+
+def _run_mirror_step(armature, recorder, step, results, options):
+    """Mirror the source module of a step, or run its operations if the two sides are not symmetric"""
+    bone_names = [token for token in step.tokens if not token.startswith(('@', 'spline:'))]
+    spline_names = [token[len('spline:'):] for token in step.tokens if token.startswith('spline:')]
+    # The source module may be the one being recorded
+    recorder.flush()
+    if not (mirror.can_mirror(armature, recorder.manifest, step.source) and mirror.symmetric_inputs(armature, bone_names, spline_names)):
+        for operation in step.operations:
+            _run_operation(recorder, operation, results, options)
+        return
+    recorder.record(step, mirror.mirror_module, [recorder.manifest, step.source])
+    operations = sorted(step.operations, key=lambda o: o.index)
+    for operation, source_operation in zip(operations, step.source_operations):
+        if operation.id and source_operation.id in results:
+            results[operation.id] = recorder.manifest['results'][operation.id] = mirror.mirror_value(results[source_operation.id])
+
+def rebuild_plan(armature, plan, options=None):
+    """Remove everything the last build created and run the plan again, e.g. at another level of detail. Animation is
+    kept, as control bones have the same names at every level. Returns the results of the operations with id"""
+    if armature.mode == 'EDIT':
+        populate.enter_object_mode()
+    previous = manifest.read_manifest(armature)
+    if previous is None:
+        raise ValueError("The armature has no build manifest, clean it and populate it again")
+    with populate.BuildSession(armature):
+        manifest.remove_modules(armature, previous, list(previous['modules']))
+        manifest.clear_manifest(armature)
+        return execute_plan(armature, plan, options)
+
+def update_plan(armature, plan, options=None):
+    """Rebuild the modules whose template bones or splines changed since the last build, and the modules depending on
+    them. Returns the rebuilt module names, or None if the armature must be cleaned and populated again"""
+    if options is None:
+        options = DEFAULT_OPTIONS
+    if armature.mode == 'EDIT':
+        populate.enter_object_mode()
+    previous = manifest.read_manifest(armature)
+    modules = manifest.changed_modules(armature, plan, options, previous)
+    if modules:
+        execute_plan(armature, plan, options, modules, previous)
+    return modules
@@ -2,12 +2,160 @@ from math import pi
 import bpy
 import mathutils
 import math
+import json
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from . import geometry
 
 # List of functions intended to build the rig. They will be used in OBJECT_OT_populate_armature() (operators.py)
 # IMPORTANT: operators.OBJECT_OT_populate_armature() should be able to do its job by using populate.py functions only
 
+# Active build session (see BuildSession). None when populate functions are called on their own
+_session = None
+
+def unprofiled(function):
+    """Decorator of the functions the profiler does not wrap (see profiler.py): helpers that build nothing and are
+    called too often to be worth a span"""
+    function.profiled = False
+    return function
+
+unprofiled.profiled = False
+
+class BuildSession:
+    """Batch the mode switches of populate functions while an armature is being built.
+    Inside the session enter_edit_mode and enter_pose_mode only switch when the object is not already in that mode,
+    and work can be queued with edit() and pose() to be run in a single mode switch per group by flush().
+    Edit and pose bones looked up by name are cached until the next mode switch (see _edit_bone and _pose_bone).
+    Rotation modes and transform locks are gathered for the whole build and written in one pass by flush().
+    Heads, tails and rolls of the bones derived from other bones are queued and written in one pass before edit mode is
+    left (see place_bones).
+    The bone registry of the armature (see registry.bone_registry) is built once per session and updated as bones are
+    created and renamed.
+    Operators called from Python push no undo steps of their own, so a build is the single undo step of the operator
+    that runs it"""
+
+    def __init__(self, armature):
+        self.armature = armature
+        self.mode_switches = 0
+        self.edit_bones = {}
+        self.pose_bones = {}
+        self.edit_queue = []
+        self.pose_queue = []
+        self.pose_settings = {}
+        self.placements = {}
+        self.frames = None
+        self.registry = None
+        self.previous = None
+
+    def __enter__(self):
+        global _session
+        self.previous = _session
+        _session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+        return False
+
+    def close(self, flush=True):
+        """Leave the session, running its queued work with flush (not for a failed or cancelled build)"""
+        global _session
+        try:
+            if flush:
+                self.flush()
+        finally:
+            _session = self.previous
+
+    def edit(self, function, *args):
+        """Queue a populate function that works in edit mode"""
+        self.edit_queue.append((function, args))
+
+    def pose(self, function, *args):
+        """Queue a populate function that works in pose mode"""
+        self.pose_queue.append((function, args))
+
+    def flush(self):
+        """Run the queued work: all edit mode work first, then all pose mode work"""
+        edit_queue, self.edit_queue = self.edit_queue, []
+        pose_queue, self.pose_queue = self.pose_queue, []
+        if edit_queue:
+            enter_edit_mode(self.armature)
+            for function, args in edit_queue:
+                function(*args)
+        write_placements(self.armature)
+        if pose_queue:
+            enter_pose_mode(self.armature)
+            for function, args in pose_queue:
+                function(*args)
+        pose_settings, self.pose_settings = self.pose_settings, {}
+        if pose_settings:
+            if self.armature.mode == 'EDIT':
+                enter_pose_mode(self.armature)
+            write_pose_settings(self.armature, pose_settings)
+
+def _in_mode(object, mode):
+    """True if a build session is active and object is already the active object in mode"""
+    if _session is None:
+        return False
+    return bpy.context.view_layer.objects.active is object and object.mode == mode
+
+def _count_mode_switch():
+    if _session is not None:
+        _session.mode_switches += 1
+        # Queued placements are written while still in edit mode
+        write_placements(_session.armature)
+        _session.frames = None
+        # Edit bones are created again when entering edit mode and pose bones when leaving it
+        _session.edit_bones.clear()
+        _session.pose_bones.clear()
+
+@unprofiled
+def build_session(armature):
+    """Build session open on armature (None if there is none)"""
+    if _session is None or _session.armature != armature:
+        return None
+    return _session
+
+def _session_cache(armature, cache_name):
+    """Bone cache of the build session for armature (None if there is no session on it)"""
+    session = build_session(armature)
+    if session is None:
+        return None
+    return getattr(session, cache_name)
+
+def _edit_bone(armature, name):
+    """(REQUIRES EDIT MODE) armature.data.edit_bones[name], cached inside a build session"""
+    cache = _session_cache(armature, 'edit_bones')
+    if cache is None:
+        return armature.data.edit_bones[name]
+    edit_bone = cache.get(name)
+    # A renamed bone keeps its old cache key
+    if edit_bone is None or edit_bone.name != name:
+        edit_bone = cache[name] = armature.data.edit_bones[name]
+    return edit_bone
+
+def _pose_bone(armature, name):
+    """armature.pose.bones[name], cached inside a build session"""
+    cache = _session_cache(armature, 'pose_bones')
+    if cache is None:
+        return armature.pose.bones[name]
+    pose_bone = cache.get(name)
+    if pose_bone is None or pose_bone.name != name:
+        pose_bone = cache[name] = armature.pose.bones[name]
+    return pose_bone
+
+def snap_cursor_to_center():
+    """Reset the 3D cursor like view3d.snap_cursor_to_center, without needing a 3D view (background mode)"""
+    bpy.context.scene.cursor.matrix = mathutils.Matrix()
+
 def enter_edit_mode(object):
     """Enters edit mode from any situation"""
+    if _in_mode(object, 'EDIT'):
+        snap_cursor_to_center()
+        return
+    _count_mode_switch()
     if bpy.context.mode == 'OBJECT':
         bpy.context.view_layer.objects.active = object
     else:
@@ -16,10 +164,13 @@ def enter_edit_mode(object):
     bpy.context.view_layer.objects.active = object
     object.select_set(True)
     bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.view3d.snap_cursor_to_center()
+    snap_cursor_to_center()
 
 def enter_pose_mode(armature):
     """Enters pose mode from any situation"""
+    if _in_mode(armature, 'POSE'):
+        return
+    _count_mode_switch()
     if bpy.context.mode == 'OBJECT':
         bpy.context.view_layer.objects.active = armature
     else:
@@ -28,7 +179,56 @@ def enter_pose_mode(armature):
     bpy.context.view_layer.objects.active = armature
     armature.select_set(True)
     bpy.ops.object.mode_set(mode='POSE')
-    bpy.ops.view3d.snap_cursor_to_center()
+    snap_cursor_to_center()
+
+def enter_object_mode():
+    """Enters object mode from any situation"""
+    if _session is not None and bpy.context.mode == 'OBJECT':
+        return
+    _count_mode_switch()
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+# Bone names are <part>_<side>_<tags>_<role>. The side ('left' or 'right') and the tags (e.g. 'fk', 'ik', 'torsion') are
+# optional and the role is the suffix: RST for result bones, HDL for handles, AUX for auxiliary bones (SPL for splines)
+BONE_ROLES = ('RST', 'HDL', 'AUX', 'SPL')
+BONE_SIDES = ('left', 'right')
+
+@unprofiled
+def parse_bone_name(name):
+    """Split a bone name in (part, side, tags, role). Without a side every token but the role is part of the part"""
+    tokens = name.split('_')
+    role = None
+    if len(tokens) > 1 and tokens[-1] in BONE_ROLES:
+        role = tokens.pop()
+    for idx, token in enumerate(tokens):
+        if token in BONE_SIDES and idx > 0:
+            return "_".join(tokens[:idx]), token, tokens[idx+1:], role
+    return "_".join(tokens), None, [], role
+
+@unprofiled
+def bone_name(part, side, tags, role):
+    """Join the tokens of a bone name (see parse_bone_name)"""
+    return "_".join([part] + ([side] if side else []) + list(tags) + ([role] if role else []))
+
+@unprofiled
+def derived_bone_name(name, tags, role=None):
+    """Name of a bone created from another one: same part and side, other tags (and role)"""
+    part, side, _, old_role = parse_bone_name(name)
+    return bone_name(part, side, tags, role or old_role)
+
+@unprofiled
+def chain_bone_name(prefix, idx, count, role):
+    """Name of the bone of index idx in a chain of count bones: prefix, number from 1 (zero padded to the digits of
+    count, at least two) and role, e.g. spine03_HDL"""
+    return prefix + str(idx+1).zfill(max(2, len(str(count)))) + "_" + role
+
+def bone_layers_array(lay):
+    """Return the 32 element layers array with only the layer of index lay enabled"""
+    layer = []
+    for idx in range(0,32):
+        layer.append(False)
+    layer[lay] = True
+    return layer
 
 def assign_selected_to_bones_layer(lay):
     """(REQUIRES BONE SELECTION) Assign selected bones to the layer of index lay"""
@@ -38,25 +238,320 @@ def assign_selected_to_bones_layer(lay):
     if bpy.context.mode != 'EDIT_ARMATURE':
         print("Not in Edit Armature mode")
         return
-    layer = []
-    for idx in range(0,32):
-        layer.append(False)
-    layer[lay] = True
-    bpy.ops.armature.bone_layers(layers=layer)
+    bpy.ops.armature.bone_layers(layers=bone_layers_array(lay))
 
 def assign_bones_to_layers(armature, bone_names_array, lay):
     """Assign a layer to a collection of bones"""
+    if lay not in range(0,32):
+        print("Layer is not in range(0,32)")
+        return
     enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
+    layer = bone_layers_array(lay)
     for name in bone_names_array:
-        armature.data.edit_bones[name]. select = True
-    assign_selected_to_bones_layer(lay)
+        _edit_bone(armature, name).layers = layer
+
+# Edit bone settings copied to duplicated and subdivided bones (besides head, tail, roll and layers)
+EDIT_BONE_SETTINGS = (
+    'use_deform',
+    'use_inherit_rotation',
+    'inherit_scale',
+    'use_local_location',
+    'use_relative_parent',
+    'use_envelope_multiply',
+    'envelope_distance',
+    'envelope_weight',
+    'head_radius',
+    'tail_radius',
+    'bbone_segments',
+    'bbone_x',
+    'bbone_z',
+    'show_wire',
+)
+
+# Pose bone settings copied to duplicated bones
+POSE_BONE_SETTINGS = (
+    'rotation_mode',
+    'lock_location',
+    'lock_rotation',
+    'lock_rotation_w',
+    'lock_scale',
+    'custom_shape',
+    'custom_shape_transform',
+    'bone_group',
+)
+
+# Unit vectors for the axis names used in add_bone_axis
+AXIS_VECTORS = {
+    '+X': mathutils.Vector((1.0, 0.0, 0.0)),
+    '+Y': mathutils.Vector((0.0, 1.0, 0.0)),
+    '+Z': mathutils.Vector((0.0, 0.0, 1.0)),
+    '-X': mathutils.Vector((-1.0, 0.0, 0.0)),
+    '-Y': mathutils.Vector((0.0, -1.0, 0.0)),
+    '-Z': mathutils.Vector((0.0, 0.0, -1.0)),
+}
+
+def new_edit_bone(armature, name, head, tail, roll, layers, is_deletable):
+    """(REQUIRES EDIT MODE) Create a bone with exact coordinates through armature.data.edit_bones. No selection or cursor involved.
+    The returned bone's name may differ from name if it is already taken. With head None, the bone is placed by place_bones"""
+    edit_bone = armature.data.edit_bones.new(name)
+    if head is not None:
+        edit_bone.head = head
+        edit_bone.tail = tail
+        edit_bone.roll = roll
+    edit_bone.layers = layers
+    edit_bone.deletable = is_deletable
+    session = build_session(armature)
+    if session is not None:
+        session.edit_bones[edit_bone.name] = edit_bone
+        if session.registry is not None:
+            session.registry.add(edit_bone.name)
+    return edit_bone
+
+# Bone placements: heads, tails and rolls of the bones derived from other bones are computed with NumPy from one
+# foreach_get of the edit bones, and queued in the build session to be written with one foreach_set per attribute
+# (write_placements) before bones are connected and before edit mode is left. Without NumPy or outside of a build
+# session, bones are read and placed one by one
+
+def _read_frames(armature):
+    """Bone names to rows, heads, tails and rolls of all edit bones, with one foreach_get per attribute"""
+    edit_bones = armature.data.edit_bones
+    count = len(edit_bones)
+    heads = numpy.zeros(count * 3, dtype=numpy.float32)
+    tails = numpy.zeros(count * 3, dtype=numpy.float32)
+    rolls = numpy.zeros(count, dtype=numpy.float32)
+    edit_bones.foreach_get('head', heads)
+    edit_bones.foreach_get('tail', tails)
+    edit_bones.foreach_get('roll', rolls)
+    rows = {edit_bone.name: idx for idx, edit_bone in enumerate(edit_bones)}
+    return rows, heads.reshape(count, 3).astype(float), tails.reshape(count, 3).astype(float), rolls.astype(float)
+
+@unprofiled
+def bone_placements(armature, names):
+    """(REQUIRES EDIT MODE) Heads, tails and rolls of bones, queued placements included: (n, 3), (n, 3) and (n,) NumPy
+    arrays, lists of Vectors and floats without NumPy. Inside a build session all edit bones are read once per edit mode,
+    outside of one only these bones are read"""
+    session = build_session(armature)
+    if numpy is None or session is None:
+        edit_bones = [_edit_bone(armature, name) for name in names]
+        heads, tails, rolls = [bone.head.copy() for bone in edit_bones], [bone.tail.copy() for bone in edit_bones], [bone.roll for bone in edit_bones]
+        if numpy is None:
+            return heads, tails, rolls
+        return numpy.array(heads, dtype=float).reshape(-1, 3), numpy.array(tails, dtype=float).reshape(-1, 3), numpy.array(rolls, dtype=float)
+    placements = session.placements
+    if session.frames is None or any(name not in session.frames[0] and name not in placements for name in names):
+        session.frames = _read_frames(armature)
+    rows, heads, tails, rolls = session.frames
+    heads = numpy.array([placements[name][0] if name in placements else heads[rows[name]] for name in names], dtype=float)
+    tails = numpy.array([placements[name][1] if name in placements else tails[rows[name]] for name in names], dtype=float)
+    rolls = numpy.array([placements[name][2] if name in placements else rolls[rows[name]] for name in names], dtype=float)
+    return heads.reshape(-1, 3), tails.reshape(-1, 3), rolls
+
+@unprofiled
+def place_bones(armature, names, heads, tails, rolls):
+    """(REQUIRES EDIT MODE) Set the heads, tails and rolls of bones: queued inside a build session, bone by bone otherwise"""
+    session = build_session(armature)
+    if session is None or numpy is None:
+        for name, head, tail, roll in zip(names, heads, tails, rolls):
+            edit_bone = _edit_bone(armature, name)
+            edit_bone.head = head
+            edit_bone.tail = tail
+            edit_bone.roll = roll
+        return
+    for name, head, tail, roll in zip(names, heads, tails, rolls):
+        session.placements[name] = (tuple(map(float, head)), tuple(map(float, tail)), float(roll))
+
+def new_placed_bones(armature, names, heads, tails, rolls, layers_array, is_deletable):
+    """(REQUIRES EDIT MODE) Create bones placed with place_bones, layers_array giving the layers of each bone. Returns
+    their names (with a suffix for the ones that are taken)"""
+    names = [new_edit_bone(armature, name, None, None, None, layers, is_deletable).name for name, layers in zip(names, layers_array)]
+    place_bones(armature, names, heads, tails, rolls)
+    return names
+
+@unprofiled
+def write_placements(armature, names=None):
+    """(REQUIRES EDIT MODE) Write the placements queued in the build session, with one foreach_get and one foreach_set
+    per attribute. With names, only when one of these bones is queued. Connecting bones moves them, so the placements
+    are written first"""
+    session = build_session(armature)
+    if session is None or not session.placements:
+        return
+    if names is not None and not any(name in session.placements for name in names):
+        return
+    placements, session.placements = session.placements, {}
+    session.frames = None
+    edit_bones = armature.data.edit_bones
+    rows = {edit_bone.name: idx for idx, edit_bone in enumerate(edit_bones) if edit_bone.name in placements}
+    missing = [name for name in placements if name not in rows]
+    if missing:
+        # Bones removed after they were placed
+        print("Bones not placed, no bones named: " + ", ".join(sorted(missing)))
+    if not rows:
+        return
+    for position, (attribute, size) in enumerate((('head', 3), ('tail', 3), ('roll', 1))):
+        values = numpy.zeros(len(edit_bones) * size, dtype=numpy.float32)
+        edit_bones.foreach_get(attribute, values)
+        values = values.reshape(-1, size)
+        values[list(rows.values())] = numpy.array([placements[name][position] for name in rows]).reshape(-1, size)
+        edit_bones.foreach_set(attribute, values.ravel())
+
+@unprofiled
+def _bones_moved(armature):
+    """Drop the edit bones read by bone_placements after bones were moved without place_bones"""
+    session = build_session(armature)
+    if session is not None:
+        session.frames = None
+
+def copy_edit_bone_settings(source_bone, edit_bone):
+    """(REQUIRES EDIT MODE) Copy the EDIT_BONE_SETTINGS of a bone to another"""
+    for attribute in EDIT_BONE_SETTINGS:
+        setattr(edit_bone, attribute, getattr(source_bone, attribute))
+
+def subdivide_bone(armature, bone_name, cuts):
+    """(REQUIRES EDIT MODE) Subdivide a bone in cuts+1 connected parts like armature.subdivide does, without selection.
+    The original bone keeps the first part. Returns the part names ordered from root to tip"""
+    write_placements(armature, [bone_name])
+    edit_bone = _edit_bone(armature, bone_name)
+    head = edit_bone.head.copy()
+    tail = edit_bone.tail.copy()
+    children = [child for child in edit_bone.children]
+    parts = [edit_bone]
+    for idx in range(1, cuts+1):
+        part = new_edit_bone(armature, bone_name, head, tail, edit_bone.roll, edit_bone.layers, edit_bone.deletable)
+        copy_edit_bone_settings(edit_bone, part)
+        parts.append(part)
+    for idx, part in enumerate(parts):
+        part.head = head.lerp(tail, idx/(cuts+1))
+        part.tail = head.lerp(tail, (idx+1)/(cuts+1))
+        if idx > 0:
+            part.parent = parts[idx-1]
+            part.use_connect = True
+    for child in children:
+        child.parent = parts[len(parts)-1]
+    _bones_moved(armature)
+    return [part.name for part in parts]
+
+def rename_bone(armature, name, new_name):
+    """(REQUIRES EDIT MODE) Rename a bone, moving its cached bones and queued pose settings to the new name. Returns the
+    name it got (new_name with a suffix if it is taken)"""
+    edit_bone = _edit_bone(armature, name)
+    edit_bone.name = new_name
+    new_name = edit_bone.name
+    edit_bones = _session_cache(armature, 'edit_bones')
+    if edit_bones is not None:
+        edit_bones.pop(name, None)
+        edit_bones[new_name] = edit_bone
+        _session.pose_bones.pop(name, None)
+        _session.frames = None
+        if name in _session.placements:
+            _session.placements[new_name] = _session.placements.pop(name)
+        pose_settings = _session.pose_settings
+        if name in pose_settings:
+            pose_settings[new_name] = pose_settings.pop(name)
+        if _session.registry is not None:
+            _session.registry.rename(name, new_name)
+    return new_name
+
+def spline_evaluated_points(spline):
+    """Points of the first spline of a curve object in world space, evaluated with the curve resolution"""
+    matrix = spline.matrix_world
+    curve_spline = spline.data.splines[0]
+    points = []
+    if curve_spline.type == 'BEZIER':
+        bezier_points = curve_spline.bezier_points
+        segments = len(bezier_points) - 1
+        if curve_spline.use_cyclic_u:
+            segments += 1
+        resolution = max(curve_spline.resolution_u, 1) + 1
+        for idx in range(0, segments):
+            point0 = bezier_points[idx]
+            point1 = bezier_points[(idx+1) % len(bezier_points)]
+            segment = mathutils.geometry.interpolate_bezier(point0.co, point0.handle_right, point1.handle_left, point1.co, resolution)
+            if points:
+                segment = segment[1:]
+            points.extend(segment)
+    else:
+        for point in curve_spline.points:
+            points.append(point.co.to_3d())
+    return [matrix @ mathutils.Vector(p) for p in points]
+
+def sample_polyline(points, count):
+    """Return count points evenly distributed by length along a polyline"""
+    lengths = [0.0]
+    for idx in range(1, len(points)):
+        lengths.append(lengths[idx-1] + (points[idx] - points[idx-1]).length)
+    total = lengths[len(lengths)-1]
+    samples = []
+    segment = 1
+    for idx in range(0, count):
+        distance = total * idx / (count-1)
+        while segment < len(points)-1 and lengths[segment] < distance:
+            segment += 1
+        span = lengths[segment] - lengths[segment-1]
+        factor = (distance - lengths[segment-1]) / span if span > 0.0 else 0.0
+        samples.append(points[segment-1].lerp(points[segment], min(max(factor, 0.0), 1.0)))
+    return samples
+
+# Pose bone settings that assign_rotation_mode and lock_bone_transforms write at the end of a build session
+LOCK_SETTINGS = ('lock_location', 'lock_rotation', 'lock_scale')
+
+@unprofiled
+def pose_bone_setting(armature, name, attribute):
+    """Value of a pose bone setting, including the rotation mode or locks queued in the build session"""
+    pose_settings = _session_cache(armature, 'pose_settings')
+    if pose_settings is not None and attribute in pose_settings.get(name, ()):
+        return pose_settings[name][attribute]
+    return getattr(_pose_bone(armature, name), attribute)
+
+@unprofiled
+def set_pose_bone_setting(armature, name, attribute, value):
+    """Set a pose bone setting, queued in the build session for the rotation mode and locks"""
+    pose_settings = _session_cache(armature, 'pose_settings')
+    if pose_settings is not None and attribute in ('rotation_mode',) + LOCK_SETTINGS:
+        pose_settings.setdefault(name, {})[attribute] = value if isinstance(value, str) else list(value)
+        return
+    setattr(_pose_bone(armature, name), attribute, value)
+
+def write_pose_settings(armature, pose_settings):
+    """Write rotation modes and locks ({bone name: {attribute: value}}) to the pose bones. Locks of all bones are written
+    with one foreach_set per attribute. Enum properties can't be, rotation modes are set bone by bone"""
+    pose_bones = armature.pose.bones
+    pose_bone_list = list(pose_bones)
+    indices = {pose_bone.name: idx for idx, pose_bone in enumerate(pose_bone_list)}
+    missing = [name for name in pose_settings if name not in indices]
+    if missing:
+        # Bones removed after their settings were queued
+        print("Rotation modes and locks not written, no bones named: " + ", ".join(sorted(missing)))
+        pose_settings = {name: settings for name, settings in pose_settings.items() if name in indices}
+    for attribute in LOCK_SETTINGS:
+        rows = [(indices[name], settings[attribute]) for name, settings in pose_settings.items() if attribute in settings]
+        if not rows:
+            continue
+        if numpy is not None:
+            values = numpy.zeros(len(pose_bones) * 3, dtype=bool)
+            pose_bones.foreach_get(attribute, values)
+            values = values.reshape(-1, 3)
+            values[[idx for idx, _ in rows]] = [locks for _, locks in rows]
+            pose_bones.foreach_set(attribute, values.ravel())
+        else:
+            values = [False] * (len(pose_bones) * 3)
+            pose_bones.foreach_get(attribute, values)
+            for idx, locks in rows:
+                values[3*idx:3*idx+3] = locks
+            pose_bones.foreach_set(attribute, values)
+    for name, settings in pose_settings.items():
+        if 'rotation_mode' in settings:
+            pose_bone_list[indices[name]].rotation_mode = settings['rotation_mode']
 
 def assign_rotation_mode(armature, bone_names_array):
     """Assign rotation mode 'XYZ' for a collection of bones"""
+    pose_settings = _session_cache(armature, 'pose_settings')
+    if pose_settings is not None:
+        for name in bone_names_array:
+            pose_settings.setdefault(name, {})['rotation_mode'] = 'XYZ'
+        return
     enter_pose_mode(armature)
     for name in bone_names_array:
-        armature.pose.bones[name].rotation_mode = 'XYZ'
+        _pose_bone(armature, name).rotation_mode = 'XYZ'
 
 def lock_bone_transforms(armature, bone_names_array, bool_array):
     """Lock transforms as defined in the nine element array bool_array (must be an 'XYZ' rotation bone)"""
@@ -67,9 +562,16 @@ def lock_bone_transforms(armature, bone_names_array, bool_array):
         if type(b) is not bool:
             print("Invalid array element")
             return
+    pose_settings = _session_cache(armature, 'pose_settings')
+    if pose_settings is not None:
+        for name in bone_names_array:
+            settings = pose_settings.setdefault(name, {})
+            for idx, attribute in enumerate(LOCK_SETTINGS):
+                settings[attribute] = list(bool_array[3*idx:3*idx+3])
+        return
     enter_pose_mode(armature)
     for name in bone_names_array:
-        pose_bone = armature.pose.bones[name]
+        pose_bone = _pose_bone(armature, name)
         for idx in range(0,3):
             pose_bone.lock_location[idx] = bool_array[idx]
             pose_bone.lock_rotation[idx] = bool_array[idx + 3]
@@ -90,7 +592,7 @@ def bone_copy_rotation_constraint(armature, bone_names_array, target_bone_name,
     enter_pose_mode(armature)
     constraints = []
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('COPY_ROTATION')
+        c = _pose_bone(armature, name).constraints.new('COPY_ROTATION')
         c.target = armature
         c.subtarget = target_bone_name
         c.use_x = axis_bool_array[0]
@@ -109,7 +611,7 @@ def bone_copy_transforms_constraint(armature, bone_names_array, target_bone_name
     enter_pose_mode(armature)
     constraints = []
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('COPY_TRANSFORMS')
+        c = _pose_bone(armature, name).constraints.new('COPY_TRANSFORMS')
         c.target = armature
         c.subtarget = target_bone_name
         c.target_space = world_local
@@ -128,7 +630,7 @@ def bone_IK_constraint(armature, bone_names_array, target_bone_name, pole_bone_n
     enter_pose_mode(armature)
     constraints = []
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('IK')
+        c = _pose_bone(armature, name).constraints.new('IK')
         c.target = armature
         c.subtarget = target_bone_name
         if pole_bone_name:
@@ -137,7 +639,7 @@ def bone_IK_constraint(armature, bone_names_array, target_bone_name, pole_bone_n
             c.pole_angle = pole_angle
         c.chain_count = chain_count
         constraints.append(c)
-        bone = armature.pose.bones[name]
+        bone = _pose_bone(armature, name)
         bone.lock_ik_x = lock_ik_axis_array[0]
         bone.lock_ik_y = lock_ik_axis_array[1]
         bone.lock_ik_z = lock_ik_axis_array[2]
@@ -148,7 +650,7 @@ def bone_child_of_constraint(armature, bone_names_array, target_bone_name, bool_
     enter_pose_mode(armature)
     constraints = []
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('CHILD_OF')
+        c = _pose_bone(armature, name).constraints.new('CHILD_OF')
         c.target = armature
         c.subtarget = target_bone_name
         c.use_location_x = bool_array[0]
@@ -171,7 +673,7 @@ def bone_damped_track_constraint(armature, bone_names_array, target_bone_name, t
         return
     enter_pose_mode(armature)
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('DAMPED_TRACK')
+        c = _pose_bone(armature, name).constraints.new('DAMPED_TRACK')
         c.target = armature
         c.subtarget = target_bone_name
         c.track_axis = track_axis
@@ -181,7 +683,7 @@ def bone_limit_rotation_constraint(armature, bone_names_array, limit_axis, x_min
     """Assign a Limit Rotation constraint to a collection of bones"""
     enter_pose_mode(armature)
     for name in bone_names_array:
-        c = armature.pose.bones[name].constraints.new('LIMIT_ROTATION')
+        c = _pose_bone(armature, name).constraints.new('LIMIT_ROTATION')
         c.use_limit_x = limit_axis[0]
         c.use_limit_y = limit_axis[1]
         c.use_limit_z = limit_axis[2]
@@ -193,9 +695,44 @@ def bone_limit_rotation_constraint(armature, bone_names_array, limit_axis, x_min
         c.max_z = z_min_max[1]
         c.owner_space = world_local
 
+def bone_transformation_constraint(armature, bone_names_array, target_bone_name, from_axis, to_axis, factor):
+    """Assign a Transformation constraint that adds factor times the local rotation of the target around from_axis
+    to the local rotation of a collection of bones around to_axis (same as a 'factor*var' ROT driver)"""
+    if not from_axis in {'X', 'Y', 'Z'} or not to_axis in {'X', 'Y', 'Z'}:
+        print("Please, select \'X\', \'Y\' or \'Z\'")
+        return
+    enter_pose_mode(armature)
+    constraints = []
+    for name in bone_names_array:
+        c = _pose_bone(armature, name).constraints.new('TRANSFORM')
+        c.target = armature
+        c.subtarget = target_bone_name
+        c.target_space = 'LOCAL'
+        c.owner_space = 'LOCAL'
+        c.map_from = 'ROTATION'
+        c.map_to = 'ROTATION'
+        c.mix_mode_rot = 'ADD'
+        c.use_motion_extrapolate = True
+        setattr(c, 'from_min_' + from_axis.lower() + '_rot', -pi)
+        setattr(c, 'from_max_' + from_axis.lower() + '_rot', pi)
+        setattr(c, 'map_to_' + to_axis.lower() + '_from', from_axis)
+        setattr(c, 'to_min_' + to_axis.lower() + '_rot', -pi * factor)
+        setattr(c, 'to_max_' + to_axis.lower() + '_rot', pi * factor)
+        constraints.append(c)
+    return constraints
+
+def constraints_read_channels(armature, bone_names_array):
+    """True if a constraint reading the local rotation of these bones gets the same value as a LOCAL_SPACE driver
+    variable (the bones have no constraints and an euler rotation mode)"""
+    for name in bone_names_array:
+        pose_bone = _pose_bone(armature, name)
+        if pose_bone.constraints or pose_bone_setting(armature, name, 'rotation_mode') in {'QUATERNION', 'AXIS_ANGLE'}:
+            return False
+    return True
+
 def object_child_of_constraint(armature, object, target_bone_name, bool_array):
     """Assign a Child Of constraint to an object"""
-    bpy.ops.object.mode_set(mode='OBJECT')
+    enter_object_mode()
     c = object.constraints.new('CHILD_OF')
     c.target = armature
     c.subtarget = target_bone_name
@@ -212,44 +749,74 @@ def object_child_of_constraint(armature, object, target_bone_name, bool_array):
 
     return c
 
+def add_driver(id_data, data_path, index):
+    """Add a driver to a property, or to one item of an array property"""
+    try:
+        return id_data.driver_add(data_path, index)
+    except TypeError:
+        # Not an array property
+        return id_data.driver_add(data_path)
+
+def remove_bone_drivers(armature, bone_names_array):
+    """Remove every driver of a collection of bones (pose bone channels, constraints and bone properties like hide).
+    The existing drivers are scanned once, so no driver is missed and no path is guessed"""
+    names = set(bone_names_array)
+    for id_data, prefix in ((armature, 'pose.bones["'), (armature.data, 'bones["')):
+        if not id_data.animation_data:
+            continue
+        drivers = id_data.animation_data.drivers
+        for fcurve in [fcurve for fcurve in drivers if fcurve.data_path.startswith(prefix)]:
+            if fcurve.data_path[len(prefix):].split('"]', 1)[0] in names:
+                drivers.remove(fcurve)
+
+@unprofiled
+def driver_count(armature):
+    """Number of drivers of an armature: on the object (constraints, bone channels) and on its data (bone hide drivers)"""
+    return sum(len(id_data.animation_data.drivers) for id_data in (armature, armature.data) if id_data.animation_data)
+
 def delete_bone_constraints_and_drivers(armature, bone_names_array):
     """Delete all constraints and drivers from a collection of bones"""
     enter_pose_mode(armature)
     for name in bone_names_array:
-        bone = armature.pose.bones[name]
+        bone = _pose_bone(armature, name)
         for c in bone.constraints:
             bone.constraints.remove(c)
-        paths = []
-        paths.append('pose.bones[\"' + bone.name + '\"].location')
-        paths.append('pose.bones[\"' + bone.name + '\"].rotation_euler')
-        paths.append('pose.bones[\"' + bone.name + '\"].rotation_quaternion')
-        paths.append('pose.bones[\"' + bone.name + '\"].scale')
-        paths.append('pose.bones[\"' + bone.name + '\"].constraints[\"' + 'Copy Transforms' + '\"].influence')
-        paths.append('pose.bones[\"' + bone.name + '\"].constraints[\"' + 'Copy Transforms.001' + '\"].influence')
-        for p in paths:
-            armature.driver_remove(p)
-        armature.data.driver_remove('bones[\"' + bone.name + '\"].hide')
+    remove_bone_drivers(armature, bone_names_array)
 
 def duplicate_bones(armature, bone_names_array, new_bone_names_array, lay, is_deletable):
-    """Duplicate a collection of bones, assign layer and rename them. Duplicate individually if it creates indesired bones"""
+    """Duplicate a collection of bones, assign layer and rename them. Hierarchy between the duplicated bones is kept"""
     enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
-    for name in bone_names_array:
-        edit_bone = armature.data.edit_bones[name]
-        if edit_bone.parent and edit_bone.use_connect:
-            edit_bone.parent.select_tail = True
-        if edit_bone.children:
-            for child in edit_bone.children:
-                if child.use_connect:
-                    child.select_head = True
-        edit_bone.select = True
-        edit_bone.select_head = True
-        edit_bone.select_tail = True
-    bpy.ops.armature.duplicate()
-    assign_selected_to_bones_layer(lay)
+    write_placements(armature, bone_names_array)
+    layers = bone_layers_array(lay)
+    new_names = {}
     for idx, name in enumerate(bone_names_array):
-        armature.data.edit_bones[name + ".001"].deletable = is_deletable
-        armature.data.edit_bones[name + ".001"].name = new_bone_names_array[idx]
+        source_bone = _edit_bone(armature, name)
+        new_bone = new_edit_bone(armature, new_bone_names_array[idx], source_bone.head, source_bone.tail, source_bone.roll, layers, is_deletable)
+        copy_edit_bone_settings(source_bone, new_bone)
+        new_names[name] = new_bone.name
+    for name, new_name in new_names.items():
+        source_bone = _edit_bone(armature, name)
+        if not source_bone.parent:
+            continue
+        new_bone = _edit_bone(armature, new_name)
+        new_bone.parent = _edit_bone(armature, new_names.get(source_bone.parent.name, source_bone.parent.name))
+        new_bone.use_connect = source_bone.use_connect
+    _bones_moved(armature)
+
+    # Pose data (constraints included) is copied the same way armature.duplicate does
+    enter_pose_mode(armature)
+    for name, new_name in new_names.items():
+        source_bone = _pose_bone(armature, name)
+        pose_bone = _pose_bone(armature, new_name)
+        for attribute in POSE_BONE_SETTINGS:
+            setattr(pose_bone, attribute, pose_bone_setting(armature, name, attribute))
+        for c in source_bone.constraints:
+            new_c = pose_bone.constraints.copy(c)
+            if getattr(new_c, 'subtarget', "") in new_names:
+                new_c.subtarget = new_names[new_c.subtarget]
+            if getattr(new_c, 'pole_subtarget', "") in new_names:
+                new_c.pole_subtarget = new_names[new_c.pole_subtarget]
+    new_bone_names_array = [new_names[name] for name in bone_names_array]
     assign_rotation_mode(armature, new_bone_names_array)
 
     return new_bone_names_array
@@ -257,33 +824,53 @@ def duplicate_bones(armature, bone_names_array, new_bone_names_array, lay, is_de
 def parent_bones(armature, bone_names_array, parent_bone, use_connect, use_inherit_rotation, inherit_scale):
     """Parent a collection of bones to another bone"""
     enter_edit_mode(armature)
+    if use_connect:
+        write_placements(armature, list(bone_names_array) + [parent_bone])
     for name in bone_names_array:
-        edit_bone = armature.data.edit_bones[name]
-        edit_bone.parent = armature.data.edit_bones[parent_bone]
+        edit_bone = _edit_bone(armature, name)
+        edit_bone.parent = _edit_bone(armature, parent_bone)
         edit_bone.use_connect = use_connect
         edit_bone.use_inherit_rotation = use_inherit_rotation
         edit_bone.inherit_scale = inherit_scale 
+    if use_connect:
+        _bones_moved(armature)
+
+# Longest chain a Spline IK constraint can have
+SPLINE_IK_MAX_BONES = 255
 
 def create_spline_chain(armature, spline, cuts, bone_prefix, fit_spline):
-    """Creates a bone chain that is binded to a spline"""
-    spline_bones = []
+    """Creates a bone chain of cuts+1 bones that is binded to a spline"""
+    if not 0 <= cuts < SPLINE_IK_MAX_BONES:
+        raise ValueError("A spline chain has 1 to " + str(SPLINE_IK_MAX_BONES) + " bones (" + str(cuts+1) + " asked for '" + bone_prefix + "')")
+    # The chain is fitted to the spline at creation, as applying a Spline IK pose to a straight chain would do
+    matrix = armature.matrix_world.inverted()
+    positions = [matrix @ p for p in sample_polyline(spline_evaluated_points(spline), cuts+2)]
     enter_edit_mode(armature)
-    bpy.ops.armature.bone_primitive_add(name="new bone")
-    bpy.ops.armature.select_more()
-    bpy.ops.armature.subdivide(number_cuts=cuts)
-    current_edit_bone = armature.data.edit_bones["new bone"]
-    for idx in range(0, cuts+1):
-        current_edit_bone.name = bone_prefix + "0" + str(idx+1) + "_RST"
-        spline_bones.append(current_edit_bone.name)
-        if idx < cuts:
-            current_edit_bone = current_edit_bone.children[0]
-    assign_selected_to_bones_layer(23)
-    bpy.ops.object.mode_set(mode='OBJECT')
-    sp_constraint = armature.pose.bones[spline_bones[len(spline_bones)-1]].constraints.new('SPLINE_IK')
+    names = [chain_bone_name(bone_prefix, idx, cuts+1, "RST") for idx in range(0, cuts+1)]
+    layers_array = [bone_layers_array(23)] * (cuts+1)
+    # Bone Z axis is transported along the chain (minimum twist) from a +Z pointing bone with roll 0
+    if numpy is not None:
+        heads, tails = numpy.array(positions[:-1], dtype=float), numpy.array(positions[1:], dtype=float)
+        z_axes = geometry.transported_axes(tails - heads, (0.0, -1.0, 0.0), (0.0, 0.0, 1.0))
+        spline_bones = new_placed_bones(armature, names, heads, tails, geometry.bone_rolls(heads, tails, z_axes), layers_array, True)
+    else:
+        spline_bones = new_placed_bones(armature, names, positions[:-1], positions[1:], [0.0] * (cuts+1), layers_array, True)
+        z_axis = mathutils.Vector((0.0, -1.0, 0.0))
+        direction = mathutils.Vector((0.0, 0.0, 1.0))
+        for idx, name in enumerate(spline_bones):
+            new_direction = (positions[idx+1] - positions[idx]).normalized()
+            z_axis = direction.rotation_difference(new_direction) @ z_axis
+            direction = new_direction
+            _edit_bone(armature, name).align_roll(z_axis)
+    write_placements(armature, spline_bones)
+    for parent, name in zip(spline_bones, spline_bones[1:]):
+        edit_bone = _edit_bone(armature, name)
+        edit_bone.parent = _edit_bone(armature, parent)
+        edit_bone.use_connect = True
+    enter_object_mode()
+    sp_constraint = _pose_bone(armature, spline_bones[len(spline_bones)-1]).constraints.new('SPLINE_IK')
     sp_constraint.target, sp_constraint.chain_count = spline, cuts + 1
     sp_constraint.use_curve_radius = False
-    enter_pose_mode(armature)
-    bpy.ops.pose.armature_apply(selected=True)
     sp_constraint.xz_scale_mode = 'BONE_ORIGINAL'
     if fit_spline:
         sp_constraint.y_scale_mode = 'FIT_CURVE'
@@ -295,54 +882,57 @@ def create_spline_chain(armature, spline, cuts, bone_prefix, fit_spline):
     return spline_bones
 
 def create_spline_hooks(armature, spline, bone_prefix):
-    """Creates bones as hooks for the spline"""
-    spline_hook_bones = []
-    enter_edit_mode(spline)
-    spline_points_positions_vec = []
-    for point in spline.data.splines[0].bezier_points:
-        spline_points_positions_vec.append(point.co)
-    bone_length = spline.data.splines[0].calc_length()/(len(spline_points_positions_vec)*2)
-
-    # Apparently unnecesary conversion, but it solves some bug in mathutils
-    spline_points_positions = []
-    for idx, vec in enumerate(spline_points_positions_vec):
-        spline_points_positions.append((vec.x, vec.y, vec.z))
-    
+    """Creates bones as hooks for the spline. The hooks are bound through the modifier data (vertex indices, center
+    and inverse matrix), without editing the spline"""
+    points = spline.data.splines[0].bezier_points
+    if numpy is not None:
+        positions = numpy.zeros(len(points) * 3, dtype=numpy.float32)
+        points.foreach_get('co', positions)
+        positions = positions.reshape(-1, 3).astype(float)
+    else:
+        positions = [point.co.copy() for point in points]
+    bone_length = spline.data.splines[0].calc_length()/(len(positions)*2)
+    # Hook bones point to world +Z, in armature space
+    to_armature = armature.matrix_world.inverted() @ spline.matrix_world
+    direction = (armature.matrix_world.inverted().to_3x3() @ mathutils.Vector((0.0, 0.0, 1.0))).normalized()
+
     enter_edit_mode(armature)
-    for idx, pos in enumerate(spline_points_positions):
-        bpy.context.scene.cursor.location = mathutils.Vector(pos)
-        bone_name = bone_prefix + "0" + str(idx+1) + "_HDL"
-        bpy.ops.armature.bone_primitive_add(name=bone_name)
-        armature.data.edit_bones[bone_name].length = bone_length
-        spline_hook_bones.append(bone_name)
-
-    bpy.ops.armature.select_all(action='DESELECT')
-    for name in spline_hook_bones:
-        edit_bone = armature.data.edit_bones[name]
-        edit_bone.select = True
-        edit_bone.select_head = True
-        edit_bone.select_tail = True
-    assign_selected_to_bones_layer(16)
+    names = [chain_bone_name(bone_prefix, idx, len(positions), "HDL") for idx in range(len(positions))]
+    if numpy is not None:
+        heads = geometry.transform_points(numpy.array(to_armature), positions)
+        tails = heads + numpy.array(direction) * bone_length
+    else:
+        heads = [to_armature @ position for position in positions]
+        tails = [head + direction*bone_length for head in heads]
+    spline_hook_bones = new_placed_bones(armature, names, heads, tails, [0.0] * len(names), [bone_layers_array(16)] * len(names), True)
+    enter_object_mode()
     assign_rotation_mode(armature, spline_hook_bones)
     lock_bone_transforms(armature, spline_hook_bones, [False, False, False, False, False, False, True, True, True,])
-    for name in spline_hook_bones:
+    # Every bezier point is three hook vertices: left handle, control point, right handle
+    to_spline = spline.matrix_world.inverted() @ armature.matrix_world
+    for idx, name in enumerate(spline_hook_bones):
         h_modifier = spline.modifiers.new(name, 'HOOK')
         h_modifier.object = armature
         h_modifier.subtarget = name
-    enter_edit_mode(spline)
-    for idx, point in enumerate(spline.data.splines[0].bezier_points):
-        bpy.ops.curve.select_all(action='DESELECT')
-        point.select_control_point = True
-        point.select_left_handle = True
-        point.select_right_handle = True
-        bpy.ops.object.hook_assign(modifier=spline_hook_bones[idx])
-
+        h_modifier.center = positions[idx]
+        h_modifier.vertex_indices_set([3*idx, 3*idx + 1, 3*idx + 2])
+        h_modifier.matrix_inverse = (to_spline @ armature.data.bones[name].matrix_local).inverted()
 
     return spline_hook_bones
 
-def chain_torsion(armature, result_bone_array, bone0_name, bone1_name):
-    """Apply torsion to bones in a chain based on the torsion of the extremes"""
+def chain_torsion(armature, result_bone_array, bone0_name, bone1_name, use_constraints=False):
+    """Apply torsion to bones in a chain based on the torsion of the extremes.
+    With use_constraints, Transformation constraints replace the drivers when they are equivalent"""
     enter_pose_mode(armature)
+    if use_constraints and constraints_read_channels(armature, [bone0_name, bone1_name]):
+        divider = len(result_bone_array) - 1
+        for idx, name in enumerate(result_bone_array):
+            if idx == 0:
+                bone_transformation_constraint(armature, [name], bone0_name, 'Y', 'Y', 1.0)
+            else:
+                bone_transformation_constraint(armature, [name], bone0_name, 'Y', 'Y', -1/divider)
+                bone_transformation_constraint(armature, [name], bone1_name, 'Y', 'Y', 1/divider)
+        return
     for idx, name in enumerate(result_bone_array):
         dr = armature.driver_add("pose.bones[\"" + name + "\"].rotation_euler",1)
         var = dr.driver.variables.new()                                     
@@ -366,69 +956,92 @@ def chain_torsion(armature, result_bone_array, bone0_name, bone1_name):
 def connect_tail_head(armature, tail_bone_name, head_bone_name, new_bone_name, lay, is_deletable):
     """Crate a bone that connects one bone tail to another bone head"""
     enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
-    bpy.context.scene.cursor.location = armature.data.edit_bones[tail_bone_name].tail
-    bpy.ops.armature.bone_primitive_add(name=new_bone_name)
-    bpy.ops.armature.select_more()
-    assign_selected_to_bones_layer(lay)
-    new_bone = armature.data.edit_bones[new_bone_name]
-    new_bone.tail = armature.data.edit_bones[head_bone_name].head
-    new_bone.deletable = is_deletable
+    heads, tails, _ = bone_placements(armature, [tail_bone_name, head_bone_name])
+    new_bone_name = new_placed_bones(armature, [new_bone_name], tails[:1], heads[1:], [0.0], [bone_layers_array(lay)], is_deletable)[0]
     parent_bones(armature, [new_bone_name], tail_bone_name, True, True, 'FULL')
     parent_bones(armature, [head_bone_name], new_bone_name, True, True, 'FULL')
     assign_rotation_mode(armature, [new_bone_name])
     lock_bone_transforms(armature, [new_bone_name], [True, True, True, True, True, True, True, True, True])
 
+def new_axis_bones(armature, names, ref_bone_names, head_tails, axes, lengths, layers_array, is_deletable):
+    """(REQUIRES EDIT MODE) Create bones with roll 0 from the head or tail ('HEAD' or 'TAIL') of reference bones along
+    axes of AXIS_VECTORS, placed all at once. Returns their names"""
+    heads, tails, _ = bone_placements(armature, ref_bone_names)
+    if numpy is not None:
+        positions = numpy.where(numpy.array([head_tail == 'HEAD' for head_tail in head_tails])[:, None], heads, tails)
+        ends = positions + numpy.array([AXIS_VECTORS[axis] for axis in axes]) * numpy.array(lengths, dtype=float)[:, None]
+    else:
+        positions = [head if head_tail == 'HEAD' else tail for head, tail, head_tail in zip(heads, tails, head_tails)]
+        ends = [position + AXIS_VECTORS[axis] * length for position, axis, length in zip(positions, axes, lengths)]
+    return new_placed_bones(armature, names, positions, ends, [0.0] * len(names), layers_array, is_deletable)
+
 def add_bone_axis(armature, new_bone_name, ref_bone_name, parent_name, head_tail, axis, length, use_connect, lay, is_deletable):
     """Create a bone in one axis direction"""
-    enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
     if not head_tail in {'HEAD', 'TAIL'}:
         print("Please, select \'HEAD\' or \'TAIL\'")
         return
-    if not axis in {'+X', '+Y', '+Z', '-X', '-Y', '-Z'}:
+    if not axis in AXIS_VECTORS:
         print("Please, select \'+X\', \'+Y\', \'+Z\', \'-X\', \'-Y\' or \'-Z\'")
         return
-    if head_tail == 'HEAD':
-        position = armature.data.edit_bones[ref_bone_name].head
-    elif head_tail == 'TAIL':
-        position = armature.data.edit_bones[ref_bone_name].tail
-    bpy.context.scene.cursor.location = position
-    bpy.ops.armature.bone_primitive_add(name=new_bone_name)
-    bpy.ops.armature.select_more()
-    assign_selected_to_bones_layer(lay)
-    new_bone = armature.data.edit_bones[new_bone_name]
-    if axis == '+X':
-        new_bone.tail.x = new_bone.head.x + length
-        new_bone.tail.y = new_bone.head.y
-        new_bone.tail.z = new_bone.head.z
-    if axis == '+Y':
-        new_bone.tail.x = new_bone.head.x
-        new_bone.tail.y = new_bone.head.y + length
-        new_bone.tail.z = new_bone.head.z
-    if axis == '+Z':
-        new_bone.tail.x = new_bone.head.x
-        new_bone.tail.y = new_bone.head.y
-        new_bone.tail.z = new_bone.head.z + length
-    if axis == '-X':
-        new_bone.tail.x = new_bone.head.x - length
-        new_bone.tail.y = new_bone.head.y
-        new_bone.tail.z = new_bone.head.z
-    if axis == '-Y':
-        new_bone.tail.x = new_bone.head.x
-        new_bone.tail.y = new_bone.head.y - length
-        new_bone.tail.z = new_bone.head.z
-    if axis == '-Z':
-        new_bone.tail.x = new_bone.head.x
-        new_bone.tail.y = new_bone.head.y
-        new_bone.tail.z = new_bone.head.z - length
-    new_bone.deletable = is_deletable
+    enter_edit_mode(armature)
+    new_bone_name = new_axis_bones(armature, [new_bone_name], [ref_bone_name], [head_tail], [axis], [length], [bone_layers_array(lay)], is_deletable)[0]
     parent_bones(armature, [new_bone_name], parent_name, use_connect, True, 'FULL')
     assign_rotation_mode(armature, [new_bone_name])
 
-def bone_add_hide_driver(armature, bone_name, switch_property_name, expression):
-    """Add a driver to the Hide property of a bone"""
+# Custom property of the armature object with the bones that FK-IK switches show and hide without drivers (consolidated
+# switches), as JSON: {switch property name: {bone name: "var" or "1-var"}}. The bone is hidden when the expression is
+# over 0.5
+SWITCH_VISIBILITY_PROPERTY = 'auto_rig_switch_visibility'
+
+@unprofiled
+def switch_visibility(armature):
+    """Bones shown and hidden by the consolidated FK-IK switches of an armature"""
+    data = armature.get(SWITCH_VISIBILITY_PROPERTY)
+    return json.loads(data) if data else {}
+
+@unprofiled
+def write_switch_visibility(armature, switches):
+    if any(switches.values()):
+        armature[SWITCH_VISIBILITY_PROPERTY] = json.dumps(switches, separators=(',', ':'))
+    elif SWITCH_VISIBILITY_PROPERTY in armature:
+        del armature[SWITCH_VISIBILITY_PROPERTY]
+
+def update_switch_visibility(armature, switch_property_name):
+    """Show and hide the bones of a consolidated FK-IK switch for the current value of its property"""
+    bones = switch_visibility(armature).get(switch_property_name)
+    if not bones:
+        return
+    value = getattr(armature, switch_property_name)
+    data_bones = armature.data.edit_bones if armature.mode == 'EDIT' else armature.data.bones
+    for name, expression in bones.items():
+        bone = data_bones.get(name)
+        if bone is not None:
+            bone.hide = (value if expression == "var" else 1.0 - value) > 0.5
+
+def add_switch_visibility(armature, bone_name, switch_property_name, expression):
+    """Let a consolidated FK-IK switch hide a bone when expression ("var" or "1-var") is over 0.5"""
+    switches = switch_visibility(armature)
+    switches.setdefault(switch_property_name, {})[bone_name] = expression
+    write_switch_visibility(armature, switches)
+    update_switch_visibility(armature, switch_property_name)
+
+def remove_switch_visibility(armature, bone_names_array):
+    """Take bones out of the consolidated FK-IK switches and show them"""
+    switches = switch_visibility(armature)
+    data_bones = armature.data.edit_bones if armature.mode == 'EDIT' else armature.data.bones
+    for name in bone_names_array:
+        for bones in switches.values():
+            if bones.pop(name, None) is not None and data_bones.get(name) is not None:
+                data_bones[name].hide = False
+    write_switch_visibility(armature, {key: bones for key, bones in switches.items() if bones})
+
+def bone_add_hide_driver(armature, bone_name, switch_property_name, expression, consolidated=False):
+    """Add a driver to the Hide property of a bone. A consolidated switch hides the bone from the update of the switch
+    property instead (no driver)"""
     enter_pose_mode(armature)
+    if consolidated:
+        add_switch_visibility(armature, bone_name, switch_property_name, expression)
+        return
     dp = "bones[\"" + bone_name + "\"].hide"
     dr = armature.data.driver_add(dp)
     var = dr.driver.variables.new()
@@ -436,34 +1049,42 @@ def bone_add_hide_driver(armature, bone_name, switch_property_name, expression):
     var.targets[0].data_path = switch_property_name
     dr.driver.expression = expression
 
-def bone_create_fk_ik_switch(armature, result_bone, fk_bone, ik_bone, switch_property_name):
-    """Creates constraints and drivers to make a result bone follow either an fk or ik bone. Creates hide drivers for fk and ik bones"""
+def bone_create_fk_ik_switch(armature, result_bone, fk_bone, ik_bone, switch_property_name, consolidated=False):
+    """Creates constraints and drivers to make a result bone follow either an fk or ik bone. Creates hide drivers for fk and ik bones.
+    A consolidated switch only drives the influence of the ik constraint, which overrides the fk one, and hides the bones without drivers"""
     bone_copy_transforms_constraint(armature, [result_bone], fk_bone, 'WORLD')
     bone_copy_transforms_constraint(armature, [result_bone], ik_bone, 'WORLD')
     # Data_Path to the constraint's influence property
     dp_fk = "pose.bones[\"" + result_bone + "\"].constraints[\"Copy Transforms\"].influence"
     dp_ik = "pose.bones[\"" + result_bone + "\"].constraints[\"Copy Transforms.001\"].influence"
-    # Drivers of each constraints
-    dr_fk = armature.driver_add(dp_fk)
-    dr_ik = armature.driver_add(dp_ik)
-    # Variables of each driver
-    var_fk = dr_fk.driver.variables.new()
-    var_ik = dr_ik.driver.variables.new()
-    # Targets of each variable
-    var_fk.targets[0].id = armature.id_data
-    var_ik.targets[0].id = armature.id_data
-    # Paths of each target
-    var_fk.targets[0].data_path = switch_property_name
-    var_ik.targets[0].data_path = switch_property_name
-    # Expressions of each driver
-    dr_fk.driver.expression = "1-var"
-    dr_ik.driver.expression = "var"
+    if consolidated:
+        dr_ik = armature.driver_add(dp_ik)
+        var_ik = dr_ik.driver.variables.new()
+        var_ik.targets[0].id = armature.id_data
+        var_ik.targets[0].data_path = switch_property_name
+        dr_ik.driver.expression = "var"
+    else:
+        # Drivers of each constraints
+        dr_fk = armature.driver_add(dp_fk)
+        dr_ik = armature.driver_add(dp_ik)
+        # Variables of each driver
+        var_fk = dr_fk.driver.variables.new()
+        var_ik = dr_ik.driver.variables.new()
+        # Targets of each variable
+        var_fk.targets[0].id = armature.id_data
+        var_ik.targets[0].id = armature.id_data
+        # Paths of each target
+        var_fk.targets[0].data_path = switch_property_name
+        var_ik.targets[0].data_path = switch_property_name
+        # Expressions of each driver
+        dr_fk.driver.expression = "1-var"
+        dr_ik.driver.expression = "var"
 
     # Driver fk_bone Hide property
-    bone_add_hide_driver(armature, fk_bone, switch_property_name, "var")
+    bone_add_hide_driver(armature, fk_bone, switch_property_name, "var", consolidated)
 
     # Driver ik_bone Hide property
-    bone_add_hide_driver(armature, ik_bone, switch_property_name, "1-var")
+    bone_add_hide_driver(armature, ik_bone, switch_property_name, "1-var", consolidated)
 
 def create_fk_ik_limb(
     armature,
@@ -476,13 +1097,14 @@ def create_fk_ik_limb(
     pole_angle,
     lock_ik_axis_array,
     handle_layer,
-    aux_layer
+    aux_layer,
+    consolidated=False
     ):
     """Create a switchable FK IK limb (arms and legs)"""
     duplicate_bones(armature, bone_names_array, fk_names_array, handle_layer, True)
     duplicate_bones(armature, bone_names_array, ik_names_array, handle_layer, True)
     assign_bones_to_layers(armature, [ik_names_array[1]], aux_layer)
-    armature.data.edit_bones[ik_names_array[2]].use_connect = False
+    _edit_bone(armature, ik_names_array[2]).use_connect = False
     parent_bones(armature, [ik_names_array[2]], center_bone_name, False, True, 'FULL')
     assign_rotation_mode(armature, bone_names_array)
     lock_bone_transforms(armature, bone_names_array, [True, True, True, True, True, True, True, True, True])
@@ -495,49 +1117,46 @@ def create_fk_ik_limb(
     bone_child_of_constraint(armature, [fk_names_array[0], ik_names_array[0]], center_bone_name, [False, False, False, True, True, True, False, False, False])
     bone_IK_constraint(armature, [ik_names_array[1]], ik_names_array[2], pole_bone_name, 2, pole_angle, lock_ik_axis_array)
     for idx, name in enumerate(bone_names_array):
-        bone_create_fk_ik_switch(armature, name, fk_names_array[idx], ik_names_array[idx], switch_property_name)
-    bone_add_hide_driver(armature, pole_bone_name, switch_property_name, "1-var")        
+        bone_create_fk_ik_switch(armature, name, fk_names_array[idx], ik_names_array[idx], switch_property_name, consolidated)
+    bone_add_hide_driver(armature, pole_bone_name, switch_property_name, "1-var", consolidated)
     
 def create_forarm_torsion_bones(armature, forearm_hand_array, cuts, result_layer, aux_layer):
     """Creates the necessary bones to obtain wirst-forearm torsion"""
-    new_forearm_name = forearm_hand_array[0][:-4] + "_part" + "_RST"
-    new_hand_name = forearm_hand_array[1][:-4] + "_torsion" + "_AUX"
+    new_forearm_name = derived_bone_name(forearm_hand_array[0], ['part'], 'RST')
+    new_hand_name = derived_bone_name(forearm_hand_array[1], ['torsion'], 'AUX')
     duplicate_bones(armature, forearm_hand_array, [new_forearm_name, new_hand_name], aux_layer, True)
     delete_bone_constraints_and_drivers(armature, [new_forearm_name, new_hand_name])
     assign_bones_to_layers(armature, [new_forearm_name], result_layer)
     parent_bones(armature, [new_forearm_name, new_hand_name], forearm_hand_array[0], False, True, 'FULL')
     enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
-    armature.data.edit_bones[new_forearm_name].select = True
-    bpy.ops.armature.subdivide(number_cuts=cuts)
     forearm_parts = []
-    current_edit_bone = armature.data.edit_bones[new_forearm_name]
-    name = current_edit_bone.name
-    for idx in range(0, cuts+1):
-        current_edit_bone.name = name[:-4] + str(idx+1) + name[-4:]
-        forearm_parts.append(current_edit_bone.name)
-        if idx < cuts:
-            current_edit_bone = current_edit_bone.children[0]
+    for idx, part_name in enumerate(subdivide_bone(armature, new_forearm_name, cuts)):
+        forearm_parts.append(rename_bone(armature, part_name, derived_bone_name(new_forearm_name, ['part' + str(idx+1)])))
     assign_rotation_mode(armature, forearm_parts)
     lock_bone_transforms(armature,forearm_parts,[True, True, True, True, True, True, True, True, True])
-    name = duplicate_bones(armature, [new_hand_name], [new_hand_name[:-4] + "_D_AUX"], aux_layer, True)[0]
+    name = duplicate_bones(armature, [new_hand_name], [derived_bone_name(new_hand_name, ['torsion', 'D'])], aux_layer, True)[0]
+    end_name = derived_bone_name(new_hand_name, ['torsion', 'E'])
     enter_edit_mode(armature)
-    bpy.ops.armature.select_all(action='DESELECT')
-    armature.data.edit_bones[name].select = True
-    bpy.ops.armature.subdivide(number_cuts=1)
-    armature.data.edit_bones[name].children[0].name = name[:-6] + "_E_AUX"
-    assign_rotation_mode(armature, [name[:-6] + "_E_AUX"])
-    lock_bone_transforms(armature,[name[:-6] + "_E_AUX"],[True, True, True, True, True, True, True, True, True])
+    end_name = rename_bone(armature, subdivide_bone(armature, name, 1)[1], end_name)
+    assign_rotation_mode(armature, [end_name])
+    lock_bone_transforms(armature,[end_name],[True, True, True, True, True, True, True, True, True])
     bone_damped_track_constraint(armature, [name], forearm_hand_array[1], 'TRACK_Y')
-    bone_copy_rotation_constraint(armature, [name[:-6] + "_E_AUX"], forearm_hand_array[1], [True, True, True], 'WORLD')
-    bone_copy_rotation_constraint(armature, [new_hand_name], name[:-6] + "_E_AUX", [True, True, True], 'LOCAL')
+    bone_copy_rotation_constraint(armature, [end_name], forearm_hand_array[1], [True, True, True], 'WORLD')
+    bone_copy_rotation_constraint(armature, [new_hand_name], end_name, [True, True, True], 'LOCAL')
     chain_torsion(armature, forearm_parts, forearm_hand_array[0], new_hand_name)
     
-def finger_drivers_and_constraints(armature, finger_names_array, bend_multiplier):
-    """Configure all the drivers for one finger (non-thumb)"""
+def finger_drivers_and_constraints(armature, finger_names_array, bend_multiplier, use_constraints=False):
+    """Configure all the drivers for one finger (non-thumb).
+    With use_constraints, Transformation constraints replace the rotation drivers (the scale driver is kept)"""
     enter_pose_mode(armature)
     assign_rotation_mode(armature, finger_names_array[0:3])
     lock_bone_transforms(armature, finger_names_array[0:3], [True, True, True, True, True, True, True, True, True])
+    if use_constraints:
+        bone_transformation_constraint(armature, [finger_names_array[1]], finger_names_array[0], 'X', 'X', bend_multiplier*1.5)
+        bone_transformation_constraint(armature, [finger_names_array[2]], finger_names_array[0], 'X', 'X', bend_multiplier*2.0)
+        bone_transformation_constraint(armature, [finger_names_array[0]], finger_names_array[3], 'Z', 'Z', 1.0)
+        finger_scale_driver(armature, finger_names_array[0], finger_names_array[3])
+        return
     dp1 = "pose.bones[\"" + finger_names_array[1] + "\"].rotation_euler"
     dp2 = "pose.bones[\"" + finger_names_array[2] + "\"].rotation_euler"
     dr1 = armature.driver_add(dp1, 0)
@@ -565,21 +1184,33 @@ def finger_drivers_and_constraints(armature, finger_names_array, bend_multiplier
     var01.targets[0].transform_type = 'ROT_Z'
     var01.targets[0].transform_space = 'LOCAL_SPACE'
     dr01.driver.expression = "var"
-    dp02 = "pose.bones[\"" + finger_names_array[0] + "\"].rotation_euler"
-    dr02 = armature.driver_add(dp02, 0)
-    var02 = dr02.driver.variables.new()
-    var02.type = 'TRANSFORMS'
-    var02.targets[0].id = armature.id_data
-    var02.targets[0].bone_target = finger_names_array[3]
-    var02.targets[0].transform_type = 'SCALE_AVG'
-    var02.targets[0].transform_space = 'LOCAL_SPACE'
-    dr02.driver.expression = "-var + 1"
-
-def thumb_drivers_and_constraints(armature, finger_names_array, bend_multiplier):
-    """Configure all the drivers for one thumb"""
+    finger_scale_driver(armature, finger_names_array[0], finger_names_array[3])
+
+def finger_scale_driver(armature, bone_name, handle_name):
+    """Bend a finger bone around X when its handle is scaled. Kept as a driver in every build mode:
+    a constraint can't read the average scale"""
+    dp = "pose.bones[\"" + bone_name + "\"].rotation_euler"
+    dr = armature.driver_add(dp, 0)
+    var = dr.driver.variables.new()
+    var.type = 'TRANSFORMS'
+    var.targets[0].id = armature.id_data
+    var.targets[0].bone_target = handle_name
+    var.targets[0].transform_type = 'SCALE_AVG'
+    var.targets[0].transform_space = 'LOCAL_SPACE'
+    dr.driver.expression = "-var + 1"
+
+def thumb_drivers_and_constraints(armature, finger_names_array, bend_multiplier, use_constraints=False):
+    """Configure all the drivers for one thumb.
+    With use_constraints, Transformation constraints replace the rotation drivers (the scale driver is kept)"""
     enter_pose_mode(armature)
     assign_rotation_mode(armature, finger_names_array[0:3])
     lock_bone_transforms(armature, finger_names_array[0:3], [True, True, True, True, True, True, True, True, True])
+    if use_constraints:
+        bone_transformation_constraint(armature, [finger_names_array[2]], finger_names_array[1], 'X', 'X', bend_multiplier*2.0)
+        bone_transformation_constraint(armature, [finger_names_array[1]], finger_names_array[4], 'Z', 'Z', 1.0)
+        finger_scale_driver(armature, finger_names_array[1], finger_names_array[4])
+        bone_copy_rotation_constraint(armature, [finger_names_array[0]], finger_names_array[3], [True, True, True], 'WORLD')
+        return
     dp2 = "pose.bones[\"" + finger_names_array[2] + "\"].rotation_euler"
     dr2 = armature.driver_add(dp2, 0)
     var2 = dr2.driver.variables.new()
@@ -598,39 +1229,30 @@ def thumb_drivers_and_constraints(armature, finger_names_array, bend_multiplier)
     var11.targets[0].transform_type = 'ROT_Z'
     var11.targets[0].transform_space = 'LOCAL_SPACE'
     dr11.driver.expression = "var"
-    dp12 = "pose.bones[\"" + finger_names_array[1] + "\"].rotation_euler"
-    dr12 = armature.driver_add(dp12, 0)
-    var12 = dr12.driver.variables.new()
-    var12.type = 'TRANSFORMS'
-    var12.targets[0].id = armature.id_data
-    var12.targets[0].bone_target = finger_names_array[4]
-    var12.targets[0].transform_type = 'SCALE_AVG'
-    var12.targets[0].transform_space = 'LOCAL_SPACE'
-    dr12.driver.expression = "-var + 1"
+    finger_scale_driver(armature, finger_names_array[1], finger_names_array[4])
     bone_copy_rotation_constraint(armature, [finger_names_array[0]], finger_names_array[3], [True, True, True], 'WORLD')
 
-def create_heel_foot_control(armature, mch_names_array, ik_main_name, switch_property_name, aux_layer, handle_layer):
+def create_heel_foot_control(armature, mch_names_array, ik_main_name, switch_property_name, aux_layer, handle_layer, consolidated=False):
     """Create the foot-heel mechanism"""
     enter_edit_mode(armature)
-    length = armature.data.edit_bones[mch_names_array[1]].length
-    # Create roll bone
-    roll_name = mch_names_array[1][:-8] + "_roll_HDL"
-    add_bone_axis(armature, roll_name, mch_names_array[0], ik_main_name, 'HEAD', '-Y', length, False, handle_layer, True)
-    lock_bone_transforms(armature, [roll_name], [True, True, True, False, True, False, True, True, True])
-    bone_add_hide_driver(armature, roll_name, switch_property_name, "1-var")
-    # Create heel bone
-    heel_name = mch_names_array[1][:-8] + "_heel_AUX"
-    add_bone_axis(armature, heel_name, ik_main_name, ik_main_name, 'TAIL', '-Y', length, False, aux_layer, True)
-    lock_bone_transforms(armature, [heel_name], [True, True, True, True, True, True, True, True, True])
-    # Create pivot bone
-    pivot_name = mch_names_array[1][:-8] + "_pivot_HDL"
-    add_bone_axis(armature, pivot_name, mch_names_array[1], heel_name, 'HEAD', '-Y', length, False, aux_layer, True)
-    lock_bone_transforms(armature, [pivot_name], [True, True, True, True, True, True, True, True, True])
-
+    heads, tails, _ = bone_placements(armature, [mch_names_array[1]])
+    length = math.dist(heads[0], tails[0])
+    # Roll bone (at the foot), heel bone (at the IK handle tail) and pivot bone (at the toe), placed in one pass
+    roll_name, heel_name, pivot_name = new_axis_bones(armature,
+        [derived_bone_name(mch_names_array[1], [tag], role) for tag, role in (('roll', 'HDL'), ('heel', 'AUX'), ('pivot', 'HDL'))],
+        [mch_names_array[0], ik_main_name, mch_names_array[1]], ['HEAD', 'TAIL', 'HEAD'], ['-Y'] * 3, [length] * 3,
+        [bone_layers_array(handle_layer), bone_layers_array(aux_layer), bone_layers_array(aux_layer)], True)
+    parent_bones(armature, [roll_name, heel_name], ik_main_name, False, True, 'FULL')
+    parent_bones(armature, [pivot_name], heel_name, False, True, 'FULL')
     # Parent mch bones
     parent_bones(armature, [mch_names_array[0]], pivot_name, False, True, 'FULL')
     parent_bones(armature, [mch_names_array[1]], heel_name, False, True, 'FULL')
 
+    assign_rotation_mode(armature, [roll_name, heel_name, pivot_name])
+    lock_bone_transforms(armature, [roll_name], [True, True, True, False, True, False, True, True, True])
+    lock_bone_transforms(armature, [heel_name, pivot_name], [True, True, True, True, True, True, True, True, True])
+    bone_add_hide_driver(armature, roll_name, switch_property_name, "1-var", consolidated)
+
     # Pivot bone constraints
     bone_copy_rotation_constraint(armature, [pivot_name], roll_name, [True, True, True], 'LOCAL')
     bone_limit_rotation_constraint(armature, [pivot_name], [True, False, False], [0.0, math.radians(170)], [0.0,0.0], [0.0,0.0], 'LOCAL')
@@ -639,14 +1261,16 @@ def create_heel_foot_control(armature, mch_names_array, ik_main_name, switch_pro
     bone_copy_rotation_constraint(armature, [heel_name], roll_name, [True, False, False], 'LOCAL')
     bone_limit_rotation_constraint(armature, [heel_name], [True, False, False], [math.radians(-170),0.0], [0.0,0.0], [0.0,0.0], 'LOCAL')
 
-    bone_add_hide_driver(armature, ik_main_name, switch_property_name, "1-var")
+    bone_add_hide_driver(armature, ik_main_name, switch_property_name, "1-var", consolidated)
 
 
 
 
 
+@unprofiled
 def register():
     pass
 
+@unprofiled
 def unregister():
     pass
\ No newline at end of file
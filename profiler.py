@@ -0,0 +1,236 @@
+import bpy
+import json
+import time
+import inspect
+import functools
+import contextlib
+from . import populate
+
+# Build time profiler of populate.py. While a Profiler is active every populate function is wrapped to record its wall
+# time, the mode switches and bpy.ops calls it made and the bones, constraints and drivers it created. Nothing is
+# wrapped when the profiler is not used, so populate runs at full speed.
+
+# Active profiler. None when populate is not being profiled
+_active = None
+_NO_SPAN = contextlib.nullcontext()
+
+def profiled_functions():
+    """Public functions of populate.py that the profiler wraps: all but the ones decorated with populate.unprofiled"""
+    return {name: function for name, function in inspect.getmembers(populate, inspect.isfunction)
+        if function.__module__ == populate.__name__ and not name.startswith('_') and getattr(function, 'profiled', True)}
+
+class _OpsCounter:
+    """Stand-in for the bpy module inside populate.py that counts the operators called through bpy.ops"""
+
+    def __init__(self, target, profiler, depth=0):
+        self._target = target
+        self._profiler = profiler
+        self._depth = depth # 0: bpy, 1: bpy.ops, 2: bpy.ops.<submodule>, 3: operator
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if (self._depth == 0 and name != 'ops') or self._depth == 3:
+            return value
+        return _OpsCounter(value, self._profiler, self._depth + 1)
+
+    def __call__(self, *args, **kwargs):
+        self._profiler.ops += 1
+        return self._target(*args, **kwargs)
+
+class Span:
+    """A profiled call (or section) with what happened during it"""
+
+    def __init__(self, name, category, path, start):
+        self.name = name
+        self.category = category
+        self.path = path
+        self.start = start
+        self.duration = 0.0
+        self.counts = {}
+
+class Profiler:
+    """Record populate.py calls made on an armature. Use as a context manager around the populate operations"""
+
+    def __init__(self, armature, name='Populate armature'):
+        self.armature = armature
+        self.name = name
+        self.spans = []
+        self.stack = []
+        self.ops = 0
+        self.mode_switches = 0
+        self.overhead = 0.0
+        # Incremented when a populate function returns or a section starts (code outside populate, like the removal of
+        # modules being rebuilt, runs between sections): bones, constraints and drivers are only counted again then
+        self.generation = 0
+        self.totals = None
+        self.originals = {}
+        self.previous = None
+
+    def __enter__(self):
+        self.begin()
+        self._install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._uninstall()
+        self.end()
+        return False
+
+    def begin(self):
+        """Start the root span. Populate calls are only recorded inside step() (or the with block of the profiler)"""
+        self.root = self.span(self.name, 'populate')
+        self.root.__enter__()
+
+    def end(self):
+        self.root.__exit__(None, None, None)
+
+    @contextlib.contextmanager
+    def step(self):
+        """Record the populate calls of the with block, for builds run a few steps at a time (modal populate)"""
+        self._install()
+        try:
+            yield self
+        finally:
+            self._uninstall()
+
+    def _install(self):
+        """Wrap the populate functions"""
+        global _active
+        for name, function in profiled_functions().items():
+            self.originals[name] = function
+            setattr(populate, name, self._wrap(function))
+        self.originals['_count_mode_switch'] = populate._count_mode_switch
+        populate._count_mode_switch = self._count_mode_switch
+        self.originals['bpy'] = populate.bpy
+        populate.bpy = _OpsCounter(bpy, self)
+        self.previous = _active
+        _active = self
+
+    def _uninstall(self):
+        global _active
+        for name, function in self.originals.items():
+            setattr(populate, name, function)
+        self.originals = {}
+        _active = self.previous
+
+    def _wrap(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.span(function.__name__, 'function'):
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.generation += 1
+        return wrapper
+
+    def _count_mode_switch(self):
+        self.mode_switches += 1
+        self.originals['_count_mode_switch']()
+
+    def _totals(self):
+        """Bones, constraints and drivers of the armature, counted again only when the generation changed: the
+        boundaries of nested sections and spans mostly share one count"""
+        if self.totals is not None and self.totals[0] == self.generation:
+            return self.totals[1]
+        armature = self.armature
+        if armature.mode == 'EDIT':
+            bones = len(armature.data.edit_bones)
+        else:
+            bones = len(armature.data.bones)
+        totals = {
+            'bones': bones,
+            'constraints': sum(len(pose_bone.constraints) for pose_bone in armature.pose.bones),
+            'drivers': populate.driver_count(armature),
+        }
+        self.totals = (self.generation, totals)
+        return totals
+
+    def _counts(self):
+        """Current counters (the time spent counting is not added to the spans)"""
+        start = time.perf_counter()
+        counts = {'mode_switches': self.mode_switches, 'ops': self.ops}
+        counts.update(self._totals())
+        self.overhead += time.perf_counter() - start
+        return counts
+
+    @contextlib.contextmanager
+    def span(self, name, category):
+        """Record what happens inside the with block as a span nested in the current one"""
+        before = self._counts()
+        path = (self.stack[-1].path if self.stack else ()) + (name,)
+        span = Span(name, category, path, time.perf_counter() - self.overhead)
+        self.stack.append(span)
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - self.overhead - span.start
+            self.stack.pop()
+            after = self._counts()
+            span.counts = {key: after[key] - before[key] for key in after}
+            self.spans.append(span)
+
+    def tree(self):
+        """Spans merged by call path, as nested dictionaries in call order"""
+        nodes = {}
+        roots = []
+        for span in sorted(self.spans, key=lambda s: (s.start, -s.duration)):
+            node = nodes.get(span.path)
+            if node is None:
+                node = {'name': span.name, 'category': span.category, 'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'children': []}
+                node.update({key: 0 for key in span.counts})
+                nodes[span.path] = node
+                parent = nodes.get(span.path[:-1])
+                (parent['children'] if parent else roots).append(node)
+            node['calls'] += 1
+            node['seconds'] += span.duration
+            for key, value in span.counts.items():
+                node[key] += value
+        for node in nodes.values():
+            node['self_seconds'] = node['seconds'] - sum(child['seconds'] for child in node['children'])
+        return roots
+
+    def report(self):
+        """Text report of the tree"""
+        lines = ["%-60s %6s %10s %10s %6s %6s %6s %6s %6s" % ('', 'calls', 'total ms', 'self ms', 'modes', 'ops', 'bones', 'cons', 'drvs')]
+        def add_lines(nodes, depth):
+            for node in nodes:
+                lines.append("%-60s %6d %10.2f %10.2f %6d %6d %6d %6d %6d" % (
+                    ("  " * depth + node['name'])[:60], node['calls'], 1000.0 * node['seconds'], 1000.0 * node['self_seconds'],
+                    node['mode_switches'], node['ops'], node['bones'], node['constraints'], node['drivers']))
+                add_lines(node['children'], depth + 1)
+        add_lines(self.tree(), 0)
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Spans in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        events = []
+        origin = min((span.start for span in self.spans), default=0.0)
+        for span in self.spans:
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': 1e6 * (span.start - origin),
+                'dur': 1e6 * span.duration,
+                'pid': 1,
+                'tid': 1,
+                'args': span.counts,
+            })
+        events.sort(key=lambda e: e['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, format='JSON'):
+        """Write the tree ('JSON') or the trace ('CHROME') to a file"""
+        if format == 'CHROME':
+            data = self.chrome_trace()
+        else:
+            data = {'name': self.name, 'tree': self.tree()}
+        with open(path, 'w') as profile_file:
+            json.dump(data, profile_file, indent=1)
+
+def section(name):
+    """Span of a part of the build (e.g. a rig module) if populate is being profiled"""
+    if _active is None:
+        return _NO_SPAN
+    _active.generation += 1
+    return _active.span(name, 'section')
@@ -1,4 +1,11 @@
 import bpy
+from . import populate
+
+def fk_ik_switch_update(switch_property_name):
+    """Update function of an FK-IK switch property: show and hide the bones of its consolidated switches"""
+    def update(self, context):
+        populate.update_switch_visibility(self, switch_property_name)
+    return update
 
 def register():
     
@@ -9,6 +16,7 @@ def register():
         min=0.0,
         max=1.0,
         options={'ANIMATABLE'},
+        update=fk_ik_switch_update('fk_ik_left_arm'),
     )
     bpy.types.Object.fk_ik_right_arm = bpy.props.FloatProperty(
         name='FK-IK right arm',
@@ -17,6 +25,7 @@ def register():
         min=0.0,
         max=1.0,
         options={'ANIMATABLE'},
+        update=fk_ik_switch_update('fk_ik_right_arm'),
     )
     bpy.types.Object.fk_ik_left_leg = bpy.props.FloatProperty(
         name='FK-IK left leg',
@@ -25,6 +34,7 @@ def register():
         min=0.0,
         max=1.0,
         options={'ANIMATABLE'},
+        update=fk_ik_switch_update('fk_ik_left_leg'),
     )
     bpy.types.Object.fk_ik_right_leg = bpy.props.FloatProperty(
         name='FK-IK right leg',
@@ -33,6 +43,7 @@ def register():
         min=0.0,
         max=1.0,
         options={'ANIMATABLE'},
+        update=fk_ik_switch_update('fk_ik_right_leg'),
     )
     bpy.types.Object.production_state = bpy.props.EnumProperty(
         name='production state',
@@ -51,6 +62,83 @@ def register():
         name='edit armature',
         description='the armature being edited'
     )
+    bpy.types.Scene.rig_spec_path = bpy.props.StringProperty(
+        name='rig specification',
+        description='JSON rig specification used by populate (the humanoid specification if empty)',
+        default='',
+        subtype='FILE_PATH',
+    )
+    bpy.types.Scene.rig_driver_mode = bpy.props.EnumProperty(
+        name='driver mode',
+        description='How populate builds finger, thumb and torsion setups',
+        items=[
+            ('DRIVERS', 'drivers', 'scripted expression drivers'),
+            ('CONSTRAINTS', 'constraints', 'native constraints where they are equivalent (faster playback)'),
+        ],
+        default='DRIVERS',
+    )
+    bpy.types.Scene.rig_switch_mode = bpy.props.EnumProperty(
+        name='switch mode',
+        description='How populate builds the FK-IK switches of arms and legs',
+        items=[
+            ('DRIVERS', 'drivers', 'influence and hide drivers on every bone'),
+            ('CONSOLIDATED', 'consolidated', 'one influence driver per bone, bones hidden without drivers (faster switching)'),
+        ],
+        default='DRIVERS',
+    )
+    bpy.types.Scene.rig_lod = bpy.props.EnumProperty(
+        name='level of detail',
+        description='Rig complexity built by populate, with the same controls at every level',
+        items=[
+            ('FULL', 'full', 'every torsion and finger setup'),
+            ('MEDIUM', 'medium', 'shorter torsion and spline chains, no finger drivers (layout)'),
+            ('PROXY', 'proxy', 'shortest spline chains, no torsion and no finger drivers (crowds)'),
+        ],
+        default='FULL',
+    )
+    bpy.types.Scene.rig_symmetry = bpy.props.BoolProperty(
+        name='symmetry',
+        description='Build the left side modules and mirror them to the right side when the template is symmetric',
+        default=False,
+    )
+    bpy.types.Scene.rig_profile = bpy.props.BoolProperty(
+        name='profile populate',
+        description='Print a build time report of populate to the console',
+        default=False,
+    )
+    bpy.types.Scene.rig_profile_path = bpy.props.StringProperty(
+        name='profile file',
+        description='File the populate profile is exported to (console only if empty)',
+        default='',
+        subtype='FILE_PATH',
+    )
+    bpy.types.Scene.rig_profile_format = bpy.props.EnumProperty(
+        name='profile format',
+        description='Format of the exported populate profile',
+        items=[
+            ('JSON', 'JSON', 'call tree with timings and counts'),
+            ('CHROME', 'Chrome trace', 'trace events for chrome://tracing or Perfetto'),
+        ],
+        default='JSON',
+    )
+    bpy.types.Scene.rig_cache_dir = bpy.props.StringProperty(
+        name='rig cache',
+        description='Directory where populated rigs are cached by proportions (no cache if empty)',
+        default='',
+        subtype='DIR_PATH',
+    )
+    bpy.types.Scene.rig_file_path = bpy.props.StringProperty(
+        name='rig file',
+        description='Rig file the armature is exported to and imported from',
+        default='',
+        subtype='FILE_PATH',
+    )
+    bpy.types.Scene.rig_cache_size = bpy.props.IntProperty(
+        name='cache size (MB)',
+        description='Size of the rig cache directory over which the least recently used rigs are removed',
+        default=1024,
+        min=1,
+    )
     bpy.types.EditBone.deletable = bpy.props.BoolProperty(
         name='deletable',
         description='bone is deletable in clean_armature()',
@@ -64,4 +152,15 @@ def unregister():
     del bpy.types.Object.fk_ik_right_leg
     del bpy.types.Object.production_state
     del bpy.types.Scene.armature_ob
+    del bpy.types.Scene.rig_spec_path
+    del bpy.types.Scene.rig_driver_mode
+    del bpy.types.Scene.rig_switch_mode
+    del bpy.types.Scene.rig_lod
+    del bpy.types.Scene.rig_symmetry
+    del bpy.types.Scene.rig_profile
+    del bpy.types.Scene.rig_profile_path
+    del bpy.types.Scene.rig_profile_format
+    del bpy.types.Scene.rig_cache_dir
+    del bpy.types.Scene.rig_cache_size
+    del bpy.types.Scene.rig_file_path
     del bpy.types.EditBone.deletable
\ No newline at end of file
@@ -0,0 +1,136 @@
+from . import populate
+from . import manifest
+
+# Bone registry of a populated armature: every bone with its role, side, part and tags (see populate.parse_bone_name),
+# the rig module (limb) that created or changed it, and the bones it was derived from and that were derived from it
+# (the derivations of the build manifest). The registry is built once per build and every query is answered from
+# indexes, e.g. the IK handles of the left arm: bone_registry(armature).query(module='arm_left', tag='ik', role='HDL').
+# Inside a build session the registry is built once and kept up to date as populate creates and renames bones
+
+# Registries by armature name, with the manifest they were built from
+_registries = {}
+
+class BoneRegistry:
+    """Bones of an armature indexed by role, side, part, tag and module"""
+
+    def __init__(self, armature, build_manifest=None):
+        self.bones = {}
+        self.index = {}
+        self.queries = {}
+        modules = build_manifest['modules'] if build_manifest else {}
+        owners = {}
+        for module_name, entry in modules.items():
+            for name in entry['bones']:
+                owners[name] = module_name
+            for name in entry['template'] + entry['modified']:
+                owners.setdefault(name, module_name)
+        derivations = {}
+        for module_name, entry in modules.items():
+            for name, derivation in entry.get('derivations', {}).items():
+                derivations[name] = {anchor['bone'] for anchor in derivation.values() if 'bone' in anchor}
+                for source in derivations[name]:
+                    owners.setdefault(source, module_name)
+
+        bones = armature.data.edit_bones if armature.mode == 'EDIT' else armature.data.bones
+        for bone in bones:
+            self.bones[bone.name] = self._entry(bone.name, owners.get(bone.name), derivations.get(bone.name, ()))
+        for name, sources in derivations.items():
+            for source in sources:
+                if source in self.bones and name in self.bones:
+                    self.bones[source]['derived'].append(name)
+        for entry in self.bones.values():
+            entry['derived'].sort()
+            self._index(entry)
+
+    @staticmethod
+    def _entry(name, module, sources):
+        part, side, tags, role = populate.parse_bone_name(name)
+        return {
+            'name': name,
+            'part': part,
+            'side': side,
+            'tags': [tag.lower() for tag in tags],
+            'role': role,
+            'module': module,
+            'sources': sorted(sources),
+            'derived': [],
+        }
+
+    @staticmethod
+    def _keys(entry):
+        keys = [('part', entry['part']), ('side', entry['side']), ('role', entry['role']), ('module', entry['module'])]
+        return keys + [('tag', tag) for tag in entry['tags']]
+
+    def _index(self, entry):
+        for key in self._keys(entry):
+            self.index.setdefault(key, set()).add(entry['name'])
+        self.queries.clear()
+
+    def _unindex(self, entry):
+        for key in self._keys(entry):
+            self.index[key].discard(entry['name'])
+        self.queries.clear()
+
+    def add(self, name, module=None):
+        """Register a created bone, or the module of a registered one"""
+        entry = self.bones.get(name)
+        if entry is None:
+            entry = self.bones[name] = self._entry(name, module, ())
+        elif module is None or entry['module'] == module:
+            return
+        else:
+            self._unindex(entry)
+            entry['module'] = module
+        self._index(entry)
+
+    def rename(self, name, new_name):
+        """Register the new name of a renamed bone, which gets the role, side, part and tags of its new name"""
+        old = self.bones.pop(name, None)
+        if old is None:
+            self.add(new_name)
+            return
+        self._unindex(old)
+        entry = self.bones[new_name] = self._entry(new_name, old['module'], old['sources'])
+        entry['derived'] = old['derived']
+        for key, other_key in (('sources', 'derived'), ('derived', 'sources')):
+            for other_name in entry[key]:
+                other = self.bones.get(other_name)
+                if other is not None:
+                    other[other_key] = sorted(new_name if item == name else item for item in other[other_key])
+        self._index(entry)
+
+    def get(self, name):
+        """Registry entry of a bone (None if the armature has no such bone)"""
+        return self.bones.get(name)
+
+    def query(self, **criteria):
+        """Names of the bones matching every criterion (part, side, role, module or tag), e.g. query(side='left', role='HDL').
+        Results are computed once per registry"""
+        key = tuple(sorted(criteria.items()))
+        if key not in self.queries:
+            sets = sorted((self.index.get(item, set()) for item in key), key=len)
+            names = set(sets[0]).intersection(*sets[1:]) if sets else set(self.bones)
+            self.queries[key] = frozenset(names)
+        return self.queries[key]
+
+    def sources(self, name):
+        """Bones a created bone was derived from"""
+        return self.bones[name]['sources']
+
+    def derived(self, name):
+        """Bones derived from a bone"""
+        return self.bones[name]['derived']
+
+def bone_registry(armature):
+    """Registry of an armature. Inside a build session it is built once for the session, otherwise it is built again
+    only when the build manifest changed (REQUIRES OBJECT OR POSE MODE outside a build session)"""
+    session = populate.build_session(armature)
+    if session is not None:
+        if session.registry is None:
+            session.registry = BoneRegistry(armature, manifest.read_manifest(armature))
+        return session.registry
+    data = armature.get(manifest.MANIFEST_PROPERTY)
+    cached = _registries.get(armature.name_full)
+    if cached is None or cached[0] != data or len(cached[1].bones) != len(armature.data.bones):
+        _registries[armature.name_full] = (data, BoneRegistry(armature, manifest.read_manifest(armature)))
+    return _registries[armature.name_full][1]
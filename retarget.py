@@ -0,0 +1,112 @@
+import bpy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from . import populate
+from . import manifest
+from . import geometry
+
+# Retarget a populated armature to new proportions: the template bones take the rest positions of another armature,
+# and every bone created by populate is moved with the bones or spline it was derived from (see the derivations in
+# manifest.py), all at once by geometry.solve_derivations. Constraints, drivers and animation are kept. Child Of
+# inverses and spline hooks are computed again.
+
+def _base_name(name):
+    """Name without the '.001' suffix Blender adds to duplicated names"""
+    base, _, suffix = name.rpartition('.')
+    if base and suffix.isdigit():
+        return base
+    return name
+
+def spline_points(armature, spline):
+    """Control points and evaluated points (armature space) of a curve object, as arrays"""
+    to_armature = armature.matrix_world.inverted()
+    evaluated_points = [to_armature @ p for p in populate.spline_evaluated_points(spline)]
+    return numpy.array(manifest.spline_control_points(spline)), numpy.array(evaluated_points)
+
+def copy_spline_shape(spline, source):
+    """Give a curve object the control points of another one"""
+    for curve_spline, source_spline in zip(spline.data.splines, source.data.splines):
+        for point, source_point in zip(curve_spline.bezier_points, source_spline.bezier_points):
+            point.co = source_point.co
+            point.handle_left = source_point.handle_left
+            point.handle_right = source_point.handle_right
+        for point, source_point in zip(curve_spline.points, source_spline.points):
+            point.co = source_point.co
+
+def reset_hooks(armature, ob):
+    """Compute the hook modifiers of an object again for the rest position of the armature"""
+    for modifier in ob.modifiers:
+        if modifier.type != 'HOOK' or modifier.object is not armature or not modifier.subtarget:
+            continue
+        bone = armature.data.bones.get(modifier.subtarget)
+        if bone:
+            modifier.matrix_inverse = (ob.matrix_world.inverted() @ armature.matrix_world @ bone.matrix_local).inverted()
+
+def retarget_armature(armature, source, plan):
+    """Move the template bones of a populated armature to the rest positions of the bones with the same name in source
+    (and the splines to the shape of the source splines), moving the created bones with them"""
+    geometry.require_numpy("Retargeting")
+    build_manifest = manifest.read_manifest(armature)
+    if build_manifest is None:
+        raise ValueError("The armature has no build manifest, populate it again")
+    derivations = {}
+    for entry in build_manifest['modules'].values():
+        derivations.update(entry.get('derivations', {}))
+    objects = [ob for ob in armature.users_collection[0].objects if ob is not armature]
+    source_objects = {_base_name(ob.name): ob for ob in source.users_collection[0].objects if ob.type == 'CURVE'}
+
+    # Everything is computed at rest
+    pose_position = armature.data.pose_position
+    armature.data.pose_position = 'REST'
+    bpy.context.view_layer.update()
+    for ob in objects:
+        if ob.type == 'CURVE' and _base_name(ob.name) in source_objects:
+            copy_spline_shape(ob, source_objects[_base_name(ob.name)])
+
+    populate.enter_edit_mode(armature)
+    edit_bones = armature.data.edit_bones
+    template_names = [name for name in build_manifest['template'] if name in source.data.bones and edit_bones.get(name)]
+    template_names.sort(key=lambda name: len(edit_bones[name].parent_recursive))
+    for name in template_names:
+        source_bone = source.data.bones[name]
+        edit_bone = edit_bones[name]
+        edit_bone.head = source_bone.head_local
+        edit_bone.tail = source_bone.tail_local
+        edit_bone.align_roll(source_bone.matrix_local.to_3x3().col[2])
+    # Bones are read and written with foreach_get/foreach_set
+    edit_bone_list = list(edit_bones)
+    names = [edit_bone.name for edit_bone in edit_bone_list]
+    indices = {name: idx for idx, name in enumerate(names)}
+    derived_names = [name for name in derivations if name in indices]
+    spline_names = {anchor['spline'] for derivation in derivations.values() for anchor in derivation.values() if 'spline' in anchor}
+    splines = {name: spline_points(armature, bpy.data.objects[name]) for name in spline_names}
+    heads, tails, rotations = geometry.read_frames(edit_bones, 'matrix')
+    heads, tails, rotations = geometry.solve_derivations(names, heads, tails, rotations, derivations, splines)
+    edit_bones.foreach_set('head', heads.astype(numpy.float32).ravel())
+    edit_bones.foreach_set('tail', tails.astype(numpy.float32).ravel())
+    rolls = numpy.zeros(len(edit_bone_list), dtype=numpy.float32)
+    edit_bones.foreach_get('roll', rolls)
+    rows = [indices[name] for name in derived_names]
+    rolls[rows] = geometry.bone_rolls(heads[rows], tails[rows], rotations[rows, :, 2])
+    edit_bones.foreach_set('roll', rolls)
+    populate.enter_object_mode()
+
+    # Constraint inverses and hooks were computed for the old rest position
+    for pose_bone in armature.pose.bones:
+        for c in pose_bone.constraints:
+            if c.type == 'CHILD_OF':
+                c.set_inverse_pending = True
+    for ob in objects:
+        for c in ob.constraints:
+            if c.type == 'CHILD_OF':
+                c.set_inverse_pending = True
+    bpy.context.view_layer.update()
+    for ob in objects:
+        reset_hooks(armature, ob)
+    armature.data.pose_position = pose_position
+
+    manifest.update_signatures(armature, plan, build_manifest, build_manifest['modules'])
+    manifest.write_manifest(armature, build_manifest)
+    return len(template_names), len(derived_names)
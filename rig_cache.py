@@ -0,0 +1,100 @@
+import bpy
+import os
+import json
+import hashlib
+from . import bl_info
+from . import populate
+from . import planner
+from . import mirror
+from . import manifest
+
+# Cache of populated rigs. A rig key hashes the template bones and splines of an armature (relative to the armature),
+# the rig specification, the build options, the add-on version and the code that builds rigs. A populated collection is written to
+# <cache directory>/<key>.blend, and armatures with the same key are replaced by a copy of it instead of being
+# populated. The least recently used files are removed when the directory grows over its size limit.
+
+CACHE_FORMAT = 2
+# Modules whose code decides what a populated rig contains: changing any of them gives new keys
+BUILD_MODULES = (populate, planner, mirror, manifest)
+
+def code_hash():
+    """Hash of the source files of the BUILD_MODULES"""
+    data = hashlib.sha1()
+    for module in BUILD_MODULES:
+        with open(module.__file__, 'rb') as source:
+            data.update(source.read())
+    return data.hexdigest()
+
+def rig_key(armature, spec, options):
+    """Key of the rig populated from the armature (REQUIRES OBJECT OR POSE MODE)"""
+    values = [CACHE_FORMAT, list(bl_info['version']), code_hash(), manifest.spec_hash(spec, options)]
+    for bone in armature.data.bones:
+        values.append([bone.name, bone.parent.name if bone.parent else None, manifest.bone_signature(armature, bone.name)])
+    to_armature = armature.matrix_world.inverted()
+    for ob in armature.users_collection[0].objects:
+        if ob.type != 'CURVE':
+            continue
+        values.append([ob.name, [round(value, 5) for row in to_armature @ ob.matrix_world for value in row], manifest.spline_signature(ob)])
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.blend')
+
+def evict(cache_dir, size_limit):
+    """Remove the least recently used rigs until the cache fits in size_limit bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.blend'):
+            path = os.path.join(cache_dir, name)
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= size_limit:
+            break
+        os.remove(path)
+        total -= size
+
+def store_rig(armature, cache_dir, key, size_limit):
+    """Write the populated collection of the armature to the cache"""
+    os.makedirs(cache_dir, exist_ok=True)
+    collection = armature.users_collection[0]
+    path = cache_path(cache_dir, key)
+    temporary_path = path + '.tmp'
+    bpy.data.libraries.write(temporary_path, {collection}, fake_user=True)
+    os.replace(temporary_path, path)
+    evict(cache_dir, size_limit)
+
+def load_cached_rig(armature, cache_dir, key):
+    """Replace the template collection of the armature by the cached rig with this key. Everything using the template
+    objects (mesh modifiers, parents, scene pointers) uses the cached ones. Returns the new armature, None on a miss"""
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    os.utime(path) # Recently used
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.collections = data_from.collections
+        # Loaded objects are renamed when their names are taken: the names in the file are the ones they had when cached
+        cached_names = list(data_from.objects)
+        data_to.objects = data_from.objects
+    cached_names = {ob: name for name, ob in zip(cached_names, data_to.objects) if ob is not None}
+    children = {child for item in data_to.collections for child in item.children}
+    loaded = [item for item in data_to.collections if item not in children][0]
+    collection = armature.users_collection[0]
+    templates = {ob.name: ob for ob in collection.all_objects}
+    new_armature = None
+    for ob in list(loaded.all_objects):
+        template = templates.get(cached_names.get(ob))
+        if template is None:
+            collection.objects.link(ob)
+            continue
+        if template is armature:
+            ob.matrix_world = armature.matrix_world.copy()
+            new_armature = ob
+        name = template.name
+        template.user_remap(ob)
+        bpy.data.objects.remove(template, do_unlink=True)
+        ob.name = name
+    for item in data_to.collections:
+        bpy.data.collections.remove(item)
+    return new_armature
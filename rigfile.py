@@ -0,0 +1,286 @@
+import bpy
+import json
+from . import populate
+from . import manifest
+from . import retarget
+
+# Rig files: a populated armature serialized as versioned JSON. The file has the bones (geometry, hierarchy, layers and
+# settings, pose bone rotation modes, locks and constraints), the drivers, the constraints and modifiers of the splines
+# and the custom properties of the armature object (build manifest included). import_rig rebuilds the rig on a
+# template armature through the data API, in bulk where it can, without running populate. Constraints and modifiers
+# are written with all their editable properties, so two rig files can be compared with a text diff.
+
+RIGFILE_VERSION = 1
+FLOAT_DIGITS = 6
+
+# Edit bone settings stored besides geometry, parent and layers
+BONE_SETTINGS = ('use_connect',) + populate.EDIT_BONE_SETTINGS
+# Pose bone settings stored besides the custom shape and the bone group. Rotation modes and locks are written with
+# populate.write_pose_settings, the other ones bone by bone
+BONE_POSE_SETTINGS = ('lock_rotation_w', 'lock_ik_x', 'lock_ik_y', 'lock_ik_z', 'ik_stretch')
+POSE_SETTINGS = ('rotation_mode',) + populate.LOCK_SETTINGS + BONE_POSE_SETTINGS
+DRIVER_TARGET_SETTINGS = ('data_path', 'bone_target', 'transform_type', 'transform_space', 'rotation_mode')
+
+# bpy.data collections of the ID types drivers and constraints can point to
+ID_COLLECTIONS = {
+    'OBJECT': 'objects', 'Object': 'objects',
+    'ARMATURE': 'armatures', 'Armature': 'armatures',
+    'CURVE': 'curves', 'Curve': 'curves',
+    'MESH': 'meshes', 'Mesh': 'meshes',
+    'ACTION': 'actions', 'Action': 'actions',
+    'TEXT': 'texts', 'Text': 'texts',
+    'SCENE': 'scenes', 'Scene': 'scenes',
+}
+
+def plain_value(value):
+    """JSON value of an RNA property value: vectors and matrices as lists, floats rounded, IDs by name"""
+    if isinstance(value, float):
+        return round(value, FLOAT_DIGITS)
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, set):
+        return sorted(value)
+    if isinstance(value, bpy.types.ID):
+        return value.name
+    return [plain_value(item) for item in value]
+
+def rna_values(struct):
+    """Editable properties of a constraint or modifier, with ID pointers by name"""
+    values = {}
+    for prop in struct.bl_rna.properties:
+        if prop.is_readonly or prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, prop.identifier)
+        if prop.type == 'POINTER' and value is not None and not isinstance(value, bpy.types.ID):
+            continue
+        values[prop.identifier] = plain_value(value)
+    return values
+
+class _IDResolver:
+    """IDs of the imported rig by their name in the rig file: the exported armature (and its data) is the armature
+    the rig is imported on, objects of its collection are found by their name without '.001' suffix"""
+
+    def __init__(self, armature, rig):
+        self.armature = armature
+        self.rig = rig
+        collection = armature.users_collection[0].objects if armature.users_collection else []
+        self.objects = {retarget._base_name(ob.name): ob for ob in collection}
+
+    def object(self, name):
+        if not name:
+            return None
+        if name == self.rig['armature']:
+            return self.armature
+        return self.objects.get(retarget._base_name(name)) or bpy.data.objects.get(name)
+
+    def id(self, id_type, name):
+        if not name:
+            return None
+        if id_type in ('OBJECT', 'Object'):
+            return self.object(name)
+        if id_type in ('ARMATURE', 'Armature') and name == self.rig['armature_data']:
+            return self.armature.data
+        collection = ID_COLLECTIONS.get(id_type)
+        return getattr(bpy.data, collection).get(name) if collection else None
+
+def set_rna_values(struct, values, ids):
+    """Write values of rna_values back. Returns the names of the properties that could not be written"""
+    failed = []
+    for identifier, value in values.items():
+        prop = struct.bl_rna.properties.get(identifier)
+        if prop is None:
+            failed.append(identifier)
+            continue
+        if prop.type == 'POINTER':
+            value = ids.id(prop.fixed_type.identifier, value)
+        elif prop.type == 'ENUM' and prop.is_enum_flag:
+            value = set(value)
+        try:
+            setattr(struct, identifier, value)
+        except (AttributeError, TypeError, ValueError):
+            failed.append(identifier)
+    return failed
+
+def driver_values(id_data, owner):
+    """Drivers of an ID ('OBJECT' or 'DATA' owner) with their variables"""
+    drivers = []
+    if not id_data.animation_data:
+        return drivers
+    for fcurve in id_data.animation_data.drivers:
+        driver = fcurve.driver
+        variables = []
+        for variable in driver.variables:
+            targets = []
+            for target in variable.targets:
+                values = {attribute: getattr(target, attribute) for attribute in DRIVER_TARGET_SETTINGS}
+                values['id_type'] = target.id_type
+                values['id'] = target.id.name if target.id else None
+                targets.append(values)
+            variables.append({'name': variable.name, 'type': variable.type, 'targets': targets})
+        drivers.append({
+            'owner': owner,
+            'data_path': fcurve.data_path,
+            'index': fcurve.array_index,
+            'type': driver.type,
+            'expression': driver.expression,
+            'use_self': driver.use_self,
+            'variables': variables,
+        })
+    return drivers
+
+def _rig_objects(armature):
+    """Objects of the armature collection that populate changed (every curve for armatures without manifest)"""
+    build_manifest = manifest.read_manifest(armature)
+    if build_manifest:
+        names = {object_name for entry in build_manifest['modules'].values() for object_name, _, _ in entry['objects']}
+        return [bpy.data.objects[name] for name in sorted(names) if name in bpy.data.objects]
+    collection = armature.users_collection[0].objects if armature.users_collection else []
+    return [ob for ob in collection if ob.type == 'CURVE']
+
+def export_rig(armature, path):
+    """Write a rig file of an armature (left in object mode)"""
+    rig = {
+        'version': RIGFILE_VERSION,
+        'armature': armature.name,
+        'armature_data': armature.data.name,
+        'bones': {},
+        'drivers': driver_values(armature, 'OBJECT') + driver_values(armature.data, 'DATA'),
+        'objects': {},
+        'properties': {},
+    }
+    populate.enter_edit_mode(armature)
+    for edit_bone in armature.data.edit_bones:
+        bone = {
+            'head': plain_value(edit_bone.head),
+            'tail': plain_value(edit_bone.tail),
+            'roll': plain_value(edit_bone.roll),
+            'parent': edit_bone.parent.name if edit_bone.parent else None,
+            'layers': list(edit_bone.layers),
+            'deletable': edit_bone.deletable,
+        }
+        for attribute in BONE_SETTINGS:
+            bone[attribute] = plain_value(getattr(edit_bone, attribute))
+        rig['bones'][edit_bone.name] = bone
+    populate.enter_pose_mode(armature)
+    for pose_bone in armature.pose.bones:
+        bone = rig['bones'][pose_bone.name]
+        bone['pose'] = {attribute: plain_value(getattr(pose_bone, attribute)) for attribute in POSE_SETTINGS}
+        bone['pose']['custom_shape'] = plain_value(pose_bone.custom_shape)
+        bone['pose']['custom_shape_transform'] = pose_bone.custom_shape_transform.name if pose_bone.custom_shape_transform else None
+        bone['pose']['bone_group'] = pose_bone.bone_group.name if pose_bone.bone_group else None
+        bone['constraints'] = [{'type': c.type, 'settings': rna_values(c)} for c in pose_bone.constraints]
+    for ob in _rig_objects(armature):
+        rig['objects'][ob.name] = {
+            'constraints': [{'type': c.type, 'settings': rna_values(c)} for c in ob.constraints],
+            'modifiers': [{'type': m.type, 'settings': rna_values(m), 'vertex_indices': list(m.vertex_indices) if m.type == 'HOOK' else None}
+                for m in ob.modifiers],
+        }
+    for key, value in armature.items():
+        if isinstance(value, (bool, int, float, str)):
+            rig['properties'][key] = value
+    populate.enter_object_mode()
+    with open(path, 'w') as rig_file:
+        json.dump(rig, rig_file, indent=1, sort_keys=True)
+
+def read_rig(path):
+    """Rig file contents"""
+    with open(path, 'r') as rig_file:
+        rig = json.load(rig_file)
+    if rig.get('version') != RIGFILE_VERSION:
+        raise ValueError("Unsupported rig file version " + str(rig.get('version')))
+    return rig
+
+def _write_bone_vectors(edit_bones, bones):
+    """Heads, tails and rolls of the edit bones that are in bones, with one foreach_set per attribute"""
+    edit_bone_list = list(edit_bones)
+    for attribute, size in (('head', 3), ('tail', 3), ('roll', 1)):
+        values = [0.0] * (len(edit_bone_list) * size)
+        edit_bones.foreach_get(attribute, values)
+        for idx, edit_bone in enumerate(edit_bone_list):
+            bone = bones.get(edit_bone.name)
+            if bone is not None:
+                values[idx*size:(idx+1)*size] = bone[attribute] if size > 1 else [bone[attribute]]
+        edit_bones.foreach_set(attribute, values)
+
+def import_rig(armature, path):
+    """Rebuild a rig file on a template armature. Returns the number of bones created and the settings that could not
+    be written (as 'owner: property')"""
+    rig = read_rig(path)
+    if manifest.read_manifest(armature) is not None:
+        raise ValueError("The armature is already populated, clean it first")
+    ids = _IDResolver(armature, rig)
+    bones = rig['bones']
+    failed = []
+    with populate.BuildSession(armature):
+        # Bones, placed by one foreach_set per attribute once the hierarchy is set
+        populate.enter_edit_mode(armature)
+        edit_bones = armature.data.edit_bones
+        created = 0
+        for name, bone in bones.items():
+            if edit_bones.get(name) is None:
+                populate.new_edit_bone(armature, name, bone['head'], bone['tail'], bone['roll'], bone['layers'], bone['deletable'])
+                created += 1
+        for name, bone in bones.items():
+            edit_bone = edit_bones[name]
+            edit_bone.parent = edit_bones.get(bone['parent']) if bone['parent'] else None
+            edit_bone.layers = bone['layers']
+            edit_bone.deletable = bone['deletable']
+            for attribute in BONE_SETTINGS:
+                setattr(edit_bone, attribute, bone[attribute])
+        _write_bone_vectors(edit_bones, bones)
+
+        # Pose bones: rotation modes and locks in one pass, then the other settings and the constraints
+        populate.enter_pose_mode(armature)
+        pose_bones = armature.pose.bones
+        populate.write_pose_settings(armature, {name: {attribute: bone['pose'][attribute] for attribute in ('rotation_mode',) + populate.LOCK_SETTINGS}
+            for name, bone in bones.items()})
+        for name, bone in bones.items():
+            pose_bone = pose_bones[name]
+            for attribute in BONE_POSE_SETTINGS:
+                setattr(pose_bone, attribute, bone['pose'][attribute])
+            pose_bone.custom_shape = ids.object(bone['pose']['custom_shape'])
+            pose_bone.custom_shape_transform = pose_bones.get(bone['pose']['custom_shape_transform'] or '')
+            pose_bone.bone_group = armature.pose.bone_groups.get(bone['pose']['bone_group'] or '')
+            for c in bone['constraints']:
+                new_c = pose_bone.constraints.new(c['type'])
+                failed += [name + ": " + identifier for identifier in set_rna_values(new_c, c['settings'], ids)]
+
+        # Drivers
+        for driver in rig['drivers']:
+            id_data = armature if driver['owner'] == 'OBJECT' else armature.data
+            new_driver = populate.add_driver(id_data, driver['data_path'], driver['index']).driver
+            new_driver.type = driver['type']
+            new_driver.expression = driver['expression']
+            new_driver.use_self = driver['use_self']
+            for variable in list(new_driver.variables):
+                new_driver.variables.remove(variable)
+            for variable in driver['variables']:
+                new_variable = new_driver.variables.new()
+                new_variable.name = variable['name']
+                new_variable.type = variable['type']
+                for target, new_target in zip(variable['targets'], new_variable.targets):
+                    if variable['type'] == 'SINGLE_PROP':
+                        new_target.id_type = target['id_type']
+                    new_target.id = ids.id(target['id_type'], target['id'])
+                    for attribute in DRIVER_TARGET_SETTINGS:
+                        setattr(new_target, attribute, target[attribute])
+
+        # Spline constraints and modifiers
+        populate.enter_object_mode()
+        for object_name, items in rig['objects'].items():
+            ob = ids.object(object_name)
+            if ob is None:
+                failed.append(object_name + ": object not found")
+                continue
+            for c in items['constraints']:
+                new_c = ob.constraints.new(c['type'])
+                failed += [ob.name + ": " + identifier for identifier in set_rna_values(new_c, c['settings'], ids)]
+            for m in items['modifiers']:
+                new_m = ob.modifiers.new(m['settings'].get('name', m['type']), m['type'])
+                failed += [ob.name + ": " + identifier for identifier in set_rna_values(new_m, m['settings'], ids)]
+                if m['vertex_indices'] is not None:
+                    new_m.vertex_indices_set(m['vertex_indices'])
+
+        for key, value in rig['properties'].items():
+            armature[key] = value
+    return created, failed
@@ -0,0 +1,109 @@
+import os
+import sys
+import math
+import types
+import importlib.util
+
+# The tests check the logic of the add-on that doesn't need Blender. Outside of Blender, bpy and mathutils are replaced
+# by stand-ins that are enough to import the add-on, and the add-on is imported as the package 'autorig'.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class _Anything:
+    """Stand-in for any part of the bpy API: attributes and calls give other stand-ins, decorators return the function"""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = _Anything()
+        setattr(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs and callable(args[0]):
+            return args[0]
+        return _Anything()
+
+class _Types(types.ModuleType):
+    """bpy.types: every type is an empty class, the same one every time"""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = type(name, (), {})
+        setattr(self, name, value)
+        return value
+
+def _fake_bpy():
+    bpy = types.ModuleType('bpy')
+    bpy.types = _Types('bpy.types')
+    for name in ('ops', 'context', 'data', 'props', 'path', 'utils', 'app'):
+        setattr(bpy, name, _Anything())
+    return bpy
+
+class Vector(tuple):
+    """The part of mathutils.Vector the tests use"""
+
+    def __new__(cls, values=(0.0, 0.0, 0.0)):
+        return tuple.__new__(cls, (float(value) for value in values))
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __mul__(self, factor):
+        return Vector(a * factor for a in self)
+
+    def __truediv__(self, factor):
+        return Vector(a / factor for a in self)
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+    def lerp(self, other, factor):
+        return self + (other - self) * factor
+
+    def copy(self):
+        return Vector(self)
+
+    @property
+    def x(self):
+        return self[0]
+
+    @property
+    def y(self):
+        return self[1]
+
+    @property
+    def z(self):
+        return self[2]
+
+    @property
+    def length(self):
+        return math.sqrt(self.dot(self))
+
+    @property
+    def length_squared(self):
+        return self.dot(self)
+
+def _fake_mathutils():
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Vector = Vector
+    for name in ('Matrix', 'Euler', 'Quaternion'):
+        setattr(mathutils, name, type(name, (), {}))
+    mathutils.geometry = _Anything()
+    return mathutils
+
+for _name, _fake in (('bpy', _fake_bpy), ('mathutils', _fake_mathutils)):
+    try:
+        __import__(_name)
+    except ImportError:
+        sys.modules[_name] = _fake()
+
+if 'autorig' not in sys.modules:
+    _spec = importlib.util.spec_from_file_location('autorig', os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT])
+    _package = importlib.util.module_from_spec(_spec)
+    sys.modules['autorig'] = _package
+    _spec.loader.exec_module(_package)
@@ -0,0 +1,21 @@
+import os
+import pytest
+from autorig import batch
+
+def test_output_names_keep_folders_apart(tmp_path):
+    paths = [str(tmp_path / 'heroes' / 'bob.blend'), str(tmp_path / 'crowd' / 'bob.blend'), str(tmp_path / 'crowd' / 'ann.blend')]
+    assert batch.output_names(paths) == [os.path.join('heroes', 'bob.blend'), os.path.join('crowd', 'bob.blend'), os.path.join('crowd', 'ann.blend')]
+
+def test_output_names_of_one_folder_are_file_names(tmp_path):
+    assert batch.output_names([str(tmp_path / 'bob.blend'), str(tmp_path / 'ann.blend')]) == ['bob.blend', 'ann.blend']
+
+def test_same_input_twice_is_rejected(tmp_path):
+    path = str(tmp_path / 'bob.blend')
+    with pytest.raises(ValueError):
+        batch.output_names([path, path])
+
+def test_manifest_paths_are_relative_to_the_manifest(tmp_path):
+    (tmp_path / 'list.txt').write_text("a/bob.blend # hero\n\nb/bob.blend\n")
+    paths = batch.collect_inputs([str(tmp_path / 'list.txt')])
+    assert paths == [str(tmp_path / 'a' / 'bob.blend'), str(tmp_path / 'b' / 'bob.blend')]
+    assert batch.output_names(paths) == [os.path.join('a', 'bob.blend'), os.path.join('b', 'bob.blend')]
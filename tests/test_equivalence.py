@@ -0,0 +1,30 @@
+import random
+import types
+from autorig import equivalence
+
+class Euler(list):
+    def to_quaternion(self):
+        return ('quaternion', tuple(self))
+
+def pose_bone(rotation_mode):
+    return types.SimpleNamespace(rotation_mode=rotation_mode, location=[0.0] * 3, rotation_euler=Euler([0.0] * 3),
+        rotation_quaternion=None, scale=[1.0] * 3, lock_location=[True, True, True], lock_rotation=[False, True, False],
+        lock_scale=[True, False, True])
+
+def test_random_channels_skip_locked_channels():
+    bone = pose_bone('XYZ')
+    channels = equivalence.random_channels(bone, random.Random(0))
+    assert channels == [('rotation_euler', 0), ('scale', 1), ('rotation_euler', 2)]
+    assert bone.location == [0.0] * 3
+    assert abs(bone.rotation_euler[0]) <= equivalence.ROTATION_RANGE and bone.rotation_euler[1] == 0.0
+
+def test_random_channels_set_the_whole_quaternion():
+    bone = pose_bone('QUATERNION')
+    assert equivalence.random_channels(bone, random.Random(0)) == [('scale', 1), ('rotation_quaternion', -1)]
+    assert bone.rotation_quaternion == ('quaternion', tuple(bone.rotation_euler))
+
+def test_same_seed_gives_the_same_values():
+    bones = [pose_bone('XYZ'), pose_bone('XYZ')]
+    for bone in bones:
+        equivalence.random_channels(bone, random.Random(3))
+    assert bones[0] == bones[1]
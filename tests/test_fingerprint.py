@@ -0,0 +1,57 @@
+import json
+import pytest
+from autorig import fingerprint
+
+def snapshot(bones, constraints=None, drivers=None):
+    """Snapshot of items given by kind, with their fingerprints"""
+    items = {'bones': bones, 'constraints': constraints or {}, 'drivers': drivers or {}}
+    result = {'version': fingerprint.SNAPSHOT_VERSION}
+    result.update(items)
+    result['fingerprints'] = {kind: {key: fingerprint.item_fingerprint(item) for key, item in items[kind].items()} for kind in items}
+    return result
+
+BONES = {
+    'spine': {'head': [0.0, 0.0, 1.0], 'tail': [0.0, 0.0, 1.2], 'parent': None},
+    'neck': {'head': [0.0, 0.0, 1.2], 'tail': [0.0, 0.0, 1.4], 'parent': 'spine'},
+}
+
+def test_same_rig_is_identical():
+    moved = {name: dict(bone) for name, bone in BONES.items()}
+    moved['neck']['tail'] = [0.0, 0.0, 1.40001]
+    assert fingerprint.is_identical(fingerprint.diff_snapshots(snapshot(BONES), snapshot(moved)))
+
+def test_removed_added_and_changed_items():
+    other = {'spine': BONES['spine'], 'head': BONES['neck'], 'neck': dict(BONES['neck'], parent=None, tail=[0.0, 0.1, 1.4])}
+    diff = fingerprint.diff_snapshots(snapshot(BONES, {'neck/IK': {'influence': 1.0}}), snapshot(other))
+    assert diff == {'removed': [['constraints', 'neck/IK']], 'added': [['bones', 'head']], 'changed': [['bones', 'neck', ['parent', 'tail']]]}
+    assert not fingerprint.is_identical(diff)
+
+def test_tolerance_under_the_fingerprint_precision_compares_values():
+    moved = dict(BONES, neck=dict(BONES['neck'], tail=[0.0, 0.0, 1.40001]))
+    diff = fingerprint.diff_snapshots(snapshot(BONES), snapshot(moved), tolerance=1e-6)
+    assert diff['changed'] == [['bones', 'neck', ['tail']]]
+
+def test_close_values():
+    assert fingerprint._close(1, 1.00001, 1e-4)
+    assert not fingerprint._close(1.0, 1.001, 1e-4)
+    assert not fingerprint._close([1.0, 2.0], [1.0], 1e-4)
+    assert not fingerprint._close({'a': 1.0}, {'b': 1.0}, 1e-4)
+    assert fingerprint._close('XYZ', 'XYZ', 1e-4)
+
+def test_armature_names_are_replaced():
+    assert fingerprint._named({'target': 'Armature', 'subtarget': ['spine', 'Armature.data']}, {'Armature', 'Armature.data'}) == {
+        'target': fingerprint.ARMATURE_NAME, 'subtarget': ['spine', fingerprint.ARMATURE_NAME]}
+
+def test_report_limits_lines():
+    diff = {'removed': [['bones', 'b%d' % idx] for idx in range(5)], 'added': [], 'changed': [['bones', 'neck', ['tail']]]}
+    lines = fingerprint.diff_report(diff, limit=2).splitlines()
+    assert lines[0] == "5 removed, 0 added, 1 changed"
+    assert len(lines) == 5 and "3 more" in lines[3] and lines[4].endswith("neck: tail")
+
+def test_snapshots_of_other_versions_are_rejected(tmp_path):
+    path = tmp_path / 'snapshot.json'
+    fingerprint.save_snapshot(snapshot(BONES), str(path))
+    assert fingerprint.load_snapshot(str(path))['bones'] == BONES
+    path.write_text(json.dumps({'version': fingerprint.SNAPSHOT_VERSION + 1}))
+    with pytest.raises(ValueError):
+        fingerprint.load_snapshot(str(path))
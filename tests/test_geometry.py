@@ -0,0 +1,59 @@
+import pytest
+from autorig import geometry
+
+numpy = pytest.importorskip('numpy')
+
+# Template bone A along +Y, B derived from A (head halfway along it, tail 0.2 above), C derived from B (head at its tail)
+DERIVATIONS = {
+    'B': {'head': {'bone': 'A', 'local': [0.0, 0.5, 0.0]}, 'tail': {'offset': [0.0, 0.0, 0.2]}, 'roll': {'bone': 'A', 'z': [0.0, -1.0, 0.0]}},
+    'C': {'head': {'bone': 'B', 'local': [0.0, 1.0, 0.0]}, 'tail': {'offset': [0.0, 0.0, 0.1]}, 'roll': {'z': [0.0, -1.0, 0.0]}},
+}
+
+def frames(length):
+    heads = numpy.zeros((3, 3))
+    tails = numpy.array([[0.0, length, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, 1.0]])
+    rotations = numpy.array([numpy.eye(3)] * 3)
+    return heads, tails, rotations
+
+def test_derived_bones_follow_their_sources_level_by_level():
+    heads, tails, rotations = geometry.solve_derivations(['A', 'B', 'C'], *frames(2.0), DERIVATIONS, {})
+    assert numpy.allclose(heads[1], [0.0, 1.0, 0.0]) and numpy.allclose(tails[1], [0.0, 1.0, 0.2])
+    assert numpy.allclose(heads[2], tails[1]) and numpy.allclose(tails[2], [0.0, 1.0, 0.3])
+    assert numpy.allclose(rotations[1][:, 1], [0.0, 0.0, 1.0]) and numpy.allclose(rotations[1][:, 2], [0.0, -1.0, 0.0])
+    # The template bone does not move
+    assert numpy.allclose(tails[0], [0.0, 2.0, 0.0])
+
+def test_derivation_levels_ignore_cycles():
+    assert geometry._derivation_levels(DERIVATIONS) == [['B'], ['C']]
+    cycle = {'B': {'head': {'bone': 'C'}}, 'C': {'head': {'bone': 'B'}}}
+    assert sorted(sum(geometry._derivation_levels(cycle), [])) == ['B', 'C']
+
+def test_spline_anchors():
+    derivations = {'B': {'head': {'spline': 'tail', 'point': 1}, 'tail': {'spline': 'tail', 'length': 0.5}, 'roll': {'z': [1.0, 0.0, 0.0]}}}
+    control_points = numpy.array([[0.0, 0.0, 0.0], [0.0, 0.0, 4.0]])
+    splines = {'tail': (control_points, numpy.array([[0.0, 0.0, 0.0], [0.0, 0.0, 2.0], [0.0, 2.0, 2.0]]))}
+    heads, tails, _ = geometry.solve_derivations(['A', 'B'], *(array[:2] for array in frames(1.0)), derivations, splines)
+    assert numpy.allclose(heads[1], [0.0, 0.0, 4.0]) and numpy.allclose(tails[1], [0.0, 0.0, 2.0])
+
+def test_closest_bone_anchors():
+    heads = numpy.array([[0.0, 0.0, 0.0], [5.0, 0.0, 0.0]])
+    tails = numpy.array([[0.0, 2.0, 0.0], [5.0, 1.0, 0.0]])
+    rotations = numpy.array([numpy.eye(3)] * 2)
+    closest, locals_, distances = geometry.closest_bone_anchors(numpy.array([[0.0, 1.0, 0.5], [5.0, 2.0, 0.0]]), heads, tails, rotations)
+    assert list(closest) == [0, 1]
+    assert numpy.allclose(locals_, [[0.0, 0.5, 0.25], [0.0, 2.0, 0.0]])
+    assert numpy.allclose(distances, [0.5, 1.0])
+
+def test_bone_rolls_match_the_roll_0_frame():
+    heads = numpy.zeros((4, 3))
+    tails = numpy.array([[0.0, 0.0, 1.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0], [0.0, -1.0, 0.0]])
+    # Roll 0 gives a +Z bone the Z axis -Y, a +X bone the Z axis +Z and a -Y bone the Z axis +Z
+    z_axes = numpy.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+    assert numpy.allclose(geometry.bone_rolls(heads, tails, z_axes), [0.0, numpy.pi / 2, 0.0, -numpy.pi / 2])
+
+def test_transported_axes_follow_the_chain_without_twist():
+    directions = numpy.array([[0.0, 0.0, 1.0], [0.0, 1.0, 1.0], [0.0, 1.0, 0.0], [1.0, 0.0, 0.0]])
+    axes = geometry.transported_axes(directions, (0.0, -1.0, 0.0), (0.0, 0.0, 1.0))
+    assert numpy.allclose(axes[0], [0.0, -1.0, 0.0]) and numpy.allclose(axes[2], [0.0, 0.0, 1.0])
+    assert numpy.allclose(numpy.einsum('ni,ni->n', axes, geometry.normalized(directions)), 0.0)
+    assert numpy.allclose(axes[3], [0.0, 0.0, 1.0])
@@ -0,0 +1,83 @@
+import types
+import pytest
+from autorig import planner
+from autorig import manifest
+
+def operation(module, tokens=(), id=None):
+    result = planner.Operation(module, 0, 'create_heel_foot_control', [], id)
+    result.tokens = set(tokens)
+    return result
+
+@pytest.fixture
+def recorder(monkeypatch):
+    """BuildRecorder of a fake armature whose state is the sets of the dictionary world"""
+    world = {'bones': {'spine', 'thigh.L'}, 'constraints': set(), 'drivers': set(), 'objects': set(), 'switches': set()}
+    calls = {'states': 0, 'derivations': []}
+
+    def armature_state(armature, objects):
+        calls['states'] += 1
+        return {key: set(value) for key, value in world.items()}
+
+    def bone_derivations(armature, bone_names, source_names, splines):
+        calls['derivations'].append((set(bone_names), set(source_names)))
+        return {name: {} for name in bone_names}
+
+    monkeypatch.setattr(manifest, 'armature_state', armature_state)
+    monkeypatch.setattr(manifest, 'bone_settings', lambda armature, names: {})
+    monkeypatch.setattr(manifest, 'bone_derivations', bone_derivations)
+    armature = types.SimpleNamespace(mode='OBJECT', users_collection=[], data=types.SimpleNamespace(bones=[]))
+    plan = types.SimpleNamespace(spec={'modules': []}, operations=[])
+    return manifest.BuildRecorder(armature, plan, {}), world, calls
+
+def create(world, *names):
+    def function(armature):
+        world['bones'].update(names)
+        return list(names)
+    return function
+
+def test_state_is_compared_once_per_module(recorder):
+    recorder, world, calls = recorder
+    for name in ('a', 'b', 'c'):
+        recorder.record(operation('leg', ['thigh.L']), create(world, name), [])
+    recorder.record(operation('torso', ['spine']), create(world, 'd'), [])
+    recorder.flush()
+    assert calls['states'] == 4
+    assert recorder.manifest['modules']['leg']['bones'] == ['a', 'b', 'c']
+    assert recorder.manifest['modules']['torso']['bones'] == ['d']
+
+def test_bones_other_operations_use_are_derived_first(recorder):
+    recorder, world, calls = recorder
+    recorder.record(operation('leg', ['thigh.L'], id='chain'), create(world, 'a', 'b'), [])
+    recorder.record(operation('leg', ['@chain']), create(world, 'c'), [])
+    recorder.flush()
+    assert calls['derivations'] == [({'a', 'b'}, {'thigh.L'}), ({'c'}, {'thigh.L', 'a', 'b'})]
+    assert set(recorder.manifest['modules']['leg']['derivations']) == {'a', 'b', 'c'}
+
+def test_failed_operation_records_what_it_created(recorder):
+    recorder, world, calls = recorder
+
+    def fail(armature):
+        world['bones'].add('partial')
+        raise ValueError("failed")
+
+    recorder.record(operation('leg', ['thigh.L']), create(world, 'a'), [])
+    with pytest.raises(ValueError):
+        recorder.record(operation('leg', ['thigh.L']), fail, [])
+    assert recorder.manifest['modules']['leg']['bones'] == ['a', 'partial']
+
+def test_changed_modules_follow_what_they_use(monkeypatch):
+    monkeypatch.setattr(manifest, 'module_signature', lambda armature, bone_names, spline_names: sorted(bone_names))
+    plan = types.SimpleNamespace(spec={'modules': []}, operations=[
+        operation('leg', ['thigh.L']), operation('foot', ['@leg_chain']), operation('torso', ['spine'])])
+    plan.operations[0].id = 'leg_chain'
+    build_manifest = {
+        'spec': manifest.spec_hash(plan.spec, {}),
+        'template': {'thigh.L': {}, 'spine': {}},
+        'modules': {
+            'leg': {'signature': ['old'], 'bones': ['leg_fk']},
+            'foot': {'signature': []},
+            'torso': {'signature': ['spine']},
+        },
+    }
+    assert manifest.changed_modules(None, plan, {}, build_manifest) == {'leg', 'foot'}
+    assert manifest.changed_modules(None, plan, {'lod': 'PROXY'}, build_manifest) is None
@@ -0,0 +1,61 @@
+import math
+import types
+import pytest
+import mathutils
+from autorig import planner
+from autorig import populate
+from autorig import mirror
+
+def test_mirror_names_swap_side_tokens_only():
+    assert mirror.mirror_name('arm_left_ik_HDL') == 'arm_right_ik_HDL'
+    assert mirror.mirror_name('arm_right_RST') == 'arm_left_RST'
+    assert mirror.mirror_name('spine01_HDL') == 'spine01_HDL'
+    assert mirror.mirror_name('leftover_RST') == 'leftover_RST'
+
+def test_mirror_paths_and_values():
+    assert mirror.mirror_path('pose.bones["forearm_left_RST"].constraints["IK"].influence') == 'pose.bones["forearm_right_RST"].constraints["IK"].influence'
+    assert mirror.mirror_path('fk_ik_left_arm') == 'fk_ik_right_arm'
+    assert mirror.mirror_value(['hand_left_RST', 'neck_RST']) == ['hand_right_RST', 'neck_RST']
+    assert mirror.mirror_value(None) is None
+
+def test_can_mirror_needs_free_mirror_names():
+    bones = {'hand_right_RST': object()}
+    armature = types.SimpleNamespace(mode='OBJECT', data=types.SimpleNamespace(bones=bones))
+    build_manifest = {'modules': {'arm_left': {'bones': ['arm_left_ik_HDL']}, 'hand_left': {'bones': ['hand_left_RST']},
+        'spine': {'bones': ['spine01_HDL']}}}
+    assert mirror.can_mirror(armature, build_manifest, 'arm_left')
+    assert not mirror.can_mirror(armature, build_manifest, 'hand_left')
+    assert not mirror.can_mirror(armature, build_manifest, 'spine')
+    assert not mirror.can_mirror(armature, build_manifest, 'leg_left')
+
+def test_mirror_steps_run_after_their_source_module():
+    plan = planner.compile_plan(planner.select_lod(planner.load_spec(planner.DEFAULT_SPEC_PATH), 'FULL'))
+    mirrors = planner.mirrored_modules(plan, {'use_symmetry': True})
+    assert mirrors['arm_right'] == 'arm_left'
+    assert planner.mirrored_modules(plan, {'use_symmetry': False}) == {}
+    steps = planner.execution_order(plan, mirrors)
+    positions = {}
+    for idx, step in enumerate(steps):
+        positions.setdefault(step.module, []).append(idx)
+    for module, source in mirrors.items():
+        mirror_steps = [step for step in steps if step.module == module]
+        assert len(mirror_steps) == 1 and isinstance(mirror_steps[0], planner.MirrorStep)
+        assert positions[module][0] > max(positions[source])
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_mirrored_bones_are_flipped_in_x(monkeypatch, use_numpy):
+    if use_numpy and mirror.numpy is None:
+        pytest.skip("NumPy is not installed")
+    if not use_numpy:
+        monkeypatch.setattr(mirror, 'numpy', None)
+        monkeypatch.setattr(populate, 'numpy', None)
+    edit_bones = {
+        'hand_left_RST': types.SimpleNamespace(head=mathutils.Vector((0.5, 0.1, 1.0)), tail=mathutils.Vector((0.7, 0.1, 1.0)), roll=0.3),
+        'hand_right_RST': types.SimpleNamespace(head=None, tail=None, roll=None),
+    }
+    armature = types.SimpleNamespace(data=types.SimpleNamespace(edit_bones=edit_bones))
+    mirror.place_mirrored_bones(armature, {'hand_left_RST': 'hand_right_RST'})
+    bone = edit_bones['hand_right_RST']
+    assert all(math.isclose(a, b) for a, b in zip(bone.head, (-0.5, 0.1, 1.0)))
+    assert all(math.isclose(a, b) for a, b in zip(bone.tail, (-0.7, 0.1, 1.0)))
+    assert math.isclose(bone.roll, -0.3)
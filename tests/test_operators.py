@@ -0,0 +1,54 @@
+import types
+from autorig import operators
+
+PREFIX = operators.TEMPLATE_CACHE_PREFIX
+
+class FakeID:
+    """Object or object data of the cached template. copy() builds it again, with the references to the same IDs"""
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.__dict__.update(build())
+
+    def copy(self):
+        return FakeID(self.name, self.build)
+
+def drivers(*ids):
+    """Animation data with one driver per id, whose variable targets it"""
+    return types.SimpleNamespace(drivers=[types.SimpleNamespace(driver=types.SimpleNamespace(variables=[
+        types.SimpleNamespace(targets=[types.SimpleNamespace(id=id_data)])])) for id_data in ids])
+
+def fake_object(data=None, **attributes):
+    values = {'data': data, 'parent': None, 'constraints': [], 'modifiers': [], 'pose': None, 'animation_data': None,
+        'production_state': 'BASIC_EDITION'}
+    values.update(attributes)
+    return values
+
+def test_copied_template_references_the_copies(monkeypatch):
+    shape = FakeID(PREFIX + 'shape_WGT', lambda: fake_object())
+    curve = FakeID('spine_SPL', lambda: {'animation_data': None})
+    spline = FakeID(PREFIX + 'spine_SPL', lambda: fake_object(curve, parent=shape,
+        modifiers=[types.SimpleNamespace(object=shape)]))
+    armature_data = FakeID('Armature', lambda: {'animation_data': drivers(spline)})
+    armature = FakeID(PREFIX + 'Armature', lambda: fake_object(armature_data, production_state='TEMPLATE',
+        constraints=[types.SimpleNamespace(target=spline)],
+        pose=types.SimpleNamespace(bones=[types.SimpleNamespace(custom_shape=shape,
+            constraints=[types.SimpleNamespace(target=spline, pole_target=shape)])]),
+        animation_data=drivers(spline, curve)))
+    cached = {shape, curve, spline, armature_data, armature}
+    source = types.SimpleNamespace(name=PREFIX + 'Armature Collection', objects=[armature, spline, shape], children=[])
+    monkeypatch.setattr(operators, 'template_cache', lambda: source)
+    scene = types.SimpleNamespace(collection=types.SimpleNamespace(children=types.SimpleNamespace(link=lambda collection: None)))
+
+    copy = operators.append_source_armature(scene)
+    assert copy is scene.armature_ob and copy.name == 'Armature' and copy.production_state == 'BASIC_EDITION'
+    pose_bone = copy.pose.bones[0]
+    references = [copy.data, copy.constraints[0].target, pose_bone.custom_shape, pose_bone.constraints[0].target,
+        pose_bone.constraints[0].pole_target]
+    references += [target.id for data in (copy, copy.data) for fcurve in data.animation_data.drivers
+        for variable in fcurve.driver.variables for target in variable.targets]
+    spline_copy = copy.constraints[0].target
+    references += [spline_copy.data, spline_copy.parent, spline_copy.modifiers[0].object]
+    assert len(references) == 11 and not any(reference in cached for reference in references)
+    assert [target.id.name for fcurve in copy.animation_data.drivers for target in fcurve.driver.variables[0].targets] == ['spine_SPL', 'spine_SPL']
@@ -0,0 +1,167 @@
+import types
+import pytest
+from autorig import planner
+from autorig import populate
+from autorig import manifest
+
+class FakeArmature:
+    mode = 'OBJECT'
+
+class FakeRecorder:
+    def __init__(self, armature, plan, options, previous=None):
+        self.manifest = {'results': {}, 'modules': {}}
+        self.finished = False
+
+    def flush(self):
+        pass
+
+    def finish(self, modules):
+        self.finished = True
+
+@pytest.fixture
+def build(monkeypatch):
+    """Plan of the default specification whose steps only record the build session they run in"""
+    calls = []
+    monkeypatch.setattr(manifest, 'BuildRecorder', FakeRecorder)
+    monkeypatch.setattr(manifest, 'remove_modules', lambda armature, build_manifest, modules: calls.append('remove'))
+    monkeypatch.setattr(manifest, 'clear_manifest', lambda armature: calls.append('clear'))
+    monkeypatch.setattr(planner, '_run_operation', lambda recorder, operation, results, options: calls.append(populate._session))
+    monkeypatch.setattr(planner, '_run_mirror_step', lambda *args: calls.append(populate._session))
+    return planner.compile_plan(planner.select_lod(planner.load_spec(planner.DEFAULT_SPEC_PATH), 'FULL')), calls
+
+def test_execute_plan_runs_every_step_in_one_session(build):
+    plan, calls = build
+    planner.execute_plan(FakeArmature(), plan)
+    assert len(calls) == len(plan.operations)
+    assert len(set(map(id, calls))) == 1 and calls[0] is not None
+    assert populate._session is None
+
+def test_stepped_build_keeps_one_session_until_it_is_cancelled(build):
+    plan, calls = build
+    armature = FakeArmature()
+    steps = planner.iterate_plan(armature, plan)
+    session = populate.BuildSession(armature)
+    session.__enter__()
+    for _ in range(3):
+        next(steps)
+    steps.close()
+    session.close(flush=False)
+    assert calls[:2] == [session, session] and calls[-2:] == ['remove', 'clear']
+    assert populate._session is None
+
+def test_failed_step_rolls_back(build, monkeypatch):
+    plan, calls = build
+    def fail(*args):
+        raise RuntimeError("failed step")
+    monkeypatch.setattr(planner, '_run_operation', fail)
+    with pytest.raises(RuntimeError):
+        planner.execute_plan(FakeArmature(), plan)
+    assert calls == ['remove', 'clear']
+    assert populate._session is None
+
+class FakeCurve(dict):
+    """Template curve object with custom properties"""
+
+    def __init__(self, name, **properties):
+        super().__init__(properties)
+        self.name = name
+        self.type = 'CURVE'
+
+def curve_armature(*curves):
+    collection = types.SimpleNamespace(objects=list(curves) + [types.SimpleNamespace(name='body', type='MESH')])
+    return types.SimpleNamespace(users_collection=[collection])
+
+def chain_cuts(spec, module):
+    operations = [entry for entry in spec['modules'] if entry['name'] == module][0]['operations']
+    return [entry['args'][1] for entry in operations if entry['function'] == 'create_spline_chain'][0]
+
+def test_unused_curves_become_spline_chain_modules():
+    spec = {'spline_chains': {'bones': 4}, 'modules': [
+        {'name': 'hair', 'operations': [{'function': 'create_spline_hooks', 'args': [{'spline': 'hair_SPL'}, 'hair']}]}]}
+    armature = curve_armature(FakeCurve('tail_SPL', rig_chain_bones=12, rig_chain_parent='hips'), FakeCurve('tentacle_SPL'),
+        FakeCurve('hair_SPL'), FakeCurve('guide'))
+    expanded = planner.expand_spline_chains(spec, armature)
+    assert [module['name'] for module in expanded['modules']] == ['hair', 'tail', 'tentacle']
+    assert chain_cuts(planner.select_lod(expanded, 'FULL'), 'tail') == 11
+    assert chain_cuts(planner.select_lod(expanded, 'PROXY'), 'tail') == 2
+    assert chain_cuts(planner.select_lod(expanded, 'FULL'), 'tentacle') == 3
+    proxy = planner.select_lod(expanded, 'PROXY')
+    assert 'chain_torsion' not in [entry['function'] for entry in proxy['modules'][1]['operations']]
+    for lod in planner.LODS:
+        planner.compile_plan(planner.select_lod(expanded, lod))
+
+def test_specifications_without_spline_chains_are_kept():
+    spec = {'modules': []}
+    assert planner.expand_spline_chains(spec, curve_armature(FakeCurve('tail_SPL'))) is spec
+
+@pytest.mark.parametrize('spline_chains, curve', [
+    ({}, FakeCurve('tail_SPL', rig_chain_bones=0)),
+    ({}, FakeCurve('tail_SPL', rig_chain_bones=populate.SPLINE_IK_MAX_BONES + 1)),
+    ({'bones': 2.5}, FakeCurve('tail_SPL')),
+    ({'length': 3}, FakeCurve('tail_SPL')),
+])
+def test_invalid_spline_chains_are_rejected(spline_chains, curve):
+    with pytest.raises(ValueError):
+        planner.expand_spline_chains({'spline_chains': spline_chains, 'modules': []}, curve_armature(curve))
+
+LOCKS = [False, False, False, False, True, False, True, True, True]
+
+def test_select_lod_drops_operations_and_resolves_values():
+    spec = {'modules': [
+        {'name': 'arm', 'operations': [
+            {'function': 'duplicate_bones', 'args': [['arm_RST'], ['arm_fk_HDL'], {'lod': {'FULL': 1, 'MEDIUM': 2, 'PROXY': 3}}, True]},
+            {'function': 'lock_bone_transforms', 'args': [['arm_fk_HDL'], LOCKS], 'lods': ['FULL']},
+        ]},
+        {'name': 'fingers', 'operations': [{'function': 'assign_rotation_mode', 'args': [['finger_RST']], 'lods': ['FULL', 'MEDIUM']}]},
+    ]}
+    proxy = planner.select_lod(spec, 'PROXY')
+    assert [module['name'] for module in proxy['modules']] == ['arm']
+    assert proxy['modules'][0]['operations'] == [{'function': 'duplicate_bones', 'args': [['arm_RST'], ['arm_fk_HDL'], 3, True]}]
+    assert len(planner.select_lod(spec, 'FULL')['modules'][0]['operations']) == 2
+    assert spec['modules'][0]['operations'][0]['args'][2] == {'lod': {'FULL': 1, 'MEDIUM': 2, 'PROXY': 3}}
+
+@pytest.mark.parametrize('lod, operation', [
+    ('LOW', {'function': 'assign_rotation_mode', 'args': [['arm_RST']]}),
+    ('FULL', {'function': 'assign_rotation_mode', 'args': [['arm_RST']], 'lods': ['LOW']}),
+    ('PROXY', {'function': 'duplicate_bones', 'args': [['arm_RST'], ['arm_fk_HDL'], {'lod': {'FULL': 1}}, True]}),
+])
+def test_invalid_levels_of_detail_are_rejected(lod, operation):
+    with pytest.raises(ValueError):
+        planner.select_lod({'modules': [{'name': 'arm', 'operations': [operation]}]}, lod)
+
+def test_default_specification_compiles_at_every_level():
+    spec = planner.load_spec(planner.DEFAULT_SPEC_PATH)
+    counts = [len(planner.compile_plan(planner.select_lod(spec, lod)).operations) for lod in planner.LODS]
+    assert counts[0] >= counts[1] >= counts[2] > 0
+
+@pytest.mark.parametrize('modules', [
+    [{'name': 'arm', 'operations': [{'function': 'delete_everything', 'args': []}]}],
+    [{'name': 'arm', 'operations': [{'function': 'assign_rotation_mode', 'args': [['arm_RST'], True]}]}],
+    [{'name': 'arm', 'operations': [{'function': 'assign_rotation_mode', 'args': [{'ref': 'later'}]},
+        {'id': 'later', 'function': 'assign_rotation_mode', 'args': [['arm_RST']]}]}],
+    [{'name': 'arm', 'operations': [{'id': 'same', 'function': 'assign_rotation_mode', 'args': [['arm_RST']]},
+        {'id': 'same', 'function': 'assign_rotation_mode', 'args': [['leg_RST']]}]}],
+    [{'name': 'arm', 'operations': []}, {'name': 'arm', 'operations': []}],
+    [{'name': 'arm', 'operations': [{'function': 'assign_rotation_mode', 'args': [{'option': 'use_magic'}]}]}],
+    [{'name': 'arm_left', 'operations': [{'function': 'assign_rotation_mode', 'args': [['arm_left_RST']]}]},
+        {'name': 'arm_right', 'mirror_of': 'arm_left', 'operations': []}],
+    [{'name': 'arm_right', 'mirror_of': 'arm_left', 'operations': []}, {'name': 'arm_left', 'operations': []}],
+])
+def test_invalid_specifications_are_rejected(modules):
+    with pytest.raises(ValueError):
+        planner.compile_plan({'modules': modules})
+
+def test_plan_order_keeps_dependencies_and_saves_mode_switches():
+    spec = planner.select_lod(planner.load_spec(planner.DEFAULT_SPEC_PATH), 'FULL')
+    plan = planner.compile_plan(spec)
+    positions = {operation: idx for idx, operation in enumerate(plan.operations)}
+    for operation in plan.operations:
+        assert all(positions[dependency] < positions[operation] for dependency in operation.dependencies)
+    assert planner.count_passes(plan.operations) <= planner.count_passes(sorted(plan.operations, key=lambda o: o.index))
+
+def test_circular_dependencies_are_rejected():
+    first = planner.Operation('arm', 0, 'assign_rotation_mode', [], None)
+    second = planner.Operation('arm', 1, 'assign_rotation_mode', [], None)
+    first.dependencies, second.dependencies = {second}, {first}
+    with pytest.raises(ValueError):
+        planner.order_operations([first, second])
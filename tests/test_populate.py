@@ -0,0 +1,187 @@
+import math
+import types
+import mathutils
+from autorig import populate
+
+class FakeBone:
+    """Edit bone and pose bone of a fake armature (they share the name, as in Blender)"""
+
+    def __init__(self, name, head=(0.0, 0.0, 0.0), tail=(0.0, 0.0, 0.0)):
+        self.name = name
+        self.head = mathutils.Vector(head)
+        self.tail = mathutils.Vector(tail)
+        self.roll = 0.0
+        self.parent = None
+        self.use_connect = False
+        self.rotation_mode = 'QUATERNION'
+        self.lock_location = [False] * 3
+        self.lock_rotation = [False] * 3
+        self.lock_scale = [False] * 3
+
+class FakeBones:
+    """Bone collection with name lookup, new() and foreach_get/foreach_set of the lock arrays and of the bone vectors"""
+
+    def __init__(self, bones):
+        self.bones = bones
+        self.foreach_sets = 0
+
+    def __getitem__(self, name):
+        for bone in self.bones:
+            if bone.name == name:
+                return bone
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.bones)
+
+    def __len__(self):
+        return len(self.bones)
+
+    def new(self, name):
+        self.bones.append(FakeBone(name))
+        return self.bones[-1]
+
+    def foreach_get(self, attribute, values):
+        size = len(values) // len(self.bones)
+        for idx, bone in enumerate(self.bones):
+            value = getattr(bone, attribute)
+            values[size*idx:size*idx+size] = list(value) if size > 1 else [value]
+
+    def foreach_set(self, attribute, values):
+        self.foreach_sets += 1
+        size = len(values) // len(self.bones)
+        for idx, bone in enumerate(self.bones):
+            value = values[size*idx:size*idx+size]
+            if attribute.startswith('lock'):
+                setattr(bone, attribute, [bool(item) for item in value])
+            else:
+                setattr(bone, attribute, mathutils.Vector(value) if size > 1 else float(value[0]))
+
+class FakeArmature:
+    def __init__(self, names, mode='POSE'):
+        bones = FakeBones([FakeBone(name) for name in names])
+        self.mode = mode
+        self.data = type('Data', (), {'edit_bones': bones})()
+        self.pose = type('Pose', (), {'bones': bones})()
+
+    def select_set(self, state):
+        pass
+
+def test_renamed_bone_keeps_queued_pose_settings():
+    armature = FakeArmature(['forearm_part_left_RST', 'hand_left_RST'])
+    with populate.BuildSession(armature):
+        populate.assign_rotation_mode(armature, ['forearm_part_left_RST'])
+        populate.lock_bone_transforms(armature, ['forearm_part_left_RST'], [True, True, True, False, True, False, True, True, True])
+        assert populate.rename_bone(armature, 'forearm_part_left_RST', 'forearm_part1_left_RST') == 'forearm_part1_left_RST'
+        assert populate.pose_bone_setting(armature, 'forearm_part1_left_RST', 'rotation_mode') == 'XYZ'
+    pose_bone = armature.pose.bones['forearm_part1_left_RST']
+    assert pose_bone.rotation_mode == 'XYZ'
+    assert pose_bone.lock_location == [True, True, True]
+    assert pose_bone.lock_rotation == [False, True, False]
+    assert armature.pose.bones['hand_left_RST'].rotation_mode == 'QUATERNION'
+
+def test_pose_settings_of_removed_bones_are_skipped():
+    armature = FakeArmature(['hand_left_RST'])
+    populate.write_pose_settings(armature, {'hand_left_RST': {'rotation_mode': 'XYZ'}, 'removed_RST': {'lock_scale': [True] * 3}})
+    assert armature.pose.bones['hand_left_RST'].rotation_mode == 'XYZ'
+
+def test_chain_bone_names_are_zero_padded_to_the_chain_length():
+    assert populate.chain_bone_name('spine', 0, 7, 'RST') == 'spine01_RST'
+    assert populate.chain_bone_name('tail', 9, 120, 'HDL') == 'tail010_HDL'
+
+def close(vector, values):
+    return all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(vector, values))
+
+def test_derived_bones_are_placed_in_one_pass():
+    armature = FakeArmature(['foot_left_RST', 'toe_left_RST'], mode='EDIT')
+    edit_bones = armature.data.edit_bones
+    edit_bones['foot_left_RST'].tail = edit_bones['toe_left_RST'].head = mathutils.Vector((0.0, -0.1, 0.0))
+    edit_bones['toe_left_RST'].tail = mathutils.Vector((0.0, -0.2, 0.0))
+    with populate.BuildSession(armature) as session:
+        populate.add_bone_axis(armature, 'foot_left_HDL', 'foot_left_RST', 'foot_left_RST', 'HEAD', '+Z', 0.5, False, 16, True)
+        populate.add_bone_axis(armature, 'toe_left_HDL', 'toe_left_RST', 'toe_left_RST', 'TAIL', '-Y', 0.5, False, 16, True)
+        heads, tails, _ = populate.bone_placements(armature, ['toe_left_HDL'])
+        assert close(heads[0], [0.0, -0.2, 0.0]) and close(tails[0], [0.0, -0.7, 0.0])
+        if populate.numpy is not None:
+            assert set(session.placements) == {'foot_left_HDL', 'toe_left_HDL'} and edit_bones.foreach_sets == 0
+    if populate.numpy is not None:
+        # One foreach_set per attribute (head, tail and roll)
+        assert edit_bones.foreach_sets == 3
+    assert close(edit_bones['foot_left_HDL'].tail, [0.0, 0.0, 0.5])
+    assert close(edit_bones['toe_left_HDL'].head, [0.0, -0.2, 0.0])
+    assert edit_bones['toe_left_HDL'].parent is edit_bones['toe_left_RST']
+    assert edit_bones['toe_left_HDL'].rotation_mode == 'XYZ'
+
+def test_bones_are_placed_before_they_are_connected():
+    armature = FakeArmature(['spine_RST', 'neck_RST'], mode='EDIT')
+    edit_bones = armature.data.edit_bones
+    edit_bones['spine_RST'].tail = mathutils.Vector((0.0, 0.0, 1.0))
+    edit_bones['neck_RST'].head = mathutils.Vector((0.0, 0.0, 1.2))
+    edit_bones['neck_RST'].tail = mathutils.Vector((0.0, 0.0, 1.4))
+    with populate.BuildSession(armature) as session:
+        populate.connect_tail_head(armature, 'spine_RST', 'neck_RST', 'neck_con_AUX', 7, True)
+        assert not session.placements
+        assert close(edit_bones['neck_con_AUX'].head, [0.0, 0.0, 1.0]) and close(edit_bones['neck_con_AUX'].tail, [0.0, 0.0, 1.2])
+        assert edit_bones['neck_RST'].parent is edit_bones['neck_con_AUX'] and edit_bones['neck_RST'].use_connect
+
+class Variables(list):
+    def new(self):
+        self.append(types.SimpleNamespace(targets=[types.SimpleNamespace(id=None, data_path="")]))
+        return self[-1]
+
+class DriverOwner:
+    """ID with driver_add: its drivers are kept in order"""
+
+    def __init__(self):
+        self.drivers = []
+
+    def driver_add(self, data_path, index=-1):
+        fcurve = types.SimpleNamespace(data_path=data_path, driver=types.SimpleNamespace(expression="", variables=Variables()))
+        self.drivers.append(fcurve)
+        return fcurve
+
+class SwitchArmature(dict, DriverOwner):
+    """Armature object with custom properties, pose bone constraint stacks and bones that can be hidden"""
+
+    def __init__(self, names):
+        dict.__init__(self)
+        DriverOwner.__init__(self)
+        self.mode = 'POSE'
+        self.id_data = self
+        self.pose = types.SimpleNamespace(bones={name: types.SimpleNamespace(name=name, constraints=types.SimpleNamespace(
+            new=lambda kind: types.SimpleNamespace(type=kind))) for name in names})
+        self.data = DriverOwner()
+        self.data.bones = {name: types.SimpleNamespace(name=name, hide=False) for name in names}
+
+    def select_set(self, state):
+        pass
+
+LIMB = [('upperarm_left_RST', 'upperarm_left_fk_HDL', 'upperarm_left_ik_AUX'), ('forearm_left_RST', 'forearm_left_fk_HDL', 'forearm_left_ik_AUX')]
+
+def test_consolidated_switch_drives_one_influence_per_result_bone():
+    armature = SwitchArmature([name for names in LIMB for name in names])
+    armature.fk_ik_left_arm = 0.0
+    for result_bone, fk_bone, ik_bone in LIMB:
+        populate.bone_create_fk_ik_switch(armature, result_bone, fk_bone, ik_bone, 'fk_ik_left_arm', consolidated=True)
+    assert [fcurve.data_path for fcurve in armature.drivers] == [
+        'pose.bones["' + result_bone + '"].constraints["Copy Transforms.001"].influence' for result_bone, _, _ in LIMB]
+    assert all(fcurve.driver.expression == "var" and fcurve.driver.variables[0].targets[0].data_path == 'fk_ik_left_arm'
+        for fcurve in armature.drivers)
+    # No hide drivers, the bones are listed for the switch property instead
+    assert armature.data.drivers == []
+    expected = {}
+    for _, fk_bone, ik_bone in LIMB:
+        expected.update({fk_bone: "var", ik_bone: "1-var"})
+    assert populate.switch_visibility(armature) == {'fk_ik_left_arm': expected}
+
+def test_consolidated_switch_property_update_shows_and_hides_bones():
+    armature = SwitchArmature([name for names in LIMB for name in names])
+    armature.fk_ik_left_arm = 0.0
+    for result_bone, fk_bone, ik_bone in LIMB:
+        populate.bone_create_fk_ik_switch(armature, result_bone, fk_bone, ik_bone, 'fk_ik_left_arm', consolidated=True)
+    bones = armature.data.bones
+    assert not any(bones[fk_bone].hide for _, fk_bone, _ in LIMB) and all(bones[ik_bone].hide for _, _, ik_bone in LIMB)
+    armature.fk_ik_left_arm = 1.0
+    populate.update_switch_visibility(armature, 'fk_ik_left_arm')
+    assert all(bones[fk_bone].hide for _, fk_bone, _ in LIMB) and not any(bones[ik_bone].hide for _, _, ik_bone in LIMB)
+    assert not any(bones[result_bone].hide for result_bone, _, _ in LIMB)
@@ -0,0 +1,44 @@
+import types
+from autorig import populate
+from autorig import profiler
+
+class PoseBones(list):
+    """Pose bones that count how many times they are iterated"""
+    iterations = 0
+
+    def __iter__(self):
+        PoseBones.iterations += 1
+        return super().__iter__()
+
+def fake_armature():
+    pose_bones = PoseBones([types.SimpleNamespace(constraints=[]) for _ in range(3)])
+    return types.SimpleNamespace(mode='POSE', data=types.SimpleNamespace(bones=pose_bones, animation_data=None),
+        pose=types.SimpleNamespace(bones=pose_bones), animation_data=None)
+
+def test_unprofiled_functions_are_not_wrapped():
+    functions = profiler.profiled_functions()
+    assert 'new_edit_bone' in functions and 'rename_bone' in functions
+    for name in ('parse_bone_name', 'pose_bone_setting', 'build_session', 'register', 'unprofiled'):
+        assert name not in functions
+
+def test_constraints_are_counted_when_a_function_returns():
+    armature = fake_armature()
+    with profiler.Profiler(armature) as profile:
+        add_constraint = profile._wrap(lambda armature: armature.pose.bones[0].constraints.append('Copy Rotation'))
+        PoseBones.iterations = 0
+        with profiler.section('arm'):
+            add_constraint(armature)
+            add_constraint(armature)
+        assert PoseBones.iterations == 3
+    spans = {span.name: span for span in profile.spans}
+    assert spans['arm'].counts['constraints'] == 2
+    assert spans['<lambda>'].counts['constraints'] == 1
+
+def test_hide_drivers_of_the_armature_data_are_counted():
+    armature = fake_armature()
+    armature.animation_data = types.SimpleNamespace(drivers=['influence'])
+    with profiler.Profiler(armature) as profile:
+        add_hide_driver = profile._wrap(lambda armature: setattr(armature.data, 'animation_data', types.SimpleNamespace(drivers=['hide'] * 2)))
+        add_hide_driver(armature)
+    assert profile.spans[-1].counts['drivers'] == 2
+    assert populate.driver_count(armature) == 3
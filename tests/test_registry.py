@@ -0,0 +1,59 @@
+import json
+import types
+from autorig import populate
+from autorig import manifest
+from autorig import registry
+
+class FakeArmature(dict):
+    """Armature with bones of the given names, a name and custom properties"""
+
+    def __init__(self, names, build_manifest=None):
+        super().__init__()
+        bones = {name: types.SimpleNamespace(name=name) for name in names}
+        self.name_full = 'rig'
+        self.mode = 'POSE'
+        self.data = types.SimpleNamespace(bones=list(bones.values()), edit_bones=bones)
+        if build_manifest is not None:
+            self[manifest.MANIFEST_PROPERTY] = json.dumps(build_manifest)
+
+BUILD_MANIFEST = {
+    'version': manifest.MANIFEST_VERSION,
+    'modules': {
+        'arm_left': {
+            'bones': ['arm_left_ik_HDL', 'arm_left_fk_HDL'],
+            'template': ['arm_left_RST'],
+            'modified': [],
+            'derivations': {'arm_left_ik_HDL': {'head': {'bone': 'arm_left_RST'}, 'tail': {'offset': [0, 1, 0]}}},
+        },
+    },
+}
+
+def test_query_by_role_side_tag_and_module():
+    armature = FakeArmature(['arm_left_RST', 'arm_left_ik_HDL', 'arm_left_fk_HDL', 'arm_right_ik_HDL'], BUILD_MANIFEST)
+    bones = registry.BoneRegistry(armature, manifest.read_manifest(armature))
+    assert bones.query(module='arm_left', tag='ik', role='HDL') == {'arm_left_ik_HDL'}
+    assert bones.query(side='right') == {'arm_right_ik_HDL'}
+    assert bones.get('arm_left_RST')['module'] == 'arm_left'
+    assert bones.sources('arm_left_ik_HDL') == ['arm_left_RST']
+    assert bones.derived('arm_left_RST') == ['arm_left_ik_HDL']
+
+def test_created_and_renamed_bones_are_indexed():
+    armature = FakeArmature(['arm_left_RST', 'arm_left_ik_HDL'], BUILD_MANIFEST)
+    bones = registry.BoneRegistry(armature, manifest.read_manifest(armature))
+    assert bones.query(role='AUX') == set()
+    bones.add('arm_left_pole_AUX')
+    assert bones.query(role='AUX') == {'arm_left_pole_AUX'}
+    bones.add('arm_left_pole_AUX', 'arm_left')
+    assert bones.query(module='arm_left', role='AUX') == {'arm_left_pole_AUX'}
+    bones.rename('arm_left_RST', 'arm_right_RST')
+    assert bones.query(side='left', role='RST') == set()
+    assert bones.get('arm_right_RST')['module'] == 'arm_left'
+    assert bones.sources('arm_left_ik_HDL') == ['arm_right_RST']
+
+def test_build_session_keeps_one_registry_up_to_date():
+    armature = FakeArmature(['forearm_left_RST'])
+    with populate.BuildSession(armature):
+        bones = registry.bone_registry(armature)
+        assert registry.bone_registry(armature) is bones
+        populate.rename_bone(armature, 'forearm_left_RST', 'forearm_left_part1_RST')
+        assert bones.query(part='forearm', tag='part1') == {'forearm_left_part1_RST'}
@@ -0,0 +1,33 @@
+import os
+import types
+from autorig import rig_cache
+
+class Matrix:
+    def inverted(self):
+        return self
+
+def template_armature():
+    collection = types.SimpleNamespace(objects=[])
+    return types.SimpleNamespace(data=types.SimpleNamespace(bones=[]), matrix_world=Matrix(), users_collection=[collection])
+
+def test_key_changes_with_the_build_code(tmp_path, monkeypatch):
+    source = tmp_path / 'populate.py'
+    source.write_text("def create_bones(): pass\n")
+    monkeypatch.setattr(rig_cache, 'BUILD_MODULES', (types.SimpleNamespace(__file__=str(source)),))
+    armature = template_armature()
+    key = rig_cache.rig_key(armature, {'modules': []}, {})
+    assert rig_cache.rig_key(armature, {'modules': []}, {}) == key
+    source.write_text("def create_bones(): return []\n")
+    assert rig_cache.rig_key(armature, {'modules': []}, {}) != key
+
+def test_key_changes_with_the_options():
+    armature = template_armature()
+    assert rig_cache.rig_key(armature, {'modules': []}, {'lod': 'FULL'}) != rig_cache.rig_key(armature, {'modules': []}, {'lod': 'PROXY'})
+
+def test_evict_removes_the_least_recently_used_rigs(tmp_path):
+    for idx, name in enumerate(('old', 'mid', 'new')):
+        path = tmp_path / (name + '.blend')
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (idx, idx))
+    rig_cache.evict(str(tmp_path), 200)
+    assert sorted(os.listdir(tmp_path)) == ['mid.blend', 'new.blend']
@@ -0,0 +1,49 @@
+import json
+import types
+import pytest
+from autorig import manifest
+from autorig import rigfile
+
+def write_rig(path, version=rigfile.RIGFILE_VERSION):
+    path.write_text(json.dumps({'version': version, 'armature': 'rig', 'armature_data': 'rig', 'bones': {}, 'drivers': [],
+        'objects': {}, 'properties': {}}))
+    return str(path)
+
+def test_rig_files_of_other_versions_are_rejected(tmp_path):
+    assert rigfile.read_rig(write_rig(tmp_path / 'rig.json'))['armature'] == 'rig'
+    with pytest.raises(ValueError, match="version " + str(rigfile.RIGFILE_VERSION + 1)):
+        rigfile.read_rig(write_rig(tmp_path / 'new.json', rigfile.RIGFILE_VERSION + 1))
+    (tmp_path / 'old.json').write_text("{}")
+    with pytest.raises(ValueError):
+        rigfile.read_rig(str(tmp_path / 'old.json'))
+
+def test_populated_armatures_are_refused(tmp_path):
+    armature = {manifest.MANIFEST_PROPERTY: json.dumps({'version': manifest.MANIFEST_VERSION, 'modules': {}})}
+    with pytest.raises(ValueError, match="already populated"):
+        rigfile.import_rig(armature, write_rig(tmp_path / 'rig.json'))
+
+def test_plain_values():
+    assert rigfile.plain_value(0.12345678) == 0.123457
+    assert rigfile.plain_value({'Z', 'X'}) == ['X', 'Z']
+    assert rigfile.plain_value(((1.0, 0.0), (0.0, 1.0))) == [[1.0, 0.0], [0.0, 1.0]]
+    assert rigfile.plain_value(None) is None and rigfile.plain_value('XYZ') == 'XYZ'
+
+class EditBones(list):
+    """Edit bones with foreach_get and foreach_set of flat value lists"""
+
+    def foreach_get(self, attribute, values):
+        for idx, bone in enumerate(self):
+            value = getattr(bone, attribute)
+            size = len(value) if isinstance(value, list) else 1
+            values[idx*size:(idx+1)*size] = value if size > 1 else [value]
+
+    def foreach_set(self, attribute, values):
+        size = len(values) // len(self)
+        for idx, bone in enumerate(self):
+            setattr(bone, attribute, list(values[idx*size:(idx+1)*size]) if size > 1 else values[idx])
+
+def test_bone_vectors_are_written_to_the_bones_of_the_file():
+    edit_bones = EditBones(types.SimpleNamespace(name=name, head=[0.0] * 3, tail=[0.0, 1.0, 0.0], roll=0.0) for name in ('spine', 'neck'))
+    rigfile._write_bone_vectors(edit_bones, {'neck': {'head': [0.0, 1.0, 0.0], 'tail': [0.0, 1.5, 0.0], 'roll': 0.5}})
+    assert edit_bones[1].head == [0.0, 1.0, 0.0] and edit_bones[1].tail == [0.0, 1.5, 0.0] and edit_bones[1].roll == 0.5
+    assert edit_bones[0].tail == [0.0, 1.0, 0.0] and edit_bones[0].roll == 0.0